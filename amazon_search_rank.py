@@ -12,12 +12,17 @@ from __future__ import annotations
 import argparse
 import csv
 import datetime as dt
+import io
+import json
 import logging
-import os
+import signal
 import sys
 import time
+import unicodedata
+from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Set, Tuple, Any
+from urllib.parse import quote_plus
+from typing import IO, Dict, List, Optional, Set, Tuple, Any, Union
 
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchElementException
@@ -28,17 +33,60 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 
+import artifact_store
+import run_report
+import serp_ranking
+import serp_records
+from serp_records import ITEM_TYPE_CODES, RankRow, SerpItem
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
 AMAZON_URL = "https://www.amazon.co.jp/"
+SEARCH_URL = AMAZON_URL + "s?k={keyword}&page={page}"
 # Select all result items, including those in carousels or special sections if they have data-asin
 RESULTS_SELECTOR = ".s-main-slot div[data-asin], .s-main-slot li[data-asin]"
 NEXT_BUTTON_SELECTOR = "a.s-pagination-next"
+# Selectors used by classify_page() to tell non-result pages apart
+CAPTCHA_SELECTOR = "form[action*='validateCaptcha']"
+NO_RESULTS_SELECTOR = ".s-no-results-filler, [data-component-type='s-no-results']"
+DOG_PAGE_SELECTOR = "a[href*='cs_404_link'], a[href*='cs_503_link'], img[alt*='Dogs of Amazon']"
+LOCATION_POPOVER_SELECTOR = "#GLUXZipUpdateInput"
 MAX_PAGES = 3
+# Progressive scroll: stop once item count and page height are stable this long
+SCROLL_STEP_PAUSE = 0.25
+SCROLL_STABLE_SECONDS = 1.0
+SCROLL_MAX_SECONDS = 10.0
+PAGE_LOAD_TIMEOUT = 60
+RESULTS_WAIT_SECONDS = 30
+CAPTCHA_PAUSE_SECONDS = 5
+# Longest one results page can take once started: load, wait, CAPTCHA click and
+# second wait, scroll. The deadline is only checked between pages.
+WORST_PAGE_SECONDS = (
+    PAGE_LOAD_TIMEOUT + 2 * RESULTS_WAIT_SECONDS + CAPTCHA_PAUSE_SECONDS + SCROLL_MAX_SECONDS
+)
 OUTPUT_DIR = Path("@output")
-IMAGES_DIR = OUTPUT_DIR / "images"
 INPUT_FILE = Path("input.csv")
+CRAWL_STATE_FILE = OUTPUT_DIR / "crawl_state.json"
+KEYWORD_TIMINGS_FILE = OUTPUT_DIR / "keyword_timings.json"
+VISIBILITY_INDEX_FILE = OUTPUT_DIR / "visibility_index.idx"
+# Kept free at the end of a --deadline run for the page still in progress and
+# for writing and uploading results
+DEADLINE_RESERVE_SECONDS = WORST_PAGE_SECONDS + 60
+# After SIGTERM, time left for the page in progress before it is abandoned
+# (Cloud Run sends SIGKILL 10 seconds after SIGTERM)
+STOP_GRACE_SECONDS = 6
+# Result files, screenshots and error dumps; cloud_runner swaps in a GcsStore
+ARTIFACT_STORE = artifact_store.LocalStore(OUTPUT_DIR)
+# Counters and phase timings of this run (written as JSON + Prometheus text)
+RUN_REPORT = run_report.RunReport()
+# Browser-side metrics of every processed page (set by --page-metrics)
+PAGE_METRICS: Optional["page_metrics.PageMetricsLog"] = None
+# ASIN -> (keyword, day, best rank, type) of every ranked card (set by --visibility-index)
+VISIBILITY_INDEX: Optional["visibility_index.VisibilityIndex"] = None
+# Browser recycling: restart Chrome after this many keywords or this much RSS
+RECYCLE_EVERY_KEYWORDS = 50
+MAX_BROWSER_MEMORY_MB = 1200
 
 # ---------------------------------------------------------------------------
 # Logging
@@ -54,13 +102,23 @@ LOGGER = logging.getLogger("amazon_rank_tracker")
 # ---------------------------------------------------------------------------
 # Helper Functions
 # ---------------------------------------------------------------------------
-def load_targets(input_path: Path) -> Dict[str, Set[str]]:
-    """Load targets from CSV."""
-    if not input_path.exists():
-        raise FileNotFoundError(f"Input file not found: {input_path}")
+# An input CSV as a local path or as raw bytes (e.g. downloaded from GCS)
+InputSource = Union[Path, bytes]
+
+
+def open_input(source: InputSource) -> IO[str]:
+    """Open an input CSV for csv.DictReader without staging bytes on disk."""
+    if isinstance(source, bytes):
+        return io.StringIO(source.decode("utf-8-sig"), newline="")
+    if not source.exists():
+        raise FileNotFoundError(f"Input file not found: {source}")
+    return source.open("r", encoding="utf-8-sig", newline="")
+
 
+def load_targets(input_path: InputSource) -> Dict[str, Set[str]]:
+    """Load targets from CSV."""
     grouped: Dict[str, Set[str]] = {}
-    with input_path.open("r", encoding="utf-8-sig", newline="") as csv_file:
+    with open_input(input_path) as csv_file:
         reader = csv.DictReader(csv_file)
         if not reader.fieldnames:
             raise ValueError("Header not found in input.csv")
@@ -80,27 +138,121 @@ def load_targets(input_path: Path) -> Dict[str, Set[str]]:
     return grouped
 
 
+def normalize_keyword(keyword: str) -> str:
+    """Canonical search term: NFKC (full/half-width), single spaces, lower-case Latin."""
+    return " ".join(unicodedata.normalize("NFKC", keyword).split()).lower()
+
+
+# tenant -> {searched keyword -> (tenant's own spelling, tenant's ASINs)}
+TenantTargets = Dict[str, Dict[str, Tuple[str, Set[str]]]]
+
+
+def load_tenant_targets(sources: Dict[str, InputSource]) -> Tuple[Dict[str, Set[str]], TenantTargets]:
+    """Merge several tenants' input files so each distinct keyword is scraped once.
+
+    Keywords are merged on normalize_keyword() but searched in the first
+    spelling seen; the merged targets hold the union of every tenant's ASINs.
+    The tenant map keeps each tenant's own spelling and ASINs for
+    fan_out_results(). A tenant whose file cannot be loaded is skipped.
+    """
+    merged: Dict[str, Set[str]] = {}
+    searched: Dict[str, str] = {}  # normalized -> first spelling
+    tenants: TenantTargets = {}
+    for tenant, path in sources.items():
+        try:
+            tenant_targets = load_targets(path)
+        except (OSError, ValueError) as e:
+            LOGGER.error(f"Skipping tenant {tenant}: {e}")
+            continue
+        tenant_map = tenants.setdefault(tenant, {})
+        for keyword, asins in tenant_targets.items():
+            query = searched.setdefault(normalize_keyword(keyword), keyword)
+            merged.setdefault(query, set()).update(asins)
+            spelling, tenant_asins = tenant_map.setdefault(query, (keyword, set()))
+            tenant_asins.update(asins)
+    if not merged:
+        raise ValueError("No valid targets in any tenant input")
+    total = sum(len(tenant_map) for tenant_map in tenants.values())
+    LOGGER.info(f"Merged {total} tenant keywords into {len(merged)} distinct searches.")
+    return merged, tenants
+
+
+def fan_out_results(rows: List[RankRow], tenants: TenantTargets) -> Dict[str, List[RankRow]]:
+    """Split merged rows into each tenant's rows, restoring the tenant's keyword spelling."""
+    by_tenant: Dict[str, List[RankRow]] = {}
+    for tenant, tenant_map in tenants.items():
+        tenant_rows = by_tenant.setdefault(tenant, [])
+        for row in rows:
+            entry = tenant_map.get(row.keyword)
+            if entry is not None and row.asin in entry[1]:
+                tenant_rows.append(RankRow(
+                    row.timestamp, entry[0], row.asin, row.type_code,
+                    row.page, row.rank, row.organic_rank,
+                ))
+    return by_tenant
+
+
+def load_priorities(input_path: InputSource, normalize: bool = False) -> Dict[str, float]:
+    """Read the optional PRIORITY column (default 1.0; highest row wins per keyword)."""
+    priorities: Dict[str, float] = {}
+    with open_input(input_path) as csv_file:
+        for row in csv.DictReader(csv_file):
+            keyword = (row.get("SEARCH TERM") or "").strip()
+            if normalize:
+                keyword = normalize_keyword(keyword)
+            if not keyword:
+                continue
+            try:
+                priority = float((row.get("PRIORITY") or "1").strip())
+            except ValueError:
+                priority = 1.0
+            priorities[keyword] = max(priority, priorities.get(keyword, priority))
+    return priorities
+
+
+def load_backends(input_path: InputSource, normalize: bool = False) -> Dict[str, str]:
+    """Read the optional BACKEND column (selenium / cdp / http); blank cells use --backend."""
+    backends: Dict[str, str] = {}
+    with open_input(input_path) as csv_file:
+        for row in csv.DictReader(csv_file):
+            keyword = (row.get("SEARCH TERM") or "").strip()
+            if normalize:
+                keyword = normalize_keyword(keyword)
+            backend = (row.get("BACKEND") or "").strip().lower()
+            if keyword and backend:
+                backends.setdefault(keyword, backend)
+    return backends
+
+
+# Use a realistic User-Agent (also sent by the plain-HTTP fetch backend)
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+ACCEPT_LANGUAGES = "ja,ja-JP,en-US,en"
+# Chrome flags shared by create_driver() and the chromedriver-less CDP backend
+CHROME_ARGUMENTS = [
+    "--disable-gpu",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--window-size=1920,1080",
+    "--lang=ja-JP",
+    f"--user-agent={USER_AGENT}",
+]
+
+
 def create_driver(headless: bool = True):
     """Create a Chrome driver instance."""
     options = webdriver.ChromeOptions()
     if headless:
         options.add_argument("--headless=new")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--lang=ja-JP")
-    # Use a realistic User-Agent
-    # Use a realistic User-Agent
-    options.add_argument(
-        "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/120.0.0.0 Safari/537.36"
-    )
-    
+    for argument in CHROME_ARGUMENTS:
+        options.add_argument(argument)
+
     # Force language preferences
     prefs = {
-        "intl.accept_languages": "ja,ja-JP,en-US,en",
+        "intl.accept_languages": ACCEPT_LANGUAGES,
         "profile.default_content_setting_values.notifications": 2
     }
     options.add_experimental_option("prefs", prefs)
@@ -109,24 +261,219 @@ def create_driver(headless: bool = True):
         service=Service(ChromeDriverManager().install()),
         options=options,
     )
-    driver.set_page_load_timeout(60)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
     return driver
 
 
-def handle_captcha(driver) -> bool:
-    """Check for CAPTCHA and try to solve it (click button)."""
+def _process_tree_rss_mb(root_pid: int) -> Optional[float]:
+    """Sum VmRSS (MB) of a process and all its descendants using /proc.
+
+    Shared pages are counted once per process, so this over-estimates a little,
+    which is fine for a recycling threshold. Returns None where /proc is missing.
+    """
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    children: Dict[int, List[int]] = {}
+    for stat_file in proc.glob("[0-9]*/stat"):
+        try:
+            # Field 4 (ppid) follows the parenthesised command name
+            ppid = int(stat_file.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(stat_file.parent.name))
+
+    total_kb = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            for line in (proc / str(pid) / "status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total_kb += int(line.split()[1])
+                    break
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+def get_browser_memory_mb(driver) -> Optional[float]:
+    """Estimate the browser's memory footprint in MB.
+
+    Prefers the RSS of the chromedriver process tree (browser + renderers);
+    falls back to the renderer JS heap from CDP Performance.getMetrics.
+    """
+    try:
+        rss = _process_tree_rss_mb(driver.service.process.pid)
+        if rss:
+            return rss
+    except AttributeError:
+        pass
+    try:
+        driver.execute_cdp_cmd("Performance.enable", {})
+        metrics = driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+        heap = next(m["value"] for m in metrics if m["name"] == "JSHeapTotalSize")
+        return heap / (1024 * 1024)
+    except Exception as e:
+        LOGGER.warning(f"Could not sample browser memory: {e}")
+        return None
+
+
+class BrowserWatchdog:
+    """Owns the Chrome driver and recycles it to keep memory bounded.
+
+    Call acquire() before each keyword; it returns a driver, transparently
+    replacing the current one after ``max_keywords`` keywords or once the
+    browser's RSS exceeds ``max_memory_mb``. Cookies (session, delivery
+    location) are carried over to the new browser.
+    """
+
+    def __init__(
+        self,
+        headless: bool = True,
+        max_keywords: int = RECYCLE_EVERY_KEYWORDS,
+        max_memory_mb: float = MAX_BROWSER_MEMORY_MB,
+    ):
+        self.headless = headless
+        self.max_keywords = max_keywords
+        self.max_memory_mb = max_memory_mb
+        self.driver = None
+        self.keywords_since_start = 0
+        self.recycle_count = 0
+
+    def acquire(self):
+        """Return a healthy driver, recycling the current one if needed."""
+        if self.driver is None:
+            self.driver = create_driver(headless=self.headless)
+        elif self._should_recycle():
+            self.recycle()
+        self.keywords_since_start += 1
+        return self.driver
+
+    def _should_recycle(self) -> bool:
+        if self.max_keywords and self.keywords_since_start >= self.max_keywords:
+            LOGGER.info(f"Recycling browser after {self.keywords_since_start} keywords.")
+            return True
+        if self.max_memory_mb:
+            memory_mb = get_browser_memory_mb(self.driver)
+            if memory_mb is not None:
+                LOGGER.info(f"Browser memory: {memory_mb:.0f} MB")
+                if memory_mb > self.max_memory_mb:
+                    LOGGER.info(f"Recycling browser: {memory_mb:.0f} MB > {self.max_memory_mb:.0f} MB.")
+                    return True
+        return False
+
+    def recycle(self) -> None:
+        """Restart Chrome, carrying the Amazon cookies over."""
+        cookies = []
+        try:
+            cookies = self.driver.get_cookies()
+        except WebDriverException as e:
+            LOGGER.warning(f"Could not read cookies before recycling: {e}")
+        self.quit()
+
+        self.driver = create_driver(headless=self.headless)
+        self.keywords_since_start = 0
+        self.recycle_count += 1
+        if cookies:
+            # Cookies can only be set for the domain that is currently loaded
+            self.driver.get(AMAZON_URL)
+            restored = 0
+            for cookie in cookies:
+                cookie.pop("sameSite", None)
+                try:
+                    self.driver.add_cookie(cookie)
+                    restored += 1
+                except WebDriverException:
+                    continue
+            LOGGER.info(f"Browser recycled; restored {restored}/{len(cookies)} cookies.")
+
+    def warm_up(self) -> None:
+        """Start Chrome ahead of time and settle CAPTCHA/location once."""
+        if self.driver is None:
+            self.driver = create_driver(headless=self.headless)
+        self.driver.get(AMAZON_URL)
+        handle_captcha(self.driver)
+        set_location_to_tokyo(self.driver)
+
+    def quit(self) -> None:
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                LOGGER.warning(f"Error while quitting browser: {e}")
+            self.driver = None
+
+
+class PageState(str, Enum):
+    """Coarse classification of the page currently loaded in the browser."""
+    RESULTS = "results"
+    CAPTCHA = "captcha"
+    NO_RESULTS = "no_results"
+    ERROR = "error"
+    DOG_PAGE = "dog_page"
+    LOCATION_POPOVER = "location_popover"
+    OTHER = "other"  # e.g. the home page, or a search page still loading
+
+
+# One in-page probe: checks the URL and a handful of selectors and returns a
+# short state string, so routing never needs to pull driver.page_source.
+PAGE_STATE_SCRIPT = """
+const sel = arguments[0];
+const url = window.location.href;
+if (url.startsWith('chrome-error:')) return 'error';
+if (!document.body) return 'other';  // unloaded mid-navigation
+if (url.indexOf('validateCaptcha') !== -1 || document.querySelector(sel.captcha)) return 'captcha';
+if (document.querySelector(sel.dog)) return 'dog_page';
+const popover = document.querySelector(sel.popover);
+if (popover && popover.offsetParent !== null) return 'location_popover';
+const items = document.querySelectorAll(sel.results);
+for (const el of items) {
+    if ((el.getAttribute('data-asin') || '').trim()) return 'results';
+}
+if (document.querySelector(sel.noResults)) return 'no_results';
+if (document.querySelector('.s-main-slot') && document.readyState === 'complete') return 'no_results';
+return 'other';
+"""
+PAGE_STATE_SELECTORS = {
+    "captcha": CAPTCHA_SELECTOR,
+    "dog": DOG_PAGE_SELECTOR,
+    "popover": LOCATION_POPOVER_SELECTOR,
+    "results": RESULTS_SELECTOR,
+    "noResults": NO_RESULTS_SELECTOR,
+}
+
+
+def classify_page(driver) -> PageState:
+    """Classify the current page with a single execute_script round trip."""
     try:
-        if "validateCaptcha" in driver.page_source:
+        return PageState(driver.execute_script(PAGE_STATE_SCRIPT, PAGE_STATE_SELECTORS))
+    except (WebDriverException, ValueError) as e:
+        LOGGER.warning(f"Failed to classify page: {e}")
+        return PageState.ERROR
+
+
+def handle_captcha(driver, state: Optional[PageState] = None) -> bool:
+    """Check for CAPTCHA and try to solve it (click button).
+
+    Pass an already known ``state`` to skip the classification probe.
+    """
+    try:
+        if state is None:
+            state = classify_page(driver)
+        if state is PageState.CAPTCHA:
             LOGGER.warning("CAPTCHA detected!")
+            RUN_REPORT.count("captchas_seen")
             # Try to find the button "ショッピングを続ける" or similar
             try:
                 # Generic submit button usually works for the simple "Click to continue" captcha
                 button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
                 button.click()
                 LOGGER.info("Clicked CAPTCHA button. Waiting...")
-                time.sleep(5)
+                time.sleep(CAPTCHA_PAUSE_SECONDS)
                 return True
-            except:
+            except Exception:
                 LOGGER.error("Could not find CAPTCHA button.")
     except Exception as e:
         LOGGER.warning(f"Error checking CAPTCHA: {e}")
@@ -149,6 +496,7 @@ def set_location_to_tokyo(driver) -> None:
             LOGGER.warning(f"Could not read location label: {e}")
 
         LOGGER.info("Setting location to Tokyo (100-0001)...")
+        RUN_REPORT.count("location_resets")
         
         # Click location widget
         driver.find_element(By.ID, "nav-global-location-popover-link").click()
@@ -169,7 +517,7 @@ def set_location_to_tokyo(driver) -> None:
         try:
             confirm_btn = driver.find_element(By.CSS_SELECTOR, "#GLUXConfirmClose, [name='glowDoneButton']")
             confirm_btn.click()
-        except:
+        except Exception:
             pass
             
         # Wait for reload
@@ -180,46 +528,85 @@ def set_location_to_tokyo(driver) -> None:
         LOGGER.warning(f"Failed to set location: {e}")
         # Take debug screenshot and HTML for location failure
         try:
-            filename_png = "location_error.png"
-            filename_html = "location_error.html"
-            driver.save_screenshot(filename_png)
-            with open(filename_html, "w", encoding="utf-8") as f:
-                f.write(driver.page_source)
-            
-            bucket_name = os.environ.get("BUCKET_NAME")
-            if bucket_name:
-                from google.cloud import storage
-                client = storage.Client()
-                bucket = client.bucket(bucket_name)
-                
-                blob_png = bucket.blob(f"errors/{filename_png}")
-                blob_png.upload_from_filename(filename_png)
-                
-                blob_html = bucket.blob(f"errors/{filename_html}")
-                blob_html.upload_from_filename(filename_html)
-                
-                LOGGER.info(f"Uploaded location error debug files to gs://{bucket_name}/errors/")
-        except:
+            ARTIFACT_STORE.put_bytes("errors", "location_error.png", driver.get_screenshot_as_png())
+            location = ARTIFACT_STORE.put_bytes(
+                "errors", "location_error.html", driver.page_source.encode("utf-8")
+            )
+            LOGGER.info(f"Saved location error debug files: {location}")
+        except Exception:
             pass
 
 
-def wait_for_results(driver) -> None:
-    """Wait for search results to load."""
-    WebDriverWait(driver, 30).until(
-        EC.presence_of_element_located((By.CSS_SELECTOR, RESULTS_SELECTOR))
-    )
+def wait_for_results(driver, timeout: float = RESULTS_WAIT_SECONDS) -> PageState:
+    """Wait until the search page settles into a routable state and return it.
 
+    Raises TimeoutException if the page is still loading after ``timeout`` seconds.
+    Script errors (the old document unloading after ENTER or a next-page click)
+    count as still loading rather than as an error page.
+    """
+    def settled(d):
+        state = PageState(d.execute_script(PAGE_STATE_SCRIPT, PAGE_STATE_SELECTORS))
+        return state if state is not PageState.OTHER else False
 
-def take_screenshot(driver, keyword: str, page: int) -> None:
-    """Save a full-page screenshot."""
-    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    return WebDriverWait(driver, timeout, ignored_exceptions=(WebDriverException,)).until(settled)
+
+
+# Scroll one viewport and report [result count, page height, viewport bottom]
+SCROLL_STEP_SCRIPT = """
+window.scrollBy(0, window.innerHeight);
+return [
+    document.querySelectorAll(arguments[0]).length,
+    document.documentElement.scrollHeight,
+    window.scrollY + window.innerHeight,
+];
+"""
+
+
+def scroll_until_stable(
+    driver,
+    step_pause: float = SCROLL_STEP_PAUSE,
+    stable_seconds: float = SCROLL_STABLE_SECONDS,
+    max_seconds: float = SCROLL_MAX_SECONDS,
+) -> int:
+    """Scroll through the page one viewport at a time until lazy loading settles.
+
+    Stops once the bottom is reached and both the RESULTS_SELECTOR count and
+    the page height have stayed unchanged for ``stable_seconds`` (or after
+    ``max_seconds``). Returns how many result items appeared while scrolling.
+    """
+    start = time.monotonic()
+    initial_count, last_height, _ = driver.execute_script(SCROLL_STEP_SCRIPT, RESULTS_SELECTOR)
+    last_count = initial_count
+    stable_since = start
+    while True:
+        time.sleep(step_pause)
+        count, height, bottom = driver.execute_script(SCROLL_STEP_SCRIPT, RESULTS_SELECTOR)
+        now = time.monotonic()
+        if count != last_count or height != last_height:
+            last_count, last_height = count, height
+            stable_since = now
+        at_bottom = bottom >= height - 2
+        if at_bottom and now - stable_since >= stable_seconds:
+            break
+        if now - start >= max_seconds:
+            LOGGER.info(f"Scroll wait capped at {max_seconds:.0f}s.")
+            break
+    lazy_items = last_count - initial_count
+    LOGGER.info(f"Scrolled page in {time.monotonic() - start:.1f}s; {lazy_items} lazy items loaded.")
+    return lazy_items
+
+
+def screenshot_filename(keyword: str, page: int) -> str:
     safe_keyword = "".join(c for c in keyword if c.isalnum() or c in (' ', '-', '_')).strip()
-    filename = f"{dt.datetime.now():%Y%m%d_%H%M%S}_{safe_keyword}_{page}.png"
-    filepath = IMAGES_DIR / filename
+    return f"{dt.datetime.now():%Y%m%d_%H%M%S}_{safe_keyword}_{page}.png"
+
+
+def take_screenshot(driver, keyword: str, page: int) -> None:
+    """Save a full-page screenshot to the artifact store."""
+    filename = screenshot_filename(keyword, page)
     try:
         # 1. Scroll to bottom to trigger lazy loading
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)
+        scroll_until_stable(driver)
         
         # 2. Get full page dimensions
         total_width = driver.execute_script("return document.body.offsetWidth")
@@ -231,8 +618,10 @@ def take_screenshot(driver, keyword: str, page: int) -> None:
         driver.set_window_size(total_width, total_height)
         time.sleep(1) # Wait for layout update
         
-        driver.save_screenshot(str(filepath))
-        LOGGER.info(f"Full-page screenshot saved: {filepath}")
+        with RUN_REPORT.phase("screenshot"):
+            location = ARTIFACT_STORE.put_bytes("images", filename, driver.get_screenshot_as_png())
+        RUN_REPORT.count("screenshots_taken")
+        LOGGER.info(f"Full-page screenshot saved: {location}")
         
     except Exception as e:
         LOGGER.warning(f"Failed to take screenshot: {e}")
@@ -288,16 +677,15 @@ def get_item_type(element, sponsored_label_cache=None) -> str:
                         # Only consider short text (single word/phrase)
                         if len(label_text) < 50 and label_text.strip():
                             label_positions.append((label.location['y'], label_text))
-                    except:
+                    except Exception:
                         continue
-            except:
+            except Exception:
                 label_positions = []
         
         # Check if any label is within 200px
-        for label_y, label_text in label_positions:
-            distance = abs(label_y - item_y)
-            if distance < 200:
-                return "Sponsored"
+        label_ys = sorted(label_y for label_y, _ in label_positions)
+        if serp_ranking.near_sponsored_label(item_y, label_ys):
+            return "Sponsored"
                 
     except Exception:
         pass
@@ -312,11 +700,17 @@ def process_page(
     driver, 
     keyword: str, 
     page: int, 
-    target_asins: Set[str], 
+    target_asins: Optional[Set[str]], 
     cumulative_offset: int,
-    take_shots: bool
-) -> Tuple[List[Dict[str, Any]], int]:
-    """Process a single page of results."""
+    take_shots: bool,
+    index_cards: bool = True,
+) -> Tuple[List[RankRow], int]:
+    """Process a single page of results.
+
+    ``target_asins=None`` keeps a row for every ranked card on the page. Every
+    card also goes to VISIBILITY_INDEX unless ``index_cards`` is False (the
+    caller's ranks are not final yet).
+    """
     
     # Cache sponsored labels BEFORE screenshot (before any scrolling)
     # This ensures we capture labels at the top of the page
@@ -336,7 +730,7 @@ def process_page(
                 # Only consider short text (single word/phrase)
                 if len(label_text) < 50 and label_text.strip():
                     sponsored_label_cache.append((label.location['y'], label_text))
-            except:
+            except Exception:
                 continue
     except Exception as e:
         LOGGER.warning(f"Failed to cache sponsored labels: {e}")
@@ -388,7 +782,7 @@ def process_page(
             # But simpler: check if it intersects with the main slot X-range.
             
             # Also skip very small items (thumbnails in filters, history, etc.)
-            if width < 50 or height < 50:
+            if width < serp_ranking.MIN_CARD_SIZE or height < serp_ranking.MIN_CARD_SIZE:
                 continue
 
             # X-coordinate check: 
@@ -409,194 +803,983 @@ def process_page(
             # "Amazon Influencer" might be inside too.
             # Sidebars are usually outside .s-main-slot.
             
-            valid_items.append({
-                'element': el,
-                'asin': asin.strip().upper(),
-                'y': y,
-                'x': x
-            })
+            valid_items.append(SerpItem(asin.strip().upper(), x, y, el))
         except Exception:
             continue
 
     # Sort by Y, then X (for items in the same row)
-    valid_items.sort(key=lambda k: (k['y'], k['x']))
+    serp_ranking.sort_items(valid_items)
 
     # 3. Deduplicate Nested Items
-    # Sometimes a container and its child both have data-asin. We want the outermost (or just one).
-    # Since we sorted by Y, parents usually come before or at similar Y. 
-    # A simple heuristic: if we see the exact same ASIN at nearly the same position, skip.
-    # Or better: check if an element is inside another. 
-    # For performance, we'll assume that `div[data-asin]` usually represents distinct cards.
-    # We will just deduplicate by (ASIN, approximate_position) to avoid double counting the exact same visual card.
-    
-    unique_items = []
-    seen_positions = [] # Store (asin, x, y)
-    
-    for item in valid_items:
-        # Check if this is a duplicate of a recently added item (e.g. same ASIN within 50px)
-        is_dup = False
-        for seen in seen_positions:
-            if seen[0] == item['asin'] and abs(seen[1] - item['y']) < 50 and abs(seen[2] - item['x']) < 50:
-                is_dup = True
-                break
-        
-        if not is_dup:
-            unique_items.append(item)
-            seen_positions.append((item['asin'], item['y'], item['x']))
+    # Sometimes a container and its child both have data-asin: keep one card
+    # per ASIN and approximate position (within 50px).
+    unique_items = serp_ranking.dedupe_items(valid_items)
 
     LOGGER.info(f"Found {len(unique_items)} visible items on page {page}")
 
-    results = []
-    position_counter = 0
-    organic_counter = 0
-    items_on_page = 0
-
-    for item_data in unique_items:
-        item = item_data['element']
-        asin = item_data['asin']
-        
-        items_on_page += 1
-        position_counter += 1
-        
-        item_type = get_item_type(item, sponsored_label_cache)
-        
-        if item_type == "Organic":
-            organic_counter += 1
-        
-        if asin in target_asins:
-            cumulative_rank = cumulative_offset + position_counter
-            cumulative_organic_rank = (
-                cumulative_offset + organic_counter if item_type == "Organic" else ""
-            )
-            
-            LOGGER.info(f"Found {asin} (Type: {item_type}) at Rank {cumulative_rank}")
-            
-            results.append({
-                "timestamp": dt.datetime.now().isoformat(timespec="seconds"),
-                "keyword": keyword,
-                "asin": asin,
-                "type": item_type,
-                "page": page,
-                "rank": cumulative_rank,
-                "organic_rank": cumulative_organic_rank,
-            })
+    type_codes = [
+        ITEM_TYPE_CODES[get_item_type(item.element, sponsored_label_cache)]
+        for item in unique_items
+    ]
+    timestamp = int(time.time())
+    results, items_on_page = serp_ranking.rank_page(
+        unique_items, type_codes, keyword, page, target_asins, cumulative_offset, timestamp
+    )
+    if VISIBILITY_INDEX is not None and index_cards:
+        VISIBILITY_INDEX.record(
+            keyword, timestamp, [item.asin for item in unique_items], type_codes, cumulative_offset + 1
+        )
+    if target_asins is not None:
+        for row in results:
+            LOGGER.info(f"Found {row.asin} (Type: {row.type}) at Rank {row.rank}")
 
+    RUN_REPORT.count("pages_fetched")
+    if PAGE_METRICS is not None:
+        PAGE_METRICS.record(driver, keyword, page)
     return results, items_on_page
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Amazon Rank Tracker (Selenium)")
-    parser.add_argument("--screenshot", action="store_true", help="Take screenshots of search results")
-    parser.add_argument("--pages", type=int, default=MAX_PAGES, help="Number of pages to scan")
-    args = parser.parse_args()
+# ---------------------------------------------------------------------------
+# Batched extraction (one round trip per page, no WebElements)
+# ---------------------------------------------------------------------------
+SPONSORED_PROXIMITY_THRESHOLD = serp_ranking.SPONSORED_PROXIMITY_THRESHOLD
+
+# Returns every data-asin card as [asin, x, y, width, height, sponsored_hint]
+# plus the page Y of every visible short "スポンサー"/"Sponsored" label.
+EXTRACT_ITEMS_SCRIPT = """
+const items = [];
+for (const el of document.querySelectorAll(arguments[0])) {
+    const asin = (el.getAttribute('data-asin') || '').trim();
+    if (!asin || !el.getClientRects().length) continue;
+    const r = el.getBoundingClientRect();
+    let hint = (el.getAttribute('data-component-type') || '').toLowerCase().includes('sponsored');
+    if (!hint) {
+        for (const b of el.querySelectorAll('span[aria-label], .s-label-popover')) {
+            const t = (b.getAttribute('aria-label') || b.innerText || '').toLowerCase();
+            if (t.includes('sponsored') || t.includes('スポンサー')) { hint = true; break; }
+        }
+    }
+    items.push([asin.toUpperCase(), r.left + window.scrollX, r.top + window.scrollY, r.width, r.height, hint]);
+}
+const labels = [];
+const found = document.evaluate(
+    "//*[contains(text(), 'スポンサー') or contains(text(), 'Sponsored')]",
+    document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+for (let i = 0; i < found.snapshotLength; i++) {
+    const node = found.snapshotItem(i);
+    if (!node.getClientRects().length) continue;
+    const text = node.innerText || '';
+    if (text.trim() && text.length < 50) {
+        labels.push(node.getBoundingClientRect().top + window.scrollY);
+    }
+}
+return {items: items, labels: labels};
+"""
+
+
+def rank_items(
+    raw_items: List[List[Any]],
+    label_ys: List[float],
+    keyword: str,
+    page: int,
+    target_asins: Optional[Set[str]],
+    cumulative_offset: int,
+    timestamp: int,
+) -> Tuple[List[RankRow], int]:
+    """Rank the plain-data output of EXTRACT_ITEMS_SCRIPT like process_page()."""
+    min_size = serp_ranking.MIN_CARD_SIZE
+    items = [
+        SerpItem(asin, x, y, sponsored_hint=hint)
+        for asin, x, y, width, height, hint in raw_items
+        if width >= min_size and height >= min_size
+    ]
+    serp_ranking.sort_items(items)
+    unique_items = serp_ranking.dedupe_items(items)
+    type_codes = serp_ranking.classify_items(unique_items, label_ys)
+    if VISIBILITY_INDEX is not None:
+        VISIBILITY_INDEX.record(
+            keyword, timestamp, [item.asin for item in unique_items], type_codes, cumulative_offset + 1
+        )
+    return serp_ranking.rank_page(
+        unique_items, type_codes, keyword, page, target_asins, cumulative_offset, timestamp
+    )
+
+
+def prepare_session(driver) -> None:
+    """Load the home page and settle CAPTCHA and delivery location."""
+    if PAGE_METRICS is not None:
+        try:
+            PAGE_METRICS.prepare(driver)
+        except WebDriverException as e:
+            LOGGER.warning(f"Failed to prepare page metrics: {e}")
+    driver.get(AMAZON_URL)
+
+    # Check and solve CAPTCHA if present
+    handle_captcha(driver, classify_page(driver))
+
+    # Ensure location is set to Japan/Tokyo
+    set_location_to_tokyo(driver)
+
+
+def open_search(driver, keyword: str) -> bool:
+    """Load the home page, settle CAPTCHA/location and submit the search.
+
+    Returns False (after saving debug files) if the search box never appears.
+    """
+    prepare_session(driver)
 
     try:
-        targets = load_targets(INPUT_FILE)
-    except Exception as e:
-        LOGGER.error(f"Initialization failed: {e}")
-        sys.exit(1)
+        search_box = WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.ID, "twotabsearchtextbox"))
+        )
+        search_box.clear()
+        search_box.send_keys(keyword)
+        search_box.send_keys(Keys.ENTER)
+        return True
+    except TimeoutException:
+        LOGGER.error(f"Search box not found for {keyword} (page state: {classify_page(driver).value})")
 
-    all_results = []
-    
-    driver = create_driver(headless=True)
+        # Take debug screenshot on error
+        try:
+            timestamp = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename_png = f"error_{timestamp}_{keyword}.png"
+            filename_html = f"error_{timestamp}_{keyword}.html"
+
+            location = ARTIFACT_STORE.put_bytes("errors", filename_png, driver.get_screenshot_as_png())
+            ARTIFACT_STORE.put_bytes("errors", filename_html, driver.page_source.encode("utf-8"))
+            LOGGER.info(f"Saved error debug files: {location}")
+        except Exception as e:
+            LOGGER.error(f"Failed to save error debug info: {e}")
+        return False
+
+
+def open_next_page_tab(driver) -> Optional[str]:
+    """Start loading the next results page in a background tab.
+
+    The driver stays focused on the current tab. Returns the new tab's window
+    handle, or None when no next page link is available (last page, or no
+    pagination strip); the caller checks the button to tell those apart.
+    """
     try:
-        for keyword, asins in targets.items():
-            LOGGER.info(f"Searching for: {keyword}")
-            driver.get(AMAZON_URL)
-            
-            # Check and solve CAPTCHA if present
-            handle_captcha(driver)
-            
-            # Ensure location is set to Japan/Tokyo
-            set_location_to_tokyo(driver)
-            
+        next_btn = driver.find_element(By.CSS_SELECTOR, NEXT_BUTTON_SELECTOR)
+    except NoSuchElementException:
+        return None
+    href = next_btn.get_attribute("href")
+    if "s-pagination-disabled" in (next_btn.get_attribute("class") or "") or not href:
+        return None
+    before = set(driver.window_handles)
+    driver.execute_script("window.open(arguments[0], '_blank');", href)
+    opened = [handle for handle in driver.window_handles if handle not in before]
+    return opened[0] if opened else None
+
+
+def swap_to_tab(driver, handle: str) -> None:
+    """Close the current tab and continue in ``handle``."""
+    driver.close()
+    driver.switch_to.window(handle)
+
+
+def close_other_tabs(driver) -> None:
+    """Close every tab except the focused one (e.g. an unused prefetch)."""
+    current = driver.current_window_handle
+    for handle in driver.window_handles:
+        if handle != current:
+            driver.switch_to.window(handle)
+            driver.close()
+    driver.switch_to.window(current)
+
+
+def scrape_keyword(
+    driver,
+    keyword: str,
+    asins: Optional[Set[str]],
+    pages: int = MAX_PAGES,
+    take_shots: bool = False,
+    pipeline: bool = False,
+    deadline: Optional["RunDeadline"] = None,
+    pages_reached: Optional[Set[int]] = None,
+) -> List[RankRow]:
+    """Search one keyword and return the rank rows found for its target ASINs.
+
+    Pass ``asins=None`` to get a row for every ranked card. With ``pipeline``
+    the next page loads in a background tab while the current one is
+    extracted, and the tabs swap afterwards. Once ``deadline`` expires no
+    further page is processed; rows of finished pages are still returned.
+
+    ``pages_reached`` collects the pages whose cards are known: processed
+    pages, plus the pages after a no-results page or the last page. Pages
+    missing from it failed (CAPTCHA, unexpected page, error), so an empty
+    result for them means nothing.
+    """
+    results: List[RankRow] = []
+    LOGGER.info(f"Searching for: {keyword}")
+    RUN_REPORT.count("keywords_attempted")
+    started = time.monotonic()
+    with RUN_REPORT.phase("open_search"):
+        opened = open_search(driver, keyword)
+    if not opened:
+        RUN_REPORT.count("keywords_failed")
+        return results
+
+    cumulative_offset = 0
+    reached = False  # a results or no-results page was seen
+    fetched = 0  # pages ranked
+    try:
+        for page in range(1, pages + 1):
+            if page > 1 and deadline is not None and deadline.expired():
+                LOGGER.warning(f"Deadline reached; stopping {keyword} before page {page}.")
+                break
+            LOGGER.info(f"Processing page {page}...")
             try:
-                search_box = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.ID, "twotabsearchtextbox"))
-                )
-                search_box.clear()
-                search_box.send_keys(keyword)
-                search_box.send_keys(Keys.ENTER)
-            except TimeoutException:
-                LOGGER.error(f"Search box not found for {keyword}")
-                
-                # Take debug screenshot on error
-                try:
-                    timestamp = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename_png = f"error_{timestamp}_{keyword}.png"
-                    filename_html = f"error_{timestamp}_{keyword}.html"
-                    
-                    driver.save_screenshot(filename_png)
-                    with open(filename_html, "w", encoding="utf-8") as f:
-                        f.write(driver.page_source)
-                    
-                    LOGGER.info(f"Saved error debug files: {filename_png}")
-                    
-                    # Upload to GCS if bucket is set
-                    bucket_name = os.environ.get("BUCKET_NAME")
-                    if bucket_name:
-                        from google.cloud import storage
-                        client = storage.Client()
-                        bucket = client.bucket(bucket_name)
-                        
-                        blob_png = bucket.blob(f"errors/{filename_png}")
-                        blob_png.upload_from_filename(filename_png)
-                        
-                        blob_html = bucket.blob(f"errors/{filename_html}")
-                        blob_html.upload_from_filename(filename_html)
-                        
-                        LOGGER.info(f"Uploaded error debug files to gs://{bucket_name}/errors/")
-                except Exception as e:
-                    LOGGER.error(f"Failed to save error debug info: {e}")
-                continue
+                with RUN_REPORT.phase("wait"):
+                    state = wait_for_results(driver)
+                    if state is PageState.CAPTCHA and handle_captcha(driver, state):
+                        state = wait_for_results(driver)
+                if state is PageState.NO_RESULTS:
+                    reached = True
+                    if pages_reached is not None:
+                        pages_reached.update(range(page, pages + 1))
+                    LOGGER.info(f"No results for {keyword} on page {page}.")
+                    break
+                if state is not PageState.RESULTS:
+                    LOGGER.error(f"Unexpected page state on page {page}: {state.value}")
+                    break
 
-            cumulative_offset = 0
-            for page in range(1, args.pages + 1):
-                LOGGER.info(f"Processing page {page}...")
-                try:
-                    wait_for_results(driver)
-                    # Scroll down to ensure lazy-loaded elements (like bottom ads) are rendered
-                    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(2) 
-                    
+                # Scroll down to ensure lazy-loaded elements (like bottom ads) are rendered
+                with RUN_REPORT.phase("scroll"):
+                    scroll_until_stable(driver)
+
+                # The pagination strip renders late, so look for it once the page settled
+                prefetch_handle = None
+                if pipeline and page < pages:
+                    prefetch_handle = open_next_page_tab(driver)
+
+                with RUN_REPORT.phase("extract"):
                     page_results, items_count = process_page(
-                        driver, keyword, page, asins, cumulative_offset, args.screenshot
+                        driver, keyword, page, asins, cumulative_offset, take_shots
                     )
-                    all_results.extend(page_results)
-                    cumulative_offset += items_count
-                    
-                    # Pagination
-                    if page < args.pages:
-                        try:
+                reached = True
+                fetched += 1
+                results.extend(page_results)
+                cumulative_offset += items_count
+                if pages_reached is not None:
+                    pages_reached.add(page)
+
+                # Pagination
+                if page < pages:
+                    if prefetch_handle is not None:
+                        swap_to_tab(driver, prefetch_handle)
+                        continue
+                    # No prefetch tab: the button check below tells the last page from a failure
+                    try:
+                        with RUN_REPORT.phase("paginate"):
                             next_btn = driver.find_element(By.CSS_SELECTOR, NEXT_BUTTON_SELECTOR)
                             if "s-pagination-disabled" in next_btn.get_attribute("class"):
                                 LOGGER.info("No more pages.")
+                                if pages_reached is not None:
+                                    pages_reached.update(range(page + 1, pages + 1))
                                 break
                             driver.execute_script("arguments[0].click();", next_btn)
                             time.sleep(2)
-                        except NoSuchElementException:
-                            LOGGER.info("Next button not found.")
-                            break
-                except Exception as e:
-                    LOGGER.error(f"Error on page {page}: {e}")
+                    except NoSuchElementException:
+                        LOGGER.info("Next button not found.")
+                        break
+            except Exception as e:
+                LOGGER.error(f"Error on page {page}: {e}")
+                break
+    finally:
+        if pipeline:
+            try:
+                close_other_tabs(driver)
+            except WebDriverException as e:
+                LOGGER.warning(f"Failed to close prefetch tabs: {e}")
+        RUN_REPORT.keyword_finished(keyword, reached, fetched)
+        RUN_REPORT.observe("keyword", time.monotonic() - started)
+    return results
+
+
+def search_url(keyword: str, page: int) -> str:
+    return SEARCH_URL.format(keyword=quote_plus(keyword), page=page)
+
+
+def scrape_keyword_parallel(
+    driver,
+    keyword: str,
+    asins: Optional[Set[str]],
+    pages: int = MAX_PAGES,
+    take_shots: bool = False,
+) -> List[RankRow]:
+    """Load pages 1..``pages`` of a keyword in separate tabs at once.
+
+    Each page is extracted on its own with a zero offset; cumulative ranks are
+    rebuilt afterwards from the per-page item counts, so wall-clock time is
+    close to the slowest page rather than the sum of all pages. With
+    VISIBILITY_INDEX set every card is kept until then, so the index gets
+    the rebuilt ranks.
+    """
+    LOGGER.info(f"Searching for: {keyword} ({pages} pages in parallel)")
+    RUN_REPORT.count("keywords_attempted")
+    started = time.monotonic()
+    with RUN_REPORT.phase("open_search"):
+        prepare_session(driver)
+
+    # Page 1 stays in the current tab; later pages start loading in new tabs
+    handles = [driver.current_window_handle]
+    for page in range(2, pages + 1):
+        before = set(driver.window_handles)
+        driver.execute_script("window.open(arguments[0], '_blank');", search_url(keyword, page))
+        opened = [handle for handle in driver.window_handles if handle not in before]
+        if opened:
+            handles.append(opened[0])
+    driver.get(search_url(keyword, 1))
+
+    page_rows: List[List[RankRow]] = []
+    page_counts: List[int] = []
+    reached = False
+    indexing = VISIBILITY_INDEX is not None
+    try:
+        for page, handle in enumerate(handles, start=1):
+            driver.switch_to.window(handle)
+            try:
+                with RUN_REPORT.phase("wait"):
+                    state = wait_for_results(driver)
+                    if state is PageState.CAPTCHA and handle_captcha(driver, state):
+                        state = wait_for_results(driver)
+                if state is PageState.NO_RESULTS:
+                    reached = True
+                if state is not PageState.RESULTS:
+                    LOGGER.info(f"Page {page} of {keyword} is {state.value}; stopping there.")
                     break
-                    
+                with RUN_REPORT.phase("scroll"):
+                    scroll_until_stable(driver)
+                with RUN_REPORT.phase("extract"):
+                    rows, items_count = process_page(
+                        driver, keyword, page, None if indexing else asins, 0, take_shots,
+                        index_cards=False,
+                    )
+                reached = True
+            except Exception as e:
+                LOGGER.error(f"Error on page {page}: {e}")
+                break
+            page_rows.append(rows)
+            page_counts.append(items_count)
+    finally:
+        driver.switch_to.window(handles[0])
+        close_other_tabs(driver)
+        RUN_REPORT.keyword_finished(keyword, reached, len(page_rows))
+        RUN_REPORT.observe("keyword", time.monotonic() - started)
+
+    # Rebuild cumulative ranks exactly as the sequential loop would have
+    results: List[RankRow] = []
+    cumulative_offset = 0
+    for rows, items_count in zip(page_rows, page_counts):
+        for row in rows:
+            row.rank += cumulative_offset
+            if row.organic_rank:
+                row.organic_rank += cumulative_offset
+        results.extend(rows)
+        cumulative_offset += items_count
+    if indexing:
+        VISIBILITY_INDEX.add_rows(results)
+        if asins is not None:
+            results = [row for row in results if row.asin in asins]
+    return results
+
+
+def scrape_for_args(
+    driver,
+    keyword: str,
+    asins: Optional[Set[str]],
+    args,
+    pages: Optional[int] = None,
+    deadline: Optional["RunDeadline"] = None,
+) -> List[RankRow]:
+    """Scrape one keyword with the page-fetch mode chosen on the command line.
+
+    ``pages`` overrides ``--pages`` (e.g. with an adaptive per-keyword depth).
+    """
+    pages = pages or args.pages
+    if args.parallel_pages:
+        return scrape_keyword_parallel(driver, keyword, asins, pages, args.screenshot)
+    return scrape_keyword(driver, keyword, asins, pages, args.screenshot, args.pipeline, deadline)
+
+
+def write_results(
+    results: List[RankRow],
+    subdir: str = "",
+    prefix: str = "amazon_ranks",
+    output_format: str = "csv",
+    partial: Optional[Dict[str, Any]] = None,
+) -> Optional[str]:
+    """Write rank rows to a timestamped csv/jsonl/bin artifact and return its location (None if empty).
+
+    ``subdir`` (e.g. a tenant name) nests the file below the data location.
+    ``partial`` is stored next to it as ``<file>.partial`` for runs that were cut short.
+    """
+    if not results:
+        LOGGER.warning("No results found.")
+        return None
+    name = f"{prefix}_{dt.datetime.now():%Y%m%d_%H%M%S}.{output_format}"
+    if subdir:
+        name = f"{subdir}/{name}"
+    with ARTIFACT_STORE.open_write("data", name) as stream:
+        serp_records.DUMPERS[output_format](results, stream)
+    location = ARTIFACT_STORE.location("data", name)
+    if partial is not None:
+        marker = json.dumps(partial, ensure_ascii=False).encode("utf-8")
+        ARTIFACT_STORE.put_bytes("data", f"{name}.partial", marker)
+        LOGGER.warning(f"Saved partial results to {location} ({partial['reason']})")
+    else:
+        LOGGER.info(f"Saved results to {location}")
+    return location
+
+
+def write_page_metrics(records: List["page_metrics.PageMetrics"]) -> Optional[str]:
+    """Write per-page browser metrics next to the rank files (amazon_page_metrics_*.csv)."""
+    import page_metrics
+
+    if not records:
+        return None
+    name = f"amazon_page_metrics_{dt.datetime.now():%Y%m%d_%H%M%S}.csv"
+    with ARTIFACT_STORE.open_write("data", name) as stream:
+        page_metrics.dump_csv(records, stream)
+    location = ARTIFACT_STORE.location("data", name)
+    LOGGER.info(f"Saved metrics of {len(records)} pages to {location}")
+    return location
+
+
+def write_run_report(report: run_report.RunReport, textfile: Optional[Path] = None) -> None:
+    """Write the run summary as run_report_*.json and run_report_*.prom next to the rank files.
+
+    ``textfile`` additionally (atomically) replaces a local Prometheus file,
+    e.g. one read by node_exporter's textfile collector.
+    """
+    stamp = f"{dt.datetime.now():%Y%m%d_%H%M%S}"
+    prometheus = report.to_prometheus()
+    ARTIFACT_STORE.put_bytes("data", f"run_report_{stamp}.json", report.to_json().encode("utf-8"))
+    location = ARTIFACT_STORE.put_bytes("data", f"run_report_{stamp}.prom", prometheus.encode("utf-8"))
+    LOGGER.info(f"Saved run report to {location} (and .json)")
+    if textfile is not None:
+        textfile.parent.mkdir(parents=True, exist_ok=True)
+        staging = textfile.with_name(textfile.name + ".tmp")
+        staging.write_text(prometheus, encoding="utf-8")
+        staging.replace(textfile)
+
+
+def select_targets(serp_rows: List[RankRow], targets: Dict[str, Set[str]]) -> List[RankRow]:
+    """Pick the rows of each keyword's target ASINs out of full-SERP rows."""
+    return [
+        row for row in serp_rows
+        if row.asin in targets.get(row.keyword, ())
+    ]
+
+
+def load_serp_rows(paths: List[Path]) -> List[RankRow]:
+    """Read stored full-SERP files (csv, jsonl or bin)."""
+    rows: List[RankRow] = []
+    for path in paths:
+        rows.extend(serp_records.read_rows(path))
+    LOGGER.info(f"Loaded {len(rows)} SERP rows from {len(paths)} file(s).")
+    return rows
+
+
+def plan_pages(targets: Dict[str, Set[str]], args) -> Dict[str, int]:
+    """Per-keyword page depth: adaptive from history with --adaptive-pages, else --pages."""
+    if not args.adaptive_pages:
+        return {keyword: args.pages for keyword in targets}
+    import crawl_planner
+    import rank_history
+    history = rank_history.load_history(days=args.history_days)
+    return crawl_planner.plan_page_depths(targets, history, args.pages)
+
+
+class RunDeadline:
+    """Wall-clock budget of one run, checked between keywords and pages.
+
+    ``seconds=None`` never expires. DEADLINE_RESERVE_SECONDS are held back
+    so a page started just before expiry can finish and results can still be
+    written and uploaded before a hard job timeout.
+    ``skipped`` collects the keywords the deadline kept from running or cut
+    short; cancel() (on a stop signal) expires the deadline at once.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, reserve: float = DEADLINE_RESERVE_SECONDS):
+        self.expires_at = time.monotonic() + seconds - reserve if seconds else None
+        self.skipped: Set[str] = set()
+        self.cancelled: Optional[str] = None
+
+    def cancel(self, reason: str) -> None:
+        self.cancelled = reason
+        self.expires_at = time.monotonic()
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def partial_marker(self) -> Optional[Dict[str, Any]]:
+        """What the run left out, or None when it covered every keyword."""
+        if self.cancelled is None and not self.skipped:
+            return None
+        return {
+            "reason": self.cancelled or "deadline",
+            "unscraped_keywords": sorted(self.skipped),
+        }
+
+
+class RunCancelled(BaseException):
+    """The grace period after a stop signal ran out; the page in progress is abandoned.
+
+    A BaseException, like KeyboardInterrupt: it is raised asynchronously from
+    the SIGALRM handler, so the ``except Exception`` handlers on the scrape
+    path must not swallow it and carry on with the page.
+    """
+
+
+def install_stop_handlers(deadline: RunDeadline, grace_seconds: float = STOP_GRACE_SECONDS) -> None:
+    """Turn SIGTERM/SIGINT into a graceful stop of the batch run.
+
+    The first signal cancels ``deadline`` so no new keyword or page starts;
+    if the current page is still running ``grace_seconds`` later, RunCancelled
+    is raised in the main thread to abandon it. A second Ctrl-C stops hard.
+    """
+    def on_grace_expired(signum, frame):
+        raise RunCancelled(f"no progress within {grace_seconds:.0f}s of {deadline.cancelled}")
+
+    def on_stop(signum, frame):
+        name = signal.Signals(signum).name
+        if deadline.cancelled is not None:
+            if signum == signal.SIGINT:
+                raise KeyboardInterrupt
+            return
+        deadline.cancel(name)
+        LOGGER.warning(f"{name} received; finishing the current page within {grace_seconds:.0f}s.")
+        if hasattr(signal, "SIGALRM") and grace_seconds > 0:
+            signal.signal(signal.SIGALRM, on_grace_expired)
+            signal.setitimer(signal.ITIMER_REAL, grace_seconds)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, on_stop)
+
+
+def disarm_stop_timer() -> None:
+    """Cancel a pending grace timer so flushing results is never interrupted."""
+    if hasattr(signal, "SIGALRM"):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def run_sequential(
+    targets: Dict[str, Set[str]],
+    args,
+    page_plan: Optional[Dict[str, int]] = None,
+    deadline: Optional[RunDeadline] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[List[RankRow], List[RankRow]]:
+    """Scrape keywords one by one in a recycled Chrome; returns (target rows, SERP rows).
+
+    Each keyword's duration is folded into ``timings`` (seconds per page).
+    """
+    import crawl_planner
+
+    page_plan = page_plan or plan_pages(targets, args)
+    all_results: List[RankRow] = []
+    serp_rows: List[RankRow] = []
+
+    watchdog = BrowserWatchdog(
+        headless=True, max_keywords=args.recycle_every, max_memory_mb=args.max_browser_mb
+    )
+    keywords = list(targets)
+    done = 0
+    try:
+        for done, keyword in enumerate(keywords):
+            if deadline is not None and deadline.expired():
+                deadline.skipped.update(keywords[done:])
+                LOGGER.warning(f"Deadline reached; {len(keywords) - done} keyword(s) left unscraped.")
+                break
+            asins = targets[keyword]
+            driver = watchdog.acquire()
+            started = time.monotonic()
+            if args.full_serp:
+                keyword_rows = scrape_for_args(
+                    driver, keyword, None, args, page_plan[keyword], deadline
+                )
+                serp_rows.extend(keyword_rows)
+                all_results.extend(select_targets(keyword_rows, {keyword: asins}))
+            else:
+                all_results.extend(
+                    scrape_for_args(driver, keyword, asins, args, page_plan[keyword], deadline)
+                )
+            if deadline is not None and deadline.expired():
+                # May have been cut before its last page
+                deadline.skipped.add(keyword)
+            elif timings is not None:
+                crawl_planner.update_timing(
+                    timings, keyword, time.monotonic() - started,
+                    RUN_REPORT.keyword_pages.get(keyword, 0),  # pages actually ranked
+                )
+    except RunCancelled as e:
+        LOGGER.warning(f"Abandoned {keywords[done]}: {e}")
+        if deadline is not None:
+            deadline.skipped.update(keywords[done:])
+    finally:
+        disarm_stop_timer()
+        watchdog.quit()
+    return all_results, serp_rows
+
+
+def warn_ignored_flags(args, mode: str) -> None:
+    """Log the per-page flags only the sequential Selenium path honours."""
+    ignored = [
+        flag for flag, value in (
+            ("--screenshot", args.screenshot),
+            ("--pipeline", args.pipeline),
+            ("--parallel-pages", args.parallel_pages),
+        ) if value
+    ]
+    if ignored:
+        LOGGER.warning(f"{', '.join(ignored)} not supported with {mode}; ignored")
+
+
+def run_in_contexts(
+    targets: Dict[str, Set[str]],
+    args,
+    page_plan: Optional[Dict[str, int]] = None,
+    deadline: Optional[RunDeadline] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[List[RankRow], List[RankRow]]:
+    """Scrape keywords concurrently in isolated contexts of one Chrome."""
+    import browser_contexts
+    import crawl_planner
+
+    warn_ignored_flags(args, "--contexts")
+    page_plan = page_plan or plan_pages(targets, args)
+    driver = create_driver(headless=True)
+    manager = browser_contexts.ContextSessionManager(driver, args.contexts)
+    try:
+        scrape_targets = {k: None for k in targets} if args.full_serp else targets
+        rows = manager.run(scrape_targets, args.pages, page_plan, deadline)
     finally:
+        disarm_stop_timer()
+        manager.close()
         driver.quit()
+    if timings is not None:
+        for keyword, seconds in manager.durations.items():
+            crawl_planner.update_timing(
+                timings, keyword, seconds, RUN_REPORT.keyword_pages.get(keyword, 0)
+            )
+    if args.full_serp:
+        return select_targets(rows, targets), rows
+    return rows, []
 
-    # Write Output
-    if all_results:
-        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-        output_path = OUTPUT_DIR / f"amazon_ranks_{dt.datetime.now():%Y%m%d_%H%M%S}.csv"
-        headers = ["timestamp", "keyword", "asin", "type", "page", "rank", "organic_rank"]
-        
-        with output_path.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(all_results)
-        LOGGER.info(f"Saved results to {output_path}")
+
+def load_keyword_timings(path: Path = KEYWORD_TIMINGS_FILE) -> Dict[str, float]:
+    """keyword -> moving-average seconds per results page."""
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_keyword_timings(timings: Dict[str, float], path: Path = KEYWORD_TIMINGS_FILE) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump({k: round(v, 2) for k, v in timings.items()}, f, ensure_ascii=False, indent=1)
+
+
+def run_targets(
+    targets: Dict[str, Set[str]],
+    args,
+    deadline: Optional[RunDeadline] = None,
+    priorities: Optional[Dict[str, float]] = None,
+    backends: Optional[Dict[str, str]] = None,
+) -> Tuple[List[RankRow], List[RankRow]]:
+    """Scrape ``targets`` with the mode chosen on the command line.
+
+    With a finite ``deadline`` only the keywords that fit its remaining
+    budget run, highest priority first. ``backends`` (keyword -> fetch
+    backend name) overrides --backend per keyword.
+    """
+    import crawl_planner
+
+    page_plan = plan_pages(targets, args)
+    timings = load_keyword_timings()
+    if deadline is not None and deadline.expires_at is not None:
+        planned = crawl_planner.plan_for_deadline(
+            targets, page_plan, timings, deadline.remaining(), priorities,
+            args.async_sessions or args.contexts or 1,
+        )
+        deadline.skipped.update(keyword for keyword in targets if keyword not in planned)
+        targets = planned
+    backend_plan = {keyword: (backends or {}).get(keyword, args.backend) for keyword in targets}
+    # Only the Selenium keywords go through --async-sessions/--contexts/--pipeline
+    other_targets = {k: asins for k, asins in targets.items() if backend_plan[k] != "selenium"}
+    selenium_targets = {k: asins for k, asins in targets.items() if k not in other_targets}
+    all_results: List[RankRow] = []
+    serp_rows: List[RankRow] = []
+    try:
+        if selenium_targets:
+            if args.async_sessions:
+                import async_orchestrator
+                rows, serp = async_orchestrator.run_async(
+                    selenium_targets, args, page_plan, deadline, timings
+                )
+            elif args.contexts:
+                rows, serp = run_in_contexts(selenium_targets, args, page_plan, deadline, timings)
+            else:
+                rows, serp = run_sequential(selenium_targets, args, page_plan, deadline, timings)
+            all_results.extend(rows)
+            serp_rows.extend(serp)
+        if other_targets:
+            import fetch_backends
+            if args.async_sessions or args.contexts or args.pipeline or args.parallel_pages:
+                LOGGER.warning(
+                    f"--async-sessions/--contexts/--pipeline/--parallel-pages do not apply to the "
+                    f"{len(other_targets)} keyword(s) on the cdp/http backends"
+                )
+            rows, serp = fetch_backends.run_backends(
+                other_targets, args, backend_plan, page_plan, deadline, timings
+            )
+            all_results.extend(rows)
+            serp_rows.extend(serp)
+    finally:
+        save_keyword_timings(timings)
+    return all_results, serp_rows
+
+
+def load_crawl_state(path: Path = CRAWL_STATE_FILE) -> Dict[str, float]:
+    """keyword -> epoch of its last crawl."""
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_crawl_state(state: Dict[str, float], path: Path = CRAWL_STATE_FILE) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+
+
+def run_volatility_scheduled(
+    targets: Dict[str, Set[str]],
+    args,
+    priorities: Dict[str, float],
+    deadline: Optional[RunDeadline] = None,
+    backends: Optional[Dict[str, str]] = None,
+) -> Tuple[List[RankRow], List[RankRow]]:
+    """Crawl only keywords whose volatility-based interval has elapsed.
+
+    Keywords whose ranks moved a lot are re-scanned once at the end of the run
+    to confirm the change; a re-scan that completes replaces the first result,
+    one that fails or is cut keeps it.
+    """
+    import crawl_planner
+    import rank_history
+
+    history = rank_history.load_history(days=args.history_days)
+    state = load_crawl_state()
+    due = crawl_planner.due_keywords(targets, history, state, priorities)
+    if not due:
+        return [], []
+
+    all_results, serp_rows = run_targets(due, args, deadline, priorities, backends)
+    if deadline is not None:
+        # Keywords the deadline cut stay due for the next run
+        due = {keyword: asins for keyword, asins in due.items() if keyword not in deadline.skipped}
+    changed = crawl_planner.big_rank_changes(all_results, history, due)
+    if changed and deadline is not None and deadline.expired():
+        LOGGER.warning(f"No time left to re-scan {len(changed)} changed keyword(s).")
+        changed = set()
+    if changed:
+        LOGGER.info(f"Re-scanning {len(changed)} keyword(s) to confirm rank changes.")
+        recheck = {keyword: due[keyword] for keyword in changed}
+        rescan_started = time.time()
+        confirmed, confirmed_serp = run_targets(recheck, args, deadline, priorities, backends)
+        rescanned = {
+            keyword for keyword in changed
+            if RUN_REPORT.reached_keywords.get(keyword, 0) >= rescan_started
+            and (deadline is None or keyword not in deadline.skipped)
+        }
+        if deadline is not None:
+            # Their first pass completed, so the result is not partial
+            deadline.skipped.difference_update(changed - rescanned)
+        all_results = [r for r in all_results if r.keyword not in rescanned] + [
+            r for r in confirmed if r.keyword in rescanned
+        ]
+        serp_rows = [r for r in serp_rows if r.keyword not in rescanned] + [
+            r for r in confirmed_serp if r.keyword in rescanned
+        ]
+
+    # Keywords that never reached a results page stay due for the next run
+    now = time.time()
+    state.update({keyword: now for keyword in due if keyword in RUN_REPORT.reached_keywords})
+    save_crawl_state(state)
+    return all_results, serp_rows
+
+
+def build_parser() -> argparse.ArgumentParser:
+    import rank_history
+
+    parser = argparse.ArgumentParser(description="Amazon Rank Tracker (Selenium)")
+    parser.add_argument("--screenshot", action="store_true", help="Take screenshots of search results")
+    parser.add_argument("--pages", type=int, default=MAX_PAGES, help="Number of pages to scan")
+    parser.add_argument("--recycle-every", type=int, default=RECYCLE_EVERY_KEYWORDS,
+                        help="Restart Chrome after this many keywords (0 = never)")
+    parser.add_argument("--max-browser-mb", type=float, default=MAX_BROWSER_MEMORY_MB,
+                        help="Restart Chrome when its RSS exceeds this many MB (0 = never)")
+    parser.add_argument("--input", action="append", metavar="TENANT=CSV",
+                        help="Tenant input file (repeatable); shared keywords are scraped once "
+                             "and results fanned out to @output/TENANT/")
+    parser.add_argument("--full-serp", action="store_true",
+                        help="Also store every ranked card (amazon_serp_*.csv), not only target ASINs")
+    parser.add_argument("--from-serp", type=Path, nargs="+", metavar="FILE",
+                        help="Answer input.csv from stored full-SERP files instead of scraping")
+    parser.add_argument("--output-format", choices=sorted(serp_records.WRITERS), default="csv",
+                        help="File format of the rank/SERP output")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Load the next results page in a background tab during extraction")
+    parser.add_argument("--parallel-pages", action="store_true",
+                        help="Load all --pages of a keyword at once in separate tabs")
+    parser.add_argument("--adaptive-pages", action="store_true",
+                        help="Choose each keyword's depth (up to --pages) from recent rank history")
+    parser.add_argument("--history-days", type=float, default=rank_history.HISTORY_DAYS,
+                        help="Days of rank history used by the planners")
+    parser.add_argument("--volatility-schedule", action="store_true",
+                        help="Only crawl keywords due by their rank volatility (run this hourly)")
+    parser.add_argument("--contexts", type=int, default=0,
+                        help="Run this many keywords concurrently in isolated browser contexts of one Chrome")
+    parser.add_argument("--async-sessions", type=int, default=0,
+                        help="Run this many keywords concurrently as asyncio sessions over one "
+                             "DevTools connection (Chrome without chromedriver)")
+    parser.add_argument("--keyword-timeout", type=float, default=300, metavar="SECONDS",
+                        help="With --async-sessions, cancel a keyword after this many seconds")
+    parser.add_argument("--backend", choices=["selenium", "cdp", "http"], default="selenium",
+                        help="Page fetch engine; a BACKEND column in the input overrides it per keyword")
+    parser.add_argument("--cookies", type=Path, default=None, metavar="FILE",
+                        help="Seed fetch backends with these cookies (JSON); browser backends save "
+                             "theirs here after setting the delivery location")
+    parser.add_argument("--deadline", type=float, default=None, metavar="SECONDS",
+                        help="Finish within this many seconds: run the highest-priority keywords "
+                             "that fit (estimated from past timings) and stop cleanly")
+    parser.add_argument("--page-metrics", action="store_true",
+                        help="Record Chrome's timing, transfer, DOM and heap metrics per page "
+                             "(amazon_page_metrics_*.csv)")
+    parser.add_argument("--visibility-index", type=Path, nargs="?", default=None, metavar="FILE",
+                        const=VISIBILITY_INDEX_FILE,
+                        help="Record every ranked card in the ASIN -> keyword visibility index "
+                             "(default file: @output/visibility_index.idx)")
+    parser.add_argument("--prometheus-textfile", type=Path, default=None, metavar="FILE",
+                        help="Also write the run metrics to this .prom file (node_exporter textfile collector)")
+    parser.add_argument("--grace-seconds", type=float, default=STOP_GRACE_SECONDS,
+                        help="After SIGTERM/Ctrl-C, abandon the current page after this many seconds")
+
+    daemon = parser.add_argument_group("daemon mode")
+    daemon.add_argument("--daemon", action="store_true",
+                        help="Keep warm browsers alive and run keywords on an internal schedule")
+    daemon.add_argument("--schedule-file", type=Path, default=Path("schedule.json"),
+                        help="JSON mapping keyword GROUP -> cron expression")
+    daemon.add_argument("--control-port", type=int, default=8765,
+                        help="Local TCP port of the daemon control socket")
+    daemon.add_argument("--pool-size", type=int, default=1, help="Number of warm browsers")
+    return parser
+
+
+def main(
+    input_source: Optional[InputSource] = None,
+    tenant_sources: Optional[Dict[str, InputSource]] = None,
+):
+    """Run the tracker; the sources override input.csv / --input (e.g. downloaded bytes)."""
+    args = build_parser().parse_args()
+    deadline = RunDeadline(args.deadline)
+
+    global VISIBILITY_INDEX
+    if args.visibility_index:
+        import visibility_index
+        VISIBILITY_INDEX = visibility_index.VisibilityIndex(args.visibility_index)
+
+    if args.daemon:
+        import rank_daemon
+        rank_daemon.run_daemon(args)
+        return
+
+    tenants: TenantTargets = {}
+    try:
+        sources: Dict[str, InputSource] = tenant_sources or {
+            tenant: Path(path) for tenant, path in (spec.split("=", 1) for spec in args.input or [])
+        }
+        if sources:
+            targets, tenants = load_tenant_targets(sources)
+        else:
+            targets = load_targets(input_source or INPUT_FILE)
+    except Exception as e:
+        LOGGER.error(f"Initialization failed: {e}")
+        sys.exit(1)
+
+    if args.from_serp:
+        write_results(
+            select_targets(load_serp_rows(args.from_serp), targets),
+            output_format=args.output_format,
+        )
+        return
+
+    priorities: Dict[str, float] = {}
+    backends: Dict[str, str] = {}
+    if sources:
+        searched = {normalize_keyword(keyword): keyword for keyword in targets}
+        for source in sources.values():
+            try:
+                source_priorities = load_priorities(source, normalize=True)
+                source_backends = load_backends(source, normalize=True)
+            except (OSError, ValueError):
+                continue  # tenant already skipped by load_tenant_targets()
+            for key, priority in source_priorities.items():
+                if key in searched:
+                    keyword = searched[key]
+                    priorities[keyword] = max(priority, priorities.get(keyword, priority))
+            for key, backend in source_backends.items():
+                if key in searched:
+                    backends.setdefault(searched[key], backend)
     else:
-        LOGGER.warning("No results found.")
+        priorities = load_priorities(input_source or INPUT_FILE)
+        backends = load_backends(input_source or INPUT_FILE)
+
+    global PAGE_METRICS
+    if args.page_metrics:
+        import page_metrics
+        PAGE_METRICS = page_metrics.PageMetricsLog()
+
+    install_stop_handlers(deadline, args.grace_seconds)
+    try:
+        if args.volatility_schedule:
+            all_results, serp_rows = run_volatility_scheduled(
+                targets, args, priorities, deadline, backends
+            )
+        else:
+            all_results, serp_rows = run_targets(targets, args, deadline, priorities, backends)
+    finally:
+        disarm_stop_timer()
+
+    partial = deadline.partial_marker()
+    write_results(all_results, output_format=args.output_format, partial=partial)
+    for tenant, tenant_rows in fan_out_results(all_results, tenants).items():
+        write_results(tenant_rows, tenant, output_format=args.output_format, partial=partial)
+    if args.full_serp:
+        write_results(serp_rows, prefix="amazon_serp", output_format=args.output_format,
+                      partial=partial)
+    if PAGE_METRICS is not None:
+        write_page_metrics(PAGE_METRICS.records)
+    if VISIBILITY_INDEX is not None:
+        VISIBILITY_INDEX.save()
+
+    RUN_REPORT.count("rows_written", len(all_results))
+    if ARTIFACT_STORE.remote:
+        RUN_REPORT.count("bytes_uploaded", ARTIFACT_STORE.bytes_written)
+    RUN_REPORT.finish(keywords=len(targets), partial=partial)
+    write_run_report(RUN_REPORT, args.prometheus_textfile)
+
 
 if __name__ == "__main__":
     main()
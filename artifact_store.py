@@ -0,0 +1,206 @@
+"""Where run artifacts go: result files, screenshots and error dumps.
+
+Local runs write under @output as before. On Cloud Run the filesystem is
+RAM-backed, so staging files there and uploading them afterwards holds every
+artifact in memory twice; GcsStore instead streams each artifact straight
+into a resumable upload.
+
+Artifacts are addressed by a kind and a relative name:
+
+    kind      LocalStore        GcsStore
+    data      @output/NAME      gs://BUCKET/data/NAME
+    images    @output/images/   gs://BUCKET/images/NAME
+    errors    ./NAME            gs://BUCKET/errors/NAME
+"""
+from __future__ import annotations
+
+import io
+import logging
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional
+
+LOGGER = logging.getLogger("amazon_rank_tracker.store")
+
+OUTPUT_DIR = Path("@output")
+# Resumable upload chunk; must be a multiple of 256 KiB
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_TIMEOUT = 60
+
+CONTENT_TYPES = {
+    ".csv": "text/csv",
+    ".jsonl": "application/x-ndjson",
+    ".json": "application/json",
+    ".html": "text/html",
+    ".png": "image/png",
+    ".prom": "text/plain; version=0.0.4",
+}
+
+
+class _CountingStream(io.RawIOBase):
+    """Write-only proxy that counts the bytes passed to the wrapped stream."""
+
+    def __init__(self, inner: BinaryIO):
+        self.inner = inner
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.inner.write(data)
+        self.written += len(data)
+        return len(data)
+
+
+class _Store:
+    """Byte accounting shared by the stores; ``remote`` stores upload what they write."""
+
+    remote = False
+
+    def __init__(self):
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _counted(self, stream: BinaryIO) -> Iterator[BinaryIO]:
+        counter = _CountingStream(stream)
+        try:
+            yield counter
+        finally:
+            with self._lock:
+                self.bytes_written += counter.written
+
+
+class LocalStore(_Store):
+    """Artifacts as files under @output (the default)."""
+
+    def __init__(self, output_dir: Path = OUTPUT_DIR):
+        super().__init__()
+        self.dirs: Dict[str, Path] = {
+            "data": output_dir,
+            "images": output_dir / "images",
+            "errors": Path("."),
+        }
+
+    def location(self, kind: str, name: str) -> str:
+        return str(self.dirs[kind] / name)
+
+    @contextmanager
+    def open_write(self, kind: str, name: str) -> Iterator[BinaryIO]:
+        path = self.dirs[kind] / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as f, self._counted(f) as stream:
+            yield stream
+
+    def put_bytes(self, kind: str, name: str, data: bytes) -> str:
+        with self.open_write(kind, name) as f:
+            f.write(data)
+        return self.location(kind, name)
+
+
+class _ResumableUpload(io.RawIOBase):
+    """Write-only stream into a GCS resumable upload session, sent in UPLOAD_CHUNK_BYTES chunks.
+
+    The session URL authorises its own requests, so plain urllib drives it.
+    Nothing is committed until finish(); abort() cancels the session.
+    """
+
+    def __init__(self, session_url: str, chunk_size: int = UPLOAD_CHUNK_BYTES):
+        self.session_url = session_url
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._offset = 0  # bytes GCS has persisted
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._put(self.chunk_size, final=False)
+        return len(data)
+
+    def _request(self, method: str, data: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        """(status, headers); 308 and other error statuses are returned, not raised."""
+        request = urllib.request.Request(self.session_url, data=data, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=UPLOAD_TIMEOUT) as response:
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers
+
+    def _put(self, size: int, final: bool) -> None:
+        end = self._offset + size
+        total = str(end) if final else "*"
+        content_range = f"bytes {self._offset}-{end - 1}/{total}" if size else f"bytes */{total}"
+        status, headers = self._request("PUT", bytes(self._buffer[:size]), {"Content-Range": content_range})
+        if final and status in (200, 201):
+            persisted = end
+        elif not final and status == 308:
+            # "Range: bytes=0-N" is what GCS kept; resend the rest with the next chunk
+            received = headers.get("Range")
+            persisted = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+        else:
+            raise OSError(f"Resumable upload failed with HTTP {status} at byte {self._offset}")
+        del self._buffer[:persisted - self._offset]
+        self._offset = persisted
+
+    def finish(self) -> None:
+        """Upload the rest and finalise the object."""
+        self._put(len(self._buffer), final=True)
+
+    def abort(self) -> None:
+        """Cancel the session so no object (truncated or not) is created."""
+        self._buffer.clear()
+        try:
+            status, _ = self._request("DELETE")
+        except OSError as e:
+            LOGGER.warning(f"Could not cancel upload session (it expires unfinalised): {e}")
+            return
+        if status != 499:  # GCS answers a cancelled session with 499
+            LOGGER.warning(f"Could not cancel upload session (it expires unfinalised): HTTP {status}")
+
+
+class GcsStore(_Store):
+    """Artifacts streamed to a GCS bucket through resumable uploads, never staged on disk."""
+
+    PREFIXES = {"data": "data/", "images": "images/", "errors": "errors/"}
+    remote = True
+
+    def __init__(self, bucket_name: str, client=None):
+        from google.cloud import storage
+
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.bucket = (client or storage.Client()).bucket(bucket_name)
+
+    def _blob_name(self, kind: str, name: str) -> str:
+        return f"{self.PREFIXES[kind]}{name}"
+
+    def location(self, kind: str, name: str) -> str:
+        return f"gs://{self.bucket_name}/{self._blob_name(kind, name)}"
+
+    @contextmanager
+    def open_write(self, kind: str, name: str) -> Iterator[BinaryIO]:
+        blob = self.bucket.blob(self._blob_name(kind, name))
+        content_type: Optional[str] = CONTENT_TYPES.get(Path(name).suffix.lower())
+        upload = _ResumableUpload(blob.create_resumable_upload_session(
+            content_type=content_type or "application/octet-stream",
+        ))
+        try:
+            with self._counted(upload) as stream:
+                yield stream
+        except BaseException:
+            upload.abort()  # a failed write must not leave a truncated object
+            raise
+        upload.finish()
+        LOGGER.info(f"Uploaded {name} -> {self.location(kind, name)}")
+
+    def put_bytes(self, kind: str, name: str, data: bytes) -> str:
+        with self.open_write(kind, name) as f:
+            f.write(data)
+        return self.location(kind, name)
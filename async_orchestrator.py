@@ -0,0 +1,471 @@
+"""Many concurrent browser sessions from one thread, on asyncio.
+
+The threaded --contexts mode parks one thread per session on every wait,
+sleep and DevTools round trip. Here a single event loop drives all of
+them: one DevTools websocket to a Chrome launched without chromedriver,
+with every session an isolated browser context attached in flattened mode
+(``Target.attachToTarget``), so dozens of page loads can be in flight at
+once.
+
+- structured concurrency: the workers live in an asyncio.TaskGroup; an
+  error or stop cancels all of them and every context is disposed,
+- per-keyword timeouts (--keyword-timeout): a stuck keyword is cancelled,
+  its finished pages kept and its session replaced,
+- cancellation: a --deadline or SIGTERM stops workers at the next page;
+  after the grace period the remaining tasks are cancelled (this replaces
+  the SIGALRM interrupt used by the blocking modes).
+
+Ranking is the batched EXTRACT_ITEMS_SCRIPT + rank_items(), as in
+browser_contexts.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Set
+
+import amazon_search_rank as asr
+from amazon_search_rank import PageState
+from browser_contexts import DEFAULT_ZIP_CODE, SET_LOCATION_SCRIPT, CdpError
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.async")
+
+CDP_COMMAND_TIMEOUT = 60
+KEYWORD_TIMEOUT = 300
+STOP_POLL_SECONDS = 0.2
+
+
+class AsyncCdpClient:
+    """DevTools client on one browser websocket; commands for page sessions carry a sessionId."""
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reader = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, address: str) -> "AsyncCdpClient":
+        import websockets
+
+        ws_url = await asyncio.to_thread(_browser_ws_url, address)
+        return cls(await websockets.connect(ws_url, max_size=None, ping_interval=None))
+
+    async def send(
+        self,
+        method: str,
+        params: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        timeout: float = CDP_COMMAND_TIMEOUT,
+    ) -> Dict[str, Any]:
+        if self._reader.done():
+            raise CdpError("DevTools connection closed")
+        message_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        message: Dict[str, Any] = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        try:
+            try:
+                await self._ws.send(json.dumps(message))
+            except Exception as e:  # websockets.ConnectionClosed once Chrome is gone
+                raise CdpError(f"DevTools connection closed: {e}") from e
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    async def _read(self) -> None:
+        """Resolve command futures by id; events are ignored."""
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                future = self._pending.get(message.get("id"))
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(CdpError(message["error"].get("message")))
+                else:
+                    future.set_result(message.get("result", {}))
+        except Exception as e:
+            LOGGER.warning(f"DevTools connection lost: {e}")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CdpError("DevTools connection closed"))
+
+    async def close(self) -> None:
+        await self._ws.close()
+        await self._reader
+
+
+def _browser_ws_url(address: str) -> str:
+    with urllib.request.urlopen(f"http://{address}/json/version", timeout=10) as response:
+        return json.load(response)["webSocketDebuggerUrl"]
+
+
+class AsyncPage:
+    """One incognito context with a single tab, driven through an AsyncCdpClient."""
+
+    def __init__(self, client: AsyncCdpClient, context_id: str, session_id: str, zip_code: str):
+        self.client = client
+        self.context_id = context_id
+        self.session_id = session_id
+        self.zip_code = zip_code
+
+    @classmethod
+    async def open(cls, client: AsyncCdpClient, zip_code: str = DEFAULT_ZIP_CODE) -> "AsyncPage":
+        context_id = (await client.send(
+            "Target.createBrowserContext", {"disposeOnDetach": True}
+        ))["browserContextId"]
+        try:
+            target_id = (await client.send(
+                "Target.createTarget", {"url": "about:blank", "browserContextId": context_id}
+            ))["targetId"]
+            session_id = (await client.send(
+                "Target.attachToTarget", {"targetId": target_id, "flatten": True}
+            ))["sessionId"]
+        except BaseException:
+            try:
+                await client.send("Target.disposeBrowserContext", {"browserContextId": context_id})
+            except (CdpError, asyncio.TimeoutError):
+                pass
+            raise
+        page = cls(client, context_id, session_id, zip_code)
+        await page.send("Page.enable")
+        return page
+
+    async def send(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.client.send(method, params, self.session_id)
+
+    async def execute_script(self, script: str, *args: Any) -> Any:
+        """Evaluate a WebDriver-style script body (``arguments[n]``, ``return``)."""
+        expression = f"(async function() {{ {script} }}).apply(null, {json.dumps(args)})"
+        result = await self.send("Runtime.evaluate", {
+            "expression": expression,
+            "returnByValue": True,
+            "awaitPromise": True,
+        })
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CdpError(details.get("exception", {}).get("description") or details.get("text"))
+        return result.get("result", {}).get("value")
+
+    async def get(self, url: str, timeout: float = 60) -> None:
+        """Navigate and wait until the new document has replaced the old one."""
+        await self.execute_script("window.__rankStale = true; return true;")
+        await self.send("Page.navigate", {"url": url})
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if await self.execute_script(
+                    "return !window.__rankStale && document.readyState !== 'loading';"
+                ):
+                    return
+            except CdpError:
+                pass  # execution context replaced mid-navigation
+            await asyncio.sleep(0.1)
+        raise CdpError(f"Timed out loading {url}")
+
+    async def classify(self) -> PageState:
+        try:
+            return PageState(await self.execute_script(asr.PAGE_STATE_SCRIPT, asr.PAGE_STATE_SELECTORS))
+        except (CdpError, ValueError) as e:
+            LOGGER.warning(f"Failed to classify page: {e}")
+            return PageState.ERROR
+
+    async def wait_for_results(self, timeout: float = 30) -> PageState:
+        """Like wait_for_results(), but returns OTHER instead of raising on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                state = PageState(await self.execute_script(asr.PAGE_STATE_SCRIPT, asr.PAGE_STATE_SELECTORS))
+            except CdpError:
+                state = PageState.OTHER  # execution context replaced mid-navigation
+            if state is not PageState.OTHER or time.monotonic() >= deadline:
+                return state
+            await asyncio.sleep(0.5)
+
+    async def handle_captcha(self, state: PageState) -> bool:
+        if state is not PageState.CAPTCHA:
+            return False
+        LOGGER.warning("CAPTCHA detected!")
+        asr.RUN_REPORT.count("captchas_seen")
+        clicked = await self.execute_script(
+            "const b = document.querySelector(\"button[type='submit']\"); if (b) b.click(); return !!b;"
+        )
+        if not clicked:
+            LOGGER.error("Could not find CAPTCHA button.")
+            return False
+        await asyncio.sleep(5)
+        return True
+
+    async def scroll_until_stable(
+        self,
+        step_pause: float = asr.SCROLL_STEP_PAUSE,
+        stable_seconds: float = asr.SCROLL_STABLE_SECONDS,
+        max_seconds: float = asr.SCROLL_MAX_SECONDS,
+    ) -> None:
+        """scroll_until_stable() without blocking the loop."""
+        start = time.monotonic()
+        last_count, last_height, _ = await self.execute_script(asr.SCROLL_STEP_SCRIPT, asr.RESULTS_SELECTOR)
+        stable_since = start
+        while True:
+            await asyncio.sleep(step_pause)
+            count, height, bottom = await self.execute_script(asr.SCROLL_STEP_SCRIPT, asr.RESULTS_SELECTOR)
+            now = time.monotonic()
+            if count != last_count or height != last_height:
+                last_count, last_height = count, height
+                stable_since = now
+            if bottom >= height - 2 and now - stable_since >= stable_seconds:
+                return
+            if now - start >= max_seconds:
+                return
+
+    async def prepare(self) -> None:
+        """Open the home page and set this context's delivery location."""
+        if asr.PAGE_METRICS is not None:
+            import page_metrics
+            await self.send("Page.addScriptToEvaluateOnNewDocument", {
+                "source": f"performance.setResourceTimingBufferSize({page_metrics.RESOURCE_BUFFER_SIZE});",
+            })
+        await self.get(asr.AMAZON_URL)
+        await self.handle_captcha(await self.classify())
+        try:
+            outcome = await self.execute_script(SET_LOCATION_SCRIPT, self.zip_code)
+            if outcome == "set":
+                asr.RUN_REPORT.count("location_resets")
+            LOGGER.info(f"Context {self.context_id[:8]}: location {outcome} ({self.zip_code})")
+        except CdpError as e:
+            # The location update reloads the page, which can cut the script short
+            LOGGER.info(f"Context {self.context_id[:8]}: location update reloaded page ({e})")
+        await asyncio.sleep(3)
+
+    async def record_metrics(self, keyword: str, page: int) -> None:
+        import page_metrics
+
+        try:
+            timing = await self.execute_script(page_metrics.PAGE_TIMING_SCRIPT)
+            await self.send("Performance.enable")
+            result = await self.send("Performance.getMetrics")
+            asr.PAGE_METRICS.add(page_metrics.page_metrics_from(keyword, page, timing, result))
+        except CdpError as e:
+            LOGGER.warning(f"Failed to collect page metrics for {keyword} page {page}: {e}")
+
+    async def scrape(
+        self,
+        keyword: str,
+        asins: Optional[Set[str]],
+        pages: int,
+        results: List[RankRow],
+        deadline: Optional[asr.RunDeadline] = None,
+    ) -> None:
+        """Rank pages 1..``pages`` into ``results`` (kept if the keyword is cancelled)."""
+        report = asr.RUN_REPORT
+        cumulative_offset = 0
+        reached = False  # a results or no-results page was seen
+        fetched = 0  # pages ranked
+        report.count("keywords_attempted")
+        started = time.monotonic()
+        try:
+            for page in range(1, pages + 1):
+                if page > 1 and deadline is not None and deadline.expired():
+                    LOGGER.warning(f"Deadline reached; stopping {keyword} before page {page}.")
+                    break
+                try:
+                    with report.phase("wait"):
+                        await self.get(asr.search_url(keyword, page))
+                        state = await self.wait_for_results()
+                        if await self.handle_captcha(state):
+                            state = await self.wait_for_results()
+                    if state is PageState.NO_RESULTS:
+                        reached = True
+                    if state is not PageState.RESULTS:
+                        LOGGER.info(f"{keyword} page {page}: {state.value}; stopping.")
+                        break
+                    with report.phase("scroll"):
+                        await self.scroll_until_stable()
+                    with report.phase("extract"):
+                        extracted = await self.execute_script(asr.EXTRACT_ITEMS_SCRIPT, asr.RESULTS_SELECTOR)
+                        rows, items_count = asr.rank_items(
+                            extracted["items"], extracted["labels"], keyword, page,
+                            asins, cumulative_offset, int(time.time()),
+                        )
+                    reached = True
+                    report.count("pages_fetched")
+                    fetched += 1
+                    if asr.PAGE_METRICS is not None:
+                        await self.record_metrics(keyword, page)
+                except Exception as e:
+                    LOGGER.error(f"{keyword} page {page} failed: {e}")
+                    break
+                results.extend(rows)
+                cumulative_offset += items_count
+        finally:
+            report.keyword_finished(keyword, reached, fetched)
+            report.observe("keyword", time.monotonic() - started)
+
+    async def close(self) -> None:
+        try:
+            await self.client.send("Target.disposeBrowserContext", {"browserContextId": self.context_id})
+        except (CdpError, asyncio.TimeoutError) as e:
+            LOGGER.warning(f"Failed to dispose context: {e}")
+
+
+class AsyncOrchestrator:
+    """Run keywords over ``concurrency`` async sessions of the Chrome at ``address``."""
+
+    def __init__(
+        self,
+        address: str,
+        concurrency: int = 8,
+        keyword_timeout: float = KEYWORD_TIMEOUT,
+        zip_code: str = DEFAULT_ZIP_CODE,
+    ):
+        self.address = address
+        self.concurrency = max(1, concurrency)
+        self.keyword_timeout = keyword_timeout
+        self.zip_code = zip_code
+        # Filled as keywords finish, so a cancelled run still has them
+        self.results: List[RankRow] = []
+        self.durations: Dict[str, float] = {}  # keyword -> seconds of its scrape
+        self.timed_out: Set[str] = set()
+        self.in_flight: Set[str] = set()
+        self.done: Set[str] = set()  # scraped, failed or skipped
+
+    async def run(
+        self,
+        targets: Dict[str, Optional[Set[str]]],
+        pages: int = asr.MAX_PAGES,
+        page_plan: Optional[Dict[str, int]] = None,
+        deadline: Optional[asr.RunDeadline] = None,
+        grace_seconds: float = asr.STOP_GRACE_SECONDS,
+    ) -> List[RankRow]:
+        """Scrape every keyword; raises RunCancelled once a stop outlasts ``grace_seconds``."""
+        page_plan = page_plan or {}
+        queue: asyncio.Queue = asyncio.Queue()
+        for keyword, asins in targets.items():
+            queue.put_nowait((keyword, asins, page_plan.get(keyword, pages)))
+        client = await AsyncCdpClient.connect(self.address)
+        try:
+            async with asyncio.TaskGroup() as supervisor:
+                watcher = None
+                if deadline is not None:
+                    watcher = supervisor.create_task(self._watch_stop(deadline, grace_seconds))
+                async with asyncio.TaskGroup() as workers:
+                    for _ in range(min(self.concurrency, queue.qsize())):
+                        workers.create_task(self._worker(client, queue, deadline))
+                if watcher is not None:
+                    watcher.cancel()
+        except* asr.RunCancelled as group:
+            if deadline is not None:
+                deadline.skipped.update(self.in_flight)
+                while not queue.empty():
+                    deadline.skipped.add(queue.get_nowait()[0])
+            raise group.exceptions[0]
+        finally:
+            await client.close()
+        return self.results
+
+    async def _watch_stop(self, deadline: asr.RunDeadline, grace_seconds: float) -> None:
+        """After a stop signal, give in-flight pages ``grace_seconds`` and then cancel them."""
+        while not deadline.cancelled:
+            await asyncio.sleep(STOP_POLL_SECONDS)
+        asr.disarm_stop_timer()  # the task group is cancelled instead of interrupting the loop
+        await asyncio.sleep(grace_seconds)
+        if self.in_flight:
+            raise asr.RunCancelled(f"{deadline.cancelled}; grace period over")
+
+    async def _worker(
+        self, client: AsyncCdpClient, queue: asyncio.Queue, deadline: Optional[asr.RunDeadline]
+    ) -> None:
+        page: Optional[AsyncPage] = None
+        try:
+            while not queue.empty():
+                keyword, asins, pages = queue.get_nowait()
+                if deadline is not None and deadline.expired():
+                    deadline.skipped.add(keyword)
+                    self.done.add(keyword)
+                    continue
+                if page is None:
+                    try:
+                        page = await AsyncPage.open(client, self.zip_code)
+                        await page.prepare()
+                    except (CdpError, asyncio.TimeoutError) as e:
+                        LOGGER.error(f"Could not open a session for {keyword}: {e}")
+                        page = None
+                        asr.RUN_REPORT.count("keywords_attempted")
+                        asr.RUN_REPORT.count("keywords_failed")
+                        self.done.add(keyword)
+                        continue
+                LOGGER.info(f"Searching for: {keyword}")
+                self.in_flight.add(keyword)
+                rows: List[RankRow] = []
+                started = time.monotonic()
+                try:
+                    async with asyncio.timeout(self.keyword_timeout):
+                        await page.scrape(keyword, asins, pages, rows, deadline)
+                except TimeoutError:
+                    LOGGER.error(f"{keyword} timed out after {self.keyword_timeout:.0f}s; "
+                                 f"keeping {len(rows)} row(s) and replacing its session.")
+                    self.timed_out.add(keyword)
+                    await page.close()
+                    page = None
+                else:
+                    if deadline is not None and deadline.expired():
+                        deadline.skipped.add(keyword)  # may have been cut before its last page
+                    else:
+                        self.durations[keyword] = time.monotonic() - started
+                finally:
+                    self.results.extend(rows)
+                self.in_flight.discard(keyword)  # stays set if the task is cancelled
+                self.done.add(keyword)
+        finally:
+            if page is not None:
+                await page.close()
+
+
+def run_async(
+    targets: Dict[str, Set[str]],
+    args,
+    page_plan: Dict[str, int],
+    deadline: Optional[asr.RunDeadline] = None,
+    timings: Optional[Dict[str, float]] = None,
+):
+    """run_in_contexts() counterpart on one event loop; returns (target rows, SERP rows)."""
+    import crawl_planner
+    import fetch_backends
+
+    asr.warn_ignored_flags(args, "--async-sessions")
+    process, address, profile = fetch_backends.launch_chrome(headless=True)
+    orchestrator = AsyncOrchestrator(address, args.async_sessions, args.keyword_timeout)
+    scrape_targets = {k: None for k in targets} if args.full_serp else targets
+    try:
+        asyncio.run(orchestrator.run(scrape_targets, args.pages, page_plan, deadline, args.grace_seconds))
+    except asr.RunCancelled as e:
+        LOGGER.warning(f"Abandoned {len(orchestrator.in_flight)} keyword(s) in flight: {e}")
+    except Exception as e:
+        # e.g. Chrome or its websocket died: keep the rows of finished keywords
+        unscraped = set(scrape_targets) - orchestrator.done
+        LOGGER.error(f"Async run failed with {len(unscraped)} keyword(s) unscraped: {e!r}")
+        if deadline is not None:
+            deadline.skipped.update(unscraped)
+    finally:
+        asr.disarm_stop_timer()
+        fetch_backends.stop_chrome(process, profile)
+    if orchestrator.timed_out:
+        LOGGER.warning(f"{len(orchestrator.timed_out)} keyword(s) timed out: {sorted(orchestrator.timed_out)}")
+    if timings is not None:
+        for keyword, seconds in orchestrator.durations.items():
+            crawl_planner.update_timing(
+                timings, keyword, seconds, asr.RUN_REPORT.keyword_pages.get(keyword, 0)
+            )
+    rows = orchestrator.results
+    if args.full_serp:
+        return asr.select_targets(rows, targets), rows
+    return rows, []
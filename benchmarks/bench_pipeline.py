@@ -0,0 +1,93 @@
+"""Profile page extraction in-process against FakeWebDriver fixtures.
+
+Compares the per-element WebDriver path (process_page + get_item_type) with
+the batched path (one EXTRACT_ITEMS_SCRIPT call + rank_items) on the same
+fixture page: WebDriver commands per page, wall time at a given per-command
+latency, and whether both paths rank the page identically.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --latency 0.002
+    python benchmarks/bench_pipeline.py --fixture my_page.json --profile
+"""
+from __future__ import annotations
+
+import argparse
+import cProfile
+import pstats
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import amazon_search_rank as asr  # noqa: E402
+from fake_driver import FakeWebDriver, load_fixture  # noqa: E402
+
+DEFAULT_FIXTURE = Path(__file__).resolve().parent / "fixtures" / "serp_two_pages.json"
+# Typical local chromedriver round trip
+DEFAULT_LATENCY = 0.001
+KEYWORD = "fixture keyword"
+
+
+def open_results_page(fixture: Dict[str, Any], latency: float) -> FakeWebDriver:
+    driver = FakeWebDriver(fixture, latency)
+    driver.get(asr.search_url(KEYWORD, 1))
+    driver.reset_commands()
+    return driver
+
+
+def per_element(driver: FakeWebDriver) -> List[Tuple[str, int, int, int]]:
+    rows, _ = asr.process_page(driver, KEYWORD, 1, None, 0, False)
+    return [(row.asin, row.type_code, row.rank, row.organic_rank) for row in rows]
+
+
+def batched(driver: FakeWebDriver) -> List[Tuple[str, int, int, int]]:
+    extracted = driver.execute_script(asr.EXTRACT_ITEMS_SCRIPT, asr.RESULTS_SELECTOR)
+    rows, _ = asr.rank_items(extracted["items"], extracted["labels"], KEYWORD, 1, None, 0, 0)
+    return [(row.asin, row.type_code, row.rank, row.organic_rank) for row in rows]
+
+
+def measure(
+    fixture: Dict[str, Any], latency: float, path: Callable[[FakeWebDriver], Any]
+) -> Tuple[Any, int, float, FakeWebDriver]:
+    driver = open_results_page(fixture, latency)
+    start = time.perf_counter()
+    result = path(driver)
+    return result, driver.round_trips, time.perf_counter() - start, driver
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile extraction against a fake WebDriver")
+    parser.add_argument("--fixture", type=Path, default=DEFAULT_FIXTURE, help="JSON page fixture")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY,
+                        help="Seconds per WebDriver command")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile both paths without latency and print the top functions")
+    args = parser.parse_args()
+
+    fixture = load_fixture(args.fixture)
+    print(f"{'path':<14}{'commands':>10}{'ms/page':>10}  busiest commands")
+    outputs = {}
+    for name, path in (("per-element", per_element), ("batched", batched)):
+        output, trips, seconds, driver = measure(fixture, args.latency, path)
+        outputs[name] = output
+        busiest = ", ".join(f"{cmd}={n}" for cmd, n in driver.commands.most_common(3))
+        print(f"{name:<14}{trips:>10}{seconds * 1000:>10.1f}  {busiest}")
+
+    same = outputs["per-element"] == outputs["batched"]
+    print(f"{len(outputs['batched'])} ranked cards; both paths agree: {same}")
+
+    if args.profile:
+        for name, path in (("per-element", per_element), ("batched", batched)):
+            driver = open_results_page(fixture, 0.0)
+            profiler = cProfile.Profile()
+            profiler.runcall(path, driver)
+            print(f"\n== {name} ==")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(12)
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Microbenchmarks of the pure page-ranking logic (serp_ranking).
+
+Runs each step on synthetic result pages of 50 to 10,000 cards and reports
+time per page and allocations per page:
+
+    python benchmarks/bench_ranking.py
+    python benchmarks/bench_ranking.py --save baseline.json
+    python benchmarks/bench_ranking.py --baseline baseline.json --max-slowdown 1.5
+
+With --baseline the exit status is 1 when any case got slower (or allocates
+more) than the baseline by more than the allowed factor, so an algorithmic
+regression fails the build before deployment.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import amazon_search_rank as asr  # noqa: E402
+import serp_ranking  # noqa: E402
+from serp_records import SerpItem  # noqa: E402
+
+PAGE_SIZES = (50, 200, 1000, 10000)
+CARDS_PER_ROW = 4
+ROW_HEIGHT = 400
+NESTED_SHARE = 0.3  # cards repeated by a nested container
+HINT_SHARE = 0.1  # cards already flagged sponsored in-page
+LABEL_EVERY_ROWS = 6
+# Ignore slowdowns below this many microseconds (timer noise on tiny cases)
+NOISE_FLOOR_US = 20.0
+
+
+def synthetic_page(cards: int, seed: int = 0) -> Tuple[List[List[Any]], List[float]]:
+    """EXTRACT_ITEMS_SCRIPT-shaped output: [asin, x, y, w, h, hint] rows and label Ys."""
+    rng = random.Random(seed)
+    raw: List[List[Any]] = []
+    for index in range(cards):
+        row, column = divmod(index, CARDS_PER_ROW)
+        # A few ASINs repeat at other positions, like ad carousels do
+        asin = f"B{rng.randrange(cards * 2) if rng.random() < 0.05 else index:09d}"
+        x, y = column * 300.0, row * ROW_HEIGHT + rng.random() * 4
+        raw.append([asin, x, y, 280.0, 380.0, rng.random() < HINT_SHARE])
+        if rng.random() < NESTED_SHARE:
+            raw.append([asin, x + 5, y + 5, 260.0, 360.0, False])
+    rows = cards // CARDS_PER_ROW + 1
+    labels = [row * ROW_HEIGHT - 20.0 for row in range(0, rows, LABEL_EVERY_ROWS)]
+    rng.shuffle(raw)  # the DOM order of cards is not reading order
+    return raw, labels
+
+
+def build_cases(cards: int) -> Dict[str, Callable[[], Any]]:
+    raw, labels = synthetic_page(cards)
+    items = [SerpItem(asin, x, y, sponsored_hint=hint) for asin, x, y, _w, _h, hint in raw]
+    ordered = list(items)
+    serp_ranking.sort_items(ordered)
+    unique = serp_ranking.dedupe_items(ordered)
+    type_codes = serp_ranking.classify_items(unique, labels)
+    targets = {item.asin for item in unique[::25]}
+
+    return {
+        "sort": lambda: serp_ranking.sort_items(list(items)),
+        "dedupe": lambda: serp_ranking.dedupe_items(ordered),
+        "proximity": lambda: serp_ranking.classify_items(unique, labels),
+        "counters": lambda: serp_ranking.rank_page(unique, type_codes, "kw", 1, None, 0, 0),
+        "counters_targets": lambda: serp_ranking.rank_page(unique, type_codes, "kw", 1, targets, 0, 0),
+        "rank_items": lambda: asr.rank_items(raw, labels, "kw", 1, None, 0, 0),
+    }
+
+
+def measure(func: Callable[[], Any], min_seconds: float) -> Dict[str, float]:
+    """Median time per call over enough calls to fill ``min_seconds``, then one traced call."""
+    timings: List[float] = []
+    deadline = time.perf_counter() + min_seconds
+    while len(timings) < 5 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        snapshot_before = tracemalloc.take_snapshot()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot_after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in snapshot_after.compare_to(snapshot_before, "filename")
+                 if stat.count_diff > 0)
+    return {
+        "us": statistics.median(timings) * 1e6,
+        "peak_kib": (peak - before) / 1024,
+        "blocks": blocks,
+        "runs": len(timings),
+    }
+
+
+def run(sizes: Tuple[int, ...], min_seconds: float) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'case':<28}{'us/page':>12}{'us/card':>10}{'peak KiB':>11}{'blocks':>9}")
+    for cards in sizes:
+        for name, func in build_cases(cards).items():
+            key = f"{name}/{cards}"
+            stats = measure(func, min_seconds)
+            results[key] = stats
+            print(f"{key:<28}{stats['us']:>12.1f}{stats['us'] / cards:>10.3f}"
+                  f"{stats['peak_kib']:>11.1f}{stats['blocks']:>9}")
+    return results
+
+
+def regressions(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], factor: float
+) -> List[str]:
+    problems = []
+    for key, stats in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if stats["us"] > base["us"] * factor and stats["us"] - base["us"] > NOISE_FLOOR_US:
+            problems.append(f"{key}: {base['us']:.1f}us -> {stats['us']:.1f}us")
+        if stats["peak_kib"] > base["peak_kib"] * factor and stats["peak_kib"] - base["peak_kib"] > 4:
+            problems.append(f"{key}: peak {base['peak_kib']:.1f}KiB -> {stats['peak_kib']:.1f}KiB")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pure page-ranking logic")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(PAGE_SIZES),
+                        help="Cards per synthetic page")
+    parser.add_argument("--min-seconds", type=float, default=0.2,
+                        help="Minimum timing time per case")
+    parser.add_argument("--save", type=Path, help="Write the results as a JSON baseline")
+    parser.add_argument("--baseline", type=Path, help="Compare against a saved baseline")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="Allowed time/peak-memory factor over the baseline")
+    args = parser.parse_args()
+
+    results = run(tuple(args.sizes), args.min_seconds)
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=1), encoding="utf-8")
+        print(f"Saved baseline to {args.save}")
+    if args.baseline:
+        problems = regressions(
+            results, json.loads(args.baseline.read_text(encoding="utf-8")), args.max_slowdown
+        )
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
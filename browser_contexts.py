@@ -0,0 +1,367 @@
+"""Many isolated sessions inside one Chrome process via CDP browser contexts.
+
+One Chrome per concurrent session costs hundreds of MB each. Instead, the
+session manager creates lightweight incognito contexts
+(``Target.createBrowserContext``) in the Chrome already started by
+create_driver(), each with its own cookie jar and delivery location, and
+drives one page per context over its own DevTools websocket so keywords run
+concurrently.
+
+Sessions expose ``execute_script`` with WebDriver semantics, so
+classify_page(), wait_for_results() and scroll_until_stable() work on them
+unchanged; ranking uses the batched EXTRACT_ITEMS_SCRIPT + rank_items().
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+
+import websocket
+from selenium.common.exceptions import WebDriverException
+
+import amazon_search_rank as asr
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.contexts")
+
+DEFAULT_ZIP_CODE = "100-0001"
+
+# Runs the delivery-location popover flow of set_location_to_tokyo() in-page.
+SET_LOCATION_SCRIPT = """
+const zip = arguments[0];
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+const label = document.getElementById('glow-ingress-line2');
+if (label && label.textContent.includes(zip)) return 'already';
+const link = document.getElementById('nav-global-location-popover-link');
+if (!link) return 'no-widget';
+link.click();
+let input = null;
+for (let i = 0; i < 50 && !input; i++) {
+    await sleep(200);
+    input = document.getElementById('GLUXZipUpdateInput');
+}
+if (!input) return 'no-input';
+input.value = zip;
+input.dispatchEvent(new Event('input', {bubbles: true}));
+document.getElementById('GLUXZipUpdate').click();
+await sleep(2000);
+const done = document.querySelector("#GLUXConfirmClose, [name='glowDoneButton']");
+if (done) done.click();
+return 'set';
+"""
+
+
+class CdpError(WebDriverException):
+    """A DevTools command failed (raised like a driver error so callers' fallbacks apply)."""
+
+
+class CdpElement:
+    """Just enough of a WebElement for handle_captcha() to click a button."""
+
+    def __init__(self, session: "ContextSession", selector: str):
+        self.session = session
+        self.selector = selector
+
+    def click(self) -> None:
+        clicked = self.session.execute_script(
+            "const el = document.querySelector(arguments[0]); if (el) el.click(); return !!el;",
+            self.selector,
+        )
+        if not clicked:
+            raise CdpError(f"No element matches {self.selector}")
+
+
+class CdpConnection:
+    """Minimal synchronous DevTools client over one websocket (events are ignored)."""
+
+    def __init__(self, ws_url: str, timeout: float = 60):
+        self._ws = websocket.create_connection(ws_url, timeout=timeout, suppress_origin=True)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def send(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with self._lock:
+            message_id = next(self._ids)
+            self._ws.send(json.dumps({"id": message_id, "method": method, "params": params or {}}))
+            while True:
+                message = json.loads(self._ws.recv())
+                if message.get("id") != message_id:
+                    continue
+                if "error" in message:
+                    raise CdpError(f"{method}: {message['error'].get('message')}")
+                return message.get("result", {})
+
+    def close(self) -> None:
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+
+
+def debugger_address(driver) -> str:
+    """host:port of the DevTools endpoint of a chromedriver-launched Chrome."""
+    return driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+
+
+def browser_connection(address: str) -> CdpConnection:
+    with urllib.request.urlopen(f"http://{address}/json/version", timeout=10) as response:
+        ws_url = json.load(response)["webSocketDebuggerUrl"]
+    return CdpConnection(ws_url)
+
+
+class ContextSession:
+    """One incognito browser context with a single page, driven over CDP."""
+
+    def __init__(self, address: str, zip_code: str = DEFAULT_ZIP_CODE):
+        self.address = address
+        self.zip_code = zip_code
+        self._browser = browser_connection(address)
+        self.context_id = self._browser.send(
+            "Target.createBrowserContext", {"disposeOnDetach": True}
+        )["browserContextId"]
+        self.target_id = self._browser.send(
+            "Target.createTarget", {"url": "about:blank", "browserContextId": self.context_id}
+        )["targetId"]
+        self._page = CdpConnection(f"ws://{address}/devtools/page/{self.target_id}")
+        self._page.send("Page.enable")
+
+    # -- WebDriver-like surface ---------------------------------------------
+    def execute_script(self, script: str, *args: Any) -> Any:
+        """Evaluate a WebDriver-style script body (``arguments[n]``, ``return``)."""
+        expression = f"(async function() {{ {script} }}).apply(null, {json.dumps(args)})"
+        result = self._page.send("Runtime.evaluate", {
+            "expression": expression,
+            "returnByValue": True,
+            "awaitPromise": True,
+        })
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CdpError(details.get("exception", {}).get("description") or details.get("text"))
+        return result.get("result", {}).get("value")
+
+    def get(self, url: str, timeout: float = 60) -> None:
+        """Navigate and wait until the new document has replaced the old one."""
+        self.execute_script("window.__rankStale = true; return true;")
+        self._page.send("Page.navigate", {"url": url})
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if self.execute_script(
+                    "return !window.__rankStale && document.readyState !== 'loading';"
+                ):
+                    return
+            except CdpError:
+                pass  # execution context replaced mid-navigation
+            time.sleep(0.1)
+        raise CdpError(f"Timed out loading {url}")
+
+    def execute_cdp_cmd(self, cmd: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a DevTools command to this context's page."""
+        return self._page.send(cmd, params)
+
+    def find_element(self, by: str, value: str) -> CdpElement:
+        return CdpElement(self, value)
+
+    def set_cookies(self, cookies: List[Dict[str, Any]]) -> None:
+        """Seed this context's (separate) cookie jar, e.g. from a Selenium session."""
+        converted = [
+            {k: v for k, v in {
+                "name": c["name"], "value": c["value"], "domain": c.get("domain"),
+                "path": c.get("path", "/"), "secure": c.get("secure", False),
+                "httpOnly": c.get("httpOnly", False), "expires": c.get("expiry"),
+            }.items() if v is not None}
+            for c in cookies
+        ]
+        self._browser.send(
+            "Storage.setCookies", {"cookies": converted, "browserContextId": self.context_id}
+        )
+
+    def get_cookies(self) -> List[Dict[str, Any]]:
+        """This context's cookies in Selenium's format (``expiry`` for persistent ones)."""
+        cookies = self._browser.send(
+            "Storage.getCookies", {"browserContextId": self.context_id}
+        ).get("cookies", [])
+        converted = []
+        for c in cookies:
+            cookie = {
+                "name": c["name"], "value": c["value"], "domain": c.get("domain"),
+                "path": c.get("path", "/"), "secure": c.get("secure", False),
+                "httpOnly": c.get("httpOnly", False),
+            }
+            if c.get("expires", -1) > 0:
+                cookie["expiry"] = int(c["expires"])
+            converted.append(cookie)
+        return converted
+
+    # -- scraping -----------------------------------------------------------
+    def prepare(self) -> None:
+        """Open the home page and set this context's delivery location."""
+        if asr.PAGE_METRICS is not None:
+            asr.PAGE_METRICS.prepare(self)
+        self.get(asr.AMAZON_URL)
+        asr.handle_captcha(self)
+        try:
+            outcome = self.execute_script(SET_LOCATION_SCRIPT, self.zip_code)
+            if outcome == "set":
+                asr.RUN_REPORT.count("location_resets")
+            LOGGER.info(f"Context {self.context_id[:8]}: location {outcome} ({self.zip_code})")
+        except CdpError as e:
+            # The location update reloads the page, which can cut the script short
+            LOGGER.info(f"Context {self.context_id[:8]}: location update reloaded page ({e})")
+        time.sleep(3)
+
+    def scrape(
+        self,
+        keyword: str,
+        asins: Optional[Set[str]],
+        pages: int,
+        deadline: Optional[asr.RunDeadline] = None,
+    ) -> List[RankRow]:
+        report = asr.RUN_REPORT
+        results: List[RankRow] = []
+        cumulative_offset = 0
+        reached = False  # a results or no-results page was seen
+        fetched = 0  # pages ranked
+        report.count("keywords_attempted")
+        started = time.monotonic()
+        for page in range(1, pages + 1):
+            if page > 1 and deadline is not None and deadline.expired():
+                LOGGER.warning(f"Deadline reached; stopping {keyword} before page {page}.")
+                break
+            try:
+                with report.phase("wait"):
+                    self.get(asr.search_url(keyword, page))
+                    state = asr.wait_for_results(self)
+                    if state is asr.PageState.CAPTCHA and asr.handle_captcha(self, state):
+                        state = asr.wait_for_results(self)
+                if state is asr.PageState.NO_RESULTS:
+                    reached = True
+                if state is not asr.PageState.RESULTS:
+                    LOGGER.info(f"{keyword} page {page}: {state.value}; stopping.")
+                    break
+                with report.phase("scroll"):
+                    asr.scroll_until_stable(self)
+                with report.phase("extract"):
+                    extracted = self.execute_script(asr.EXTRACT_ITEMS_SCRIPT, asr.RESULTS_SELECTOR)
+                    rows, items_count = asr.rank_items(
+                        extracted["items"], extracted["labels"], keyword, page,
+                        asins, cumulative_offset, int(time.time()),
+                    )
+                reached = True
+                report.count("pages_fetched")
+                fetched += 1
+                if asr.PAGE_METRICS is not None:
+                    asr.PAGE_METRICS.record(self, keyword, page)
+            except Exception as e:
+                LOGGER.error(f"{keyword} page {page} failed: {e}")
+                break
+            results.extend(rows)
+            cumulative_offset += items_count
+        report.keyword_finished(keyword, reached, fetched)
+        report.observe("keyword", time.monotonic() - started)
+        return results
+
+    def close(self) -> None:
+        self._page.close()
+        try:
+            self._browser.send("Target.disposeBrowserContext", {"browserContextId": self.context_id})
+        except CdpError as e:
+            LOGGER.warning(f"Failed to dispose context: {e}")
+        self._browser.close()
+
+
+class ContextSessionManager:
+    """Run keywords concurrently in isolated contexts of one Chrome process."""
+
+    def __init__(self, driver, concurrency: int = 4, zip_code: str = DEFAULT_ZIP_CODE):
+        self.address = debugger_address(driver)
+        self.concurrency = max(1, concurrency)
+        self.zip_code = zip_code
+        self._local = threading.local()
+        self._sessions: List[ContextSession] = []
+        self._lock = threading.Lock()
+        self.durations: Dict[str, float] = {}  # keyword -> seconds of its last scrape
+
+    def _session(self) -> ContextSession:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = ContextSession(self.address, self.zip_code)
+            session.prepare()
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _scrape_one(
+        self,
+        keyword: str,
+        asins: Optional[Set[str]],
+        pages: int,
+        deadline: Optional[asr.RunDeadline],
+    ) -> List[RankRow]:
+        if deadline is not None and deadline.expired():
+            with self._lock:
+                deadline.skipped.add(keyword)
+            return []
+        LOGGER.info(f"Searching for: {keyword}")
+        started = time.monotonic()
+        rows = self._session().scrape(keyword, asins, pages, deadline)
+        with self._lock:
+            if deadline is not None and deadline.expired():
+                deadline.skipped.add(keyword)  # may have been cut before its last page
+            else:
+                self.durations[keyword] = time.monotonic() - started
+        return rows
+
+    def run(
+        self,
+        targets: Dict[str, Optional[Set[str]]],
+        pages: int = asr.MAX_PAGES,
+        page_plan: Optional[Dict[str, int]] = None,
+        deadline: Optional[asr.RunDeadline] = None,
+    ) -> List[RankRow]:
+        """Scrape every keyword; ``page_plan`` overrides ``pages`` per keyword.
+
+        Keywords not yet started when ``deadline`` expires are skipped.
+        """
+        page_plan = page_plan or {}
+        results: List[RankRow] = []
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="context")
+        futures = [
+            pool.submit(self._scrape_one, keyword, asins, page_plan.get(keyword, pages), deadline)
+            for keyword, asins in targets.items()
+        ]
+        for index, (keyword, future) in enumerate(zip(targets, futures)):
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                LOGGER.error(f"Error scraping {keyword}: {e}")
+                asr.RUN_REPORT.count("keywords_failed")
+            except asr.RunCancelled as e:
+                # Stop signal grace period over: keep what already finished and
+                # return without waiting for the pages still in flight
+                LOGGER.warning(f"Abandoning keywords still in flight: {e}")
+                abandoned = [keyword]
+                for rest_keyword, rest in zip(list(targets)[index + 1:], futures[index + 1:]):
+                    if rest.done() and not rest.cancelled() and rest.exception() is None:
+                        results.extend(rest.result())
+                    else:
+                        abandoned.append(rest_keyword)
+                pool.shutdown(wait=False, cancel_futures=True)
+                if deadline is not None:
+                    with self._lock:
+                        deadline.skipped.update(abandoned)
+                return results
+        pool.shutdown()
+        return results
+
+    def close(self) -> None:
+        for session in self._sessions:
+            session.close()
+        self._sessions.clear()
@@ -1,43 +1,115 @@
 import os
 import sys
 import logging
+import datetime as dt
 from google.cloud import storage
 from pathlib import Path
 import amazon_search_rank
+import artifact_store
+import rank_history
 
 # Configuration
 BUCKET_NAME = os.environ.get("BUCKET_NAME", "amazon-search-ranks")
 INPUT_BLOB_NAME = "input.csv"
 DATA_PREFIX = "data/"
 IMAGES_PREFIX = "images/"
-LOCAL_INPUT = "input.csv"
 LOCAL_OUTPUT_DIR = Path("@output")
+LOCAL_HISTORY_DIR = LOCAL_OUTPUT_DIR / "history"
+STATE_BLOB_NAME = "state/crawl_state.json"
+LOCAL_STATE = LOCAL_OUTPUT_DIR / "crawl_state.json"
+TIMINGS_BLOB_NAME = "state/keyword_timings.json"
+LOCAL_TIMINGS = LOCAL_OUTPUT_DIR / "keyword_timings.json"
+INDEX_BLOB_NAME = "state/visibility_index.idx"
+LOCAL_INDEX = LOCAL_OUTPUT_DIR / "visibility_index.idx"
+# Days of rank history downloaded and passed on as --history-days
+HISTORY_DAYS = float(os.environ.get("HISTORY_DAYS", rank_history.HISTORY_DAYS))
+# "tenantA=inputs/a.csv,tenantB=inputs/b.csv": per-tenant input blobs
+TENANT_INPUTS = os.environ.get("TENANT_INPUTS", "")
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger("cloud_runner")
 
-def download_input():
-    """Download input.csv from GCS."""
+def download_input() -> bytes:
+    """Download input.csv from GCS into memory."""
     LOGGER.info(f"Downloading {INPUT_BLOB_NAME} from bucket {BUCKET_NAME}...")
     client = storage.Client()
     bucket = client.bucket(BUCKET_NAME)
-    blob = bucket.blob(INPUT_BLOB_NAME)
-    blob.download_to_filename(LOCAL_INPUT)
-    LOGGER.info(f"Downloaded to {LOCAL_INPUT}")
+    data = bucket.blob(INPUT_BLOB_NAME).download_as_bytes()
+    LOGGER.info(f"Downloaded {len(data)} bytes")
+    return data
+
+def download_tenant_inputs(spec: str = TENANT_INPUTS):
+    """Download every tenant's input blob into memory; returns tenant -> CSV bytes."""
+    client = storage.Client()
+    bucket = client.bucket(BUCKET_NAME)
+    sources = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        tenant, blob_name = entry.split("=", 1)
+        sources[tenant] = bucket.blob(blob_name).download_as_bytes()
+        LOGGER.info(f"Downloaded {blob_name} for tenant {tenant}")
+    return sources
+
+def download_history(days: float = HISTORY_DAYS):
+    """Download recent result files from GCS so history-driven planners can use them."""
+    client = storage.Client()
+    bucket = client.bucket(BUCKET_NAME)
+    since = f"{DATA_PREFIX}amazon_ranks_{dt.datetime.now() - dt.timedelta(days=days):%Y%m%d}"
+    LOCAL_HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+    count = 0
+    for blob in client.list_blobs(bucket, prefix=f"{DATA_PREFIX}amazon_ranks_"):
+        # File names carry a sortable timestamp, so a string compare selects the window
+        if blob.name < since:
+            continue
+        blob.download_to_filename(str(LOCAL_HISTORY_DIR / Path(blob.name).name))
+        count += 1
+    LOGGER.info(f"Downloaded {count} history files to {LOCAL_HISTORY_DIR}")
+
+def download_state(blob_name: str = STATE_BLOB_NAME, local_path: Path = LOCAL_STATE):
+    """Fetch a state file (crawl state, keyword timings, index) if one was uploaded before."""
+    client = storage.Client()
+    blob = client.bucket(BUCKET_NAME).blob(blob_name)
+    if blob.exists():
+        LOCAL_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        blob.download_to_filename(str(local_path))
+        LOGGER.info(f"Downloaded {blob_name} to {local_path}")
 
 def upload_outputs():
-    """Upload all CSVs and images to GCS."""
+    """Upload files left on local disk: state files, plus results/images of local-store runs.
+
+    Result files and screenshots normally stream straight to GCS through the
+    GcsStore set up in main(), so nothing of theirs is found here.
+    """
     LOGGER.info("Uploading outputs to GCS...")
     client = storage.Client()
     bucket = client.bucket(BUCKET_NAME)
 
-    # Upload CSVs
+    # Upload result files (csv / jsonl / bin depending on --output-format)
     if LOCAL_OUTPUT_DIR.exists():
-        for csv_file in LOCAL_OUTPUT_DIR.glob("*.csv"):
-            blob_name = f"{DATA_PREFIX}{csv_file.name}"
-            blob = bucket.blob(blob_name)
-            blob.upload_from_filename(str(csv_file))
-            LOGGER.info(f"Uploaded {csv_file.name} -> gs://{BUCKET_NAME}/{blob_name}")
+        for pattern in ("*.csv", "*.jsonl", "*.bin"):
+            for data_file in LOCAL_OUTPUT_DIR.glob(pattern):
+                blob_name = f"{DATA_PREFIX}{data_file.name}"
+                blob = bucket.blob(blob_name)
+                blob.upload_from_filename(str(data_file))
+                LOGGER.info(f"Uploaded {data_file.name} -> gs://{BUCKET_NAME}/{blob_name}")
+        # Per-tenant fan-out files live in @output/<tenant>/
+        for tenant_dir in LOCAL_OUTPUT_DIR.iterdir():
+            if not tenant_dir.is_dir() or tenant_dir.name in ("images", "history"):
+                continue
+            for data_file in tenant_dir.glob("amazon_ranks_*"):
+                blob_name = f"{DATA_PREFIX}{tenant_dir.name}/{data_file.name}"
+                bucket.blob(blob_name).upload_from_filename(str(data_file))
+                LOGGER.info(f"Uploaded {data_file.name} -> gs://{BUCKET_NAME}/{blob_name}")
+
+    # Upload crawl state, keyword timings and the visibility index for the next run
+    state_files = (
+        (LOCAL_STATE, STATE_BLOB_NAME),
+        (LOCAL_TIMINGS, TIMINGS_BLOB_NAME),
+        (LOCAL_INDEX, INDEX_BLOB_NAME),
+    )
+    for local_path, blob_name in state_files:
+        if local_path.exists():
+            bucket.blob(blob_name).upload_from_filename(str(local_path))
+            LOGGER.info(f"Uploaded {local_path.name} -> gs://{BUCKET_NAME}/{blob_name}")
 
     # Upload Images
     images_dir = LOCAL_OUTPUT_DIR / "images"
@@ -50,9 +122,17 @@ def upload_outputs():
 
 def main():
     try:
-        # 1. Download Input
-        download_input()
-        
+        # 1. Download Input (kept in memory; parsed straight from the bytes)
+        input_source = None
+        tenant_sources = None
+        if TENANT_INPUTS:
+            tenant_sources = download_tenant_inputs()
+        else:
+            input_source = download_input()
+
+        # Stream result files and screenshots to GCS instead of staging them in @output
+        amazon_search_rank.ARTIFACT_STORE = artifact_store.GcsStore(BUCKET_NAME)
+
         # 2. Run Scraper
         # Configure arguments for amazon_search_rank
         sys.argv = ["amazon_search_rank.py"]
@@ -66,8 +146,50 @@ def main():
         if pages:
             sys.argv.extend(["--pages", pages])
 
+        output_format = os.environ.get("OUTPUT_FORMAT")
+        if output_format:
+            sys.argv.extend(["--output-format", output_format])
+
+        sys.argv.extend(["--history-days", str(HISTORY_DAYS)])
+
+        # Pick each keyword's page depth from recent rank history
+        if os.environ.get("ADAPTIVE_PAGES", "false").lower() == "true":
+            download_history()
+            sys.argv.append("--adaptive-pages")
+
+        # Crawl keywords at a frequency matching their rank volatility
+        if os.environ.get("VOLATILITY_SCHEDULE", "false").lower() == "true":
+            if os.environ.get("ADAPTIVE_PAGES", "false").lower() != "true":
+                download_history()
+            download_state()
+            sys.argv.append("--volatility-schedule")
+
+        # Finish inside the job timeout: highest-priority keywords first
+        deadline = os.environ.get("DEADLINE_SECONDS")
+        if deadline:
+            sys.argv.extend(["--deadline", deadline])
+        download_state(TIMINGS_BLOB_NAME, LOCAL_TIMINGS)
+
+        # Chrome's per-page timing / transfer / DOM / heap numbers
+        if os.environ.get("PAGE_METRICS", "false").lower() == "true":
+            sys.argv.append("--page-metrics")
+
+        # Store every ranked card so any ASIN can be answered later
+        if os.environ.get("FULL_SERP", "false").lower() == "true":
+            sys.argv.append("--full-serp")
+
+        # Keep the ASIN -> keyword visibility index across runs
+        if os.environ.get("VISIBILITY_INDEX", "false").lower() == "true":
+            download_state(INDEX_BLOB_NAME, LOCAL_INDEX)
+            sys.argv.extend(["--visibility-index", str(LOCAL_INDEX)])
+
+        # Page fetch engine (selenium / cdp / http); the input's BACKEND column overrides it
+        backend = os.environ.get("FETCH_BACKEND")
+        if backend:
+            sys.argv.extend(["--backend", backend])
+
         LOGGER.info(f"Starting scraper with args: {sys.argv}")
-        amazon_search_rank.main()
+        amazon_search_rank.main(input_source, tenant_sources)
         
         # 3. Upload Outputs
         upload_outputs()
@@ -0,0 +1,223 @@
+"""Crawl planning from rank history.
+
+Decides how much browser work each keyword deserves instead of scanning
+every keyword to the same global depth, every run:
+
+- plan_page_depths(): how many result pages to scan per keyword,
+- due_keywords(): which keywords to crawl now, from rank volatility and
+  priority, with big_rank_changes() flagging keywords to re-scan,
+- plan_for_deadline(): which keywords fit a hard time budget, highest
+  priority first, from per-keyword timings of earlier runs.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import statistics
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.planner")
+
+PAGE_DEPTH_MARGIN = 1
+FULL_SCAN_EVERY_DAYS = 7
+
+
+def is_verification_day(keyword: str, every_days: int, today: dt.date) -> bool:
+    """Spread full-depth verification scans evenly: each keyword gets one every ``every_days`` days."""
+    if every_days <= 1:
+        return True
+    return zlib.crc32(keyword.encode("utf-8")) % every_days == today.toordinal() % every_days
+
+
+def plan_page_depths(
+    targets: Dict[str, Set[str]],
+    history: Iterable[RankRow],
+    max_pages: int,
+    margin: int = PAGE_DEPTH_MARGIN,
+    full_scan_every_days: int = FULL_SCAN_EVERY_DAYS,
+    today: Optional[dt.date] = None,
+) -> Dict[str, int]:
+    """Choose a page depth per keyword from where its target ASINs were seen recently.
+
+    A keyword is scanned to the deepest page any of its target ASINs reached
+    in the history window plus ``margin`` pages, capped at ``max_pages``. It
+    gets the full depth when any target ASIN is missing from its history
+    (new ASIN, or it fell out of the scanned pages) and on its periodic
+    verification day.
+    """
+    today = today or dt.date.today()
+    deepest: Dict[Tuple[str, str], int] = {}
+    for row in history:
+        key = (row.keyword, row.asin)
+        if row.page > deepest.get(key, 0):
+            deepest[key] = row.page
+
+    plan: Dict[str, int] = {}
+    for keyword, asins in targets.items():
+        pages_seen = [deepest.get((keyword, asin)) for asin in asins]
+        if None in pages_seen or is_verification_day(keyword, full_scan_every_days, today):
+            plan[keyword] = max_pages
+        else:
+            plan[keyword] = max(1, min(max_pages, max(pages_seen) + margin))
+
+    LOGGER.info(
+        f"Adaptive depth: {sum(plan.values())} page loads planned "
+        f"instead of {max_pages * len(targets)}."
+    )
+    return plan
+
+
+# ---------------------------------------------------------------------------
+# Volatility-based crawl frequency
+# ---------------------------------------------------------------------------
+MIN_INTERVAL_HOURS = 1.0
+MAX_INTERVAL_HOURS = 24.0
+# Mean rank movement per observation at which a keyword is crawled hourly
+VOLATILITY_FOR_MIN_INTERVAL = 10.0
+BIG_RANK_CHANGE = 10
+
+
+def _best_ranks(rows: Iterable[RankRow]) -> Dict[Tuple[str, str], List[Tuple[int, int]]]:
+    """(keyword, asin) -> [(hour, best rank)] in time order; one point per run hour."""
+    best: Dict[Tuple[str, str, int], int] = {}
+    for row in rows:
+        key = (row.keyword, row.asin, row.timestamp // 3600)
+        if row.rank < best.get(key, row.rank + 1):
+            best[key] = row.rank
+    series: Dict[Tuple[str, str], List[Tuple[int, int]]] = {}
+    for (keyword, asin, hour), rank in sorted(best.items(), key=lambda item: item[0][2]):
+        series.setdefault((keyword, asin), []).append((hour, rank))
+    return series
+
+
+def keyword_volatility(history: Iterable[RankRow]) -> Dict[str, float]:
+    """Mean absolute rank change between consecutive observations, per keyword."""
+    moves: Dict[str, List[int]] = {}
+    for (keyword, _asin), points in _best_ranks(history).items():
+        ranks = [rank for _, rank in points]
+        moves.setdefault(keyword, []).extend(abs(b - a) for a, b in zip(ranks, ranks[1:]))
+    return {keyword: sum(deltas) / len(deltas) for keyword, deltas in moves.items() if deltas}
+
+
+def crawl_interval_hours(volatility: Optional[float], priority: float = 1.0) -> float:
+    """Hours between crawls: hourly for volatile or important keywords, daily for stable ones.
+
+    Keywords without enough history count as volatile until they have it.
+    """
+    if volatility is None:
+        return MIN_INTERVAL_HOURS
+    stability = max(0.0, 1.0 - volatility / VOLATILITY_FOR_MIN_INTERVAL)
+    hours = MIN_INTERVAL_HOURS + (MAX_INTERVAL_HOURS - MIN_INTERVAL_HOURS) * stability
+    return max(MIN_INTERVAL_HOURS, min(MAX_INTERVAL_HOURS, hours / max(priority, 0.1)))
+
+
+def due_keywords(
+    targets: Dict[str, Set[str]],
+    history: Iterable[RankRow],
+    last_crawls: Dict[str, float],
+    priorities: Optional[Dict[str, float]] = None,
+    now: Optional[float] = None,
+) -> Dict[str, Set[str]]:
+    """Keep the keywords whose crawl interval has elapsed since their last crawl."""
+    now = now if now is not None else dt.datetime.now().timestamp()
+    priorities = priorities or {}
+    volatility = keyword_volatility(history)
+    due: Dict[str, Set[str]] = {}
+    for keyword, asins in targets.items():
+        interval = crawl_interval_hours(volatility.get(keyword), priorities.get(keyword, 1.0))
+        last = last_crawls.get(keyword)
+        # Small slack so an hourly cron does not miss an hourly keyword by seconds
+        if last is None or now - last >= interval * 3600 - 300:
+            due[keyword] = asins
+    LOGGER.info(f"{len(due)}/{len(targets)} keywords due for crawling.")
+    return due
+
+
+def big_rank_changes(
+    new_rows: Iterable[RankRow],
+    history: Iterable[RankRow],
+    targets: Dict[str, Set[str]],
+    threshold: int = BIG_RANK_CHANGE,
+) -> Set[str]:
+    """Keywords where a target ASIN with a prior rank moved by ``threshold``+ ranks or vanished.
+
+    ASINs without a baseline (new keywords, newly listed ASINs) never count.
+    """
+    previous: Dict[Tuple[str, str], int] = {
+        key: points[-1][1] for key, points in _best_ranks(history).items()
+    }
+    current: Dict[Tuple[str, str], int] = {}
+    for row in new_rows:
+        key = (row.keyword, row.asin)
+        current[key] = min(row.rank, current.get(key, row.rank))
+
+    changed: Set[str] = set()
+    for keyword, asins in targets.items():
+        for asin in asins:
+            before, after = previous.get((keyword, asin)), current.get((keyword, asin))
+            if before is None:
+                continue
+            if after is None or abs(after - before) >= threshold:
+                LOGGER.info(f"Big rank change for {keyword}/{asin}: {before} -> {after}")
+                changed.add(keyword)
+    return changed
+
+
+# ---------------------------------------------------------------------------
+# Deadline budget
+# ---------------------------------------------------------------------------
+DEFAULT_SECONDS_PER_PAGE = 15.0
+# Weight of the newest measurement in the per-keyword moving average
+TIMING_SMOOTHING = 0.3
+
+
+def update_timing(timings: Dict[str, float], keyword: str, seconds: float, pages: int) -> None:
+    """Fold one measured keyword run into its seconds-per-page moving average."""
+    if pages <= 0:
+        return
+    per_page = seconds / pages
+    previous = timings.get(keyword)
+    timings[keyword] = per_page if previous is None else (
+        TIMING_SMOOTHING * per_page + (1 - TIMING_SMOOTHING) * previous
+    )
+
+
+def estimate_cost(
+    keyword: str, pages: int, timings: Dict[str, float], default_per_page: float
+) -> float:
+    """Expected seconds to scrape ``pages`` pages of ``keyword``."""
+    return pages * timings.get(keyword, default_per_page)
+
+
+def plan_for_deadline(
+    targets: Dict[str, Set[str]],
+    page_plan: Dict[str, int],
+    timings: Dict[str, float],
+    budget_seconds: float,
+    priorities: Optional[Dict[str, float]] = None,
+    concurrency: int = 1,
+) -> Dict[str, Set[str]]:
+    """Keywords that fit in ``budget_seconds``, in the order they should run.
+
+    Highest priority first (input order breaks ties); a keyword too expensive
+    for what is left is skipped so cheaper lower-priority ones can still run.
+    Keywords without timings cost the median known seconds-per-page.
+    """
+    priorities = priorities or {}
+    default_per_page = statistics.median(timings.values()) if timings else DEFAULT_SECONDS_PER_PAGE
+    order = sorted(targets, key=lambda keyword: -priorities.get(keyword, 1.0))
+    remaining = budget_seconds * max(1, concurrency)
+    planned: Dict[str, Set[str]] = {}
+    for keyword in order:
+        cost = estimate_cost(keyword, page_plan.get(keyword, 1), timings, default_per_page)
+        if cost > remaining:
+            continue
+        planned[keyword] = targets[keyword]
+        remaining -= cost
+    LOGGER.info(
+        f"{len(planned)}/{len(targets)} keywords fit the {budget_seconds:.0f}s deadline budget."
+    )
+    return planned
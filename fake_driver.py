@@ -0,0 +1,493 @@
+"""In-process stand-in for Chrome + chromedriver, fed from JSON page fixtures.
+
+FakeWebDriver implements the part of Selenium's WebDriver / WebElement API
+that amazon_search_rank uses (find_element(s), get_attribute, rect,
+location, is_displayed, click/send_keys, tabs, screenshots and the known
+execute_script probes), so process_page(), get_item_type(),
+set_location_to_tokyo() and scrape_keyword() run without a browser or
+network. Every WebDriver command is counted in ``driver.commands`` and can
+be delayed by a configurable latency, which makes the round-trip cost of a
+code path measurable exactly (see benchmarks/bench_pipeline.py).
+
+Fixture layout (one site; every keyword gets the same result pages)::
+
+    {
+      "location_label": "お届け先 大阪府 530-0001",
+      "pages": [
+        {
+          "state": "results",            # PageState value; "captcha" clears on submit
+          "page_height": 9000,
+          "main_slot": {"x": 200, "y": 150, "width": 1200, "height": 8500},
+          "items": [
+            {"asin": "B0...", "x": 220, "y": 420, "width": 280, "height": 420,
+             "component_type": "sp-sponsored-result", "badges": ["スポンサー"],
+             "displayed": true}
+          ],
+          "labels": [{"text": "スポンサー", "x": 220, "y": 380}],
+          "metrics": {"Nodes": 5400, "JSHeapUsedSize": 31000000}
+        }
+      ]
+    }
+
+Result pages beyond the fixture are "no_results". Unknown scripts raise
+JavascriptException rather than returning something plausible.
+"""
+from __future__ import annotations
+
+import base64
+import itertools
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import parse_qs, urlparse
+
+from selenium.common.exceptions import (
+    JavascriptException,
+    NoSuchElementException,
+    NoSuchWindowException,
+)
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+import amazon_search_rank as asr
+import page_metrics
+
+# 1x1 transparent PNG
+BLANK_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+VIEWPORT = (1920, 1080)
+BADGES_SELECTOR = "span[aria-label], .s-label-popover"
+CONFIRM_SELECTOR = "#GLUXConfirmClose, [name='glowDoneButton']"
+LABEL_WORDS = ("スポンサー", "Sponsored")
+
+Latency = Union[float, Dict[str, float]]
+
+
+def load_fixture(path: Path) -> Dict[str, Any]:
+    with Path(path).open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeElement:
+    """A WebElement backed by fixture data; every accessor is one counted command."""
+
+    def __init__(
+        self,
+        driver: "FakeWebDriver",
+        attributes: Optional[Dict[str, str]] = None,
+        rect: Optional[Dict[str, float]] = None,
+        text: str = "",
+        displayed: bool = True,
+        children: Optional[List["FakeElement"]] = None,
+        on_click: Optional[Callable[[], None]] = None,
+        on_keys: Optional[Callable[[str], None]] = None,
+    ):
+        self._driver = driver
+        self._attributes = attributes or {}
+        self._rect = {"x": 0.0, "y": 0.0, "width": 0.0, "height": 0.0, **(rect or {})}
+        self._text = text
+        self._displayed = displayed
+        self._children = children or []
+        self._on_click = on_click
+        self._on_keys = on_keys
+
+    @property
+    def parent(self) -> "FakeWebDriver":
+        return self._driver
+
+    @property
+    def rect(self) -> Dict[str, float]:
+        self._driver._command("get_element_rect")
+        return dict(self._rect)
+
+    @property
+    def location(self) -> Dict[str, float]:
+        self._driver._command("get_element_rect")
+        return {"x": self._rect["x"], "y": self._rect["y"]}
+
+    @property
+    def size(self) -> Dict[str, float]:
+        self._driver._command("get_element_rect")
+        return {"width": self._rect["width"], "height": self._rect["height"]}
+
+    @property
+    def text(self) -> str:
+        self._driver._command("get_element_text")
+        return self._text if self._displayed else ""
+
+    def get_attribute(self, name: str) -> Optional[str]:
+        self._driver._command("get_attribute")
+        return self._attributes.get(name)
+
+    def is_displayed(self) -> bool:
+        self._driver._command("is_displayed")
+        return self._displayed
+
+    def is_enabled(self) -> bool:
+        self._driver._command("is_enabled")
+        return True
+
+    def find_elements(self, by: str = By.ID, value: Optional[str] = None) -> List["FakeElement"]:
+        self._driver._command("find_child_elements")
+        if by == By.CSS_SELECTOR and value == BADGES_SELECTOR:
+            return list(self._children)
+        return []
+
+    def find_element(self, by: str = By.ID, value: Optional[str] = None) -> "FakeElement":
+        found = self.find_elements(by, value)
+        if not found:
+            raise NoSuchElementException(f"No child element for {by}={value}")
+        return found[0]
+
+    def click(self) -> None:
+        self._driver._command("click_element")
+        if self._on_click is not None:
+            self._on_click()
+
+    def clear(self) -> None:
+        self._driver._command("clear_element")
+        if self._on_keys is not None:
+            self._on_keys("")
+
+    def send_keys(self, *values: str) -> None:
+        self._driver._command("send_keys_to_element")
+        if self._on_keys is not None:
+            self._on_keys("".join(values))
+
+
+class _SwitchTo:
+    def __init__(self, driver: "FakeWebDriver"):
+        self._driver = driver
+
+    def window(self, handle: str) -> None:
+        self._driver._command("switch_to_window")
+        if handle not in self._driver._tabs:
+            raise NoSuchWindowException(f"No window {handle}")
+        self._driver._current = handle
+
+
+class _Tab:
+    """Navigation state of one tab."""
+
+    def __init__(self, url: str = "about:blank"):
+        self.url = url
+        self.scroll_y = 0.0
+        self.search_text = ""
+        self.popover_open = False
+        self.zip_input = ""
+        self.captcha_cleared = False
+
+
+class FakeWebDriver:
+    """Selenium-compatible driver over a fixture site (see the module docstring).
+
+    ``latency`` is seconds slept per command, either one number or a dict of
+    command name -> seconds with an optional ``"default"``.
+    """
+
+    def __init__(self, fixture: Dict[str, Any], latency: Latency = 0.0):
+        self.fixture = fixture
+        self.latency = latency
+        self.commands: Counter = Counter()
+        self.location_label = fixture.get("location_label", "お届け先 東京都 100-0001")
+        self.window_size = VIEWPORT
+        self.switch_to = _SwitchTo(self)
+        self._handles = (f"fake-tab-{n}" for n in itertools.count(1))
+        first = next(self._handles)
+        self._tabs: Dict[str, _Tab] = {first: _Tab()}
+        self._current = first
+        self._page_cache: Dict[int, Dict[str, List[FakeElement]]] = {}
+        self._scripts: Dict[str, Callable[..., Any]] = {
+            asr.PAGE_STATE_SCRIPT: self._page_state_script,
+            asr.SCROLL_STEP_SCRIPT: self._scroll_step_script,
+            asr.EXTRACT_ITEMS_SCRIPT: self._extract_items_script,
+            page_metrics.PAGE_TIMING_SCRIPT: self._page_timing_script,
+            "return document.body.offsetWidth": lambda: VIEWPORT[0],
+            "return document.body.parentNode.scrollHeight": lambda: self._page_height(),
+            "arguments[0].click();": lambda element: element.click(),
+            "window.open(arguments[0], '_blank');": self._open_tab,
+        }
+
+    @classmethod
+    def from_fixture(cls, path: Path, latency: Latency = 0.0) -> "FakeWebDriver":
+        return cls(load_fixture(path), latency)
+
+    # -- accounting -----------------------------------------------------------
+    def _command(self, name: str) -> None:
+        self.commands[name] += 1
+        if isinstance(self.latency, dict):
+            delay = self.latency.get(name, self.latency.get("default", 0.0))
+        else:
+            delay = self.latency
+        if delay:
+            time.sleep(delay)
+
+    @property
+    def round_trips(self) -> int:
+        return sum(self.commands.values())
+
+    def reset_commands(self) -> None:
+        self.commands.clear()
+
+    # -- page model -----------------------------------------------------------
+    @property
+    def _tab(self) -> _Tab:
+        return self._tabs[self._current]
+
+    def _page_number(self) -> Optional[int]:
+        """Result page number of the current tab, None off the search pages."""
+        parsed = urlparse(self._tab.url)
+        if parsed.path.rstrip("/") != "/s":
+            return None
+        return int(parse_qs(parsed.query).get("page", ["1"])[0])
+
+    def _page(self) -> Optional[Dict[str, Any]]:
+        number = self._page_number()
+        pages = self.fixture.get("pages", [])
+        if number is None or not 1 <= number <= len(pages):
+            return None
+        return pages[number - 1]
+
+    def _state(self) -> str:
+        url = self._tab.url
+        if url.startswith("about:"):
+            return asr.PageState.OTHER.value
+        if self._page_number() is None:
+            return asr.PageState.LOCATION_POPOVER.value if self._tab.popover_open else asr.PageState.OTHER.value
+        page = self._page()
+        if page is None:
+            return asr.PageState.NO_RESULTS.value
+        state = page.get("state", asr.PageState.RESULTS.value)
+        if state == asr.PageState.CAPTCHA.value and self._tab.captcha_cleared:
+            return asr.PageState.RESULTS.value
+        return state
+
+    def _page_height(self) -> float:
+        page = self._page() or {}
+        return float(page.get("page_height", VIEWPORT[1]))
+
+    def _elements(self) -> Dict[str, List[FakeElement]]:
+        """Result cards and sponsored labels of the current page (built once per page)."""
+        number = self._page_number() or 0
+        cached = self._page_cache.get(number)
+        if cached is not None:
+            return cached
+        page = self._page() or {}
+        items = [
+            FakeElement(
+                self,
+                {"data-asin": item.get("asin", ""), "data-component-type": item.get("component_type", "")},
+                {key: item.get(key, 0.0) for key in ("x", "y", "width", "height")},
+                displayed=item.get("displayed", True),
+                children=[FakeElement(self, {"aria-label": badge}, text=badge)
+                          for badge in item.get("badges", [])],
+            )
+            for item in page.get("items", [])
+        ]
+        labels = [
+            FakeElement(
+                self, {}, {"x": label.get("x", 0.0), "y": label["y"], "width": 60.0, "height": 16.0},
+                text=label["text"], displayed=label.get("displayed", True),
+            )
+            for label in page.get("labels", [])
+        ]
+        main = page.get("main_slot")
+        elements = {
+            "items": items,
+            "labels": labels,
+            "main": [FakeElement(self, {}, main)] if main else [],
+        }
+        self._page_cache[number] = elements
+        return elements
+
+    # -- navigation -----------------------------------------------------------
+    def _navigate(self, url: str) -> None:
+        tab = self._tab
+        tab.url = url
+        tab.scroll_y = 0.0
+        tab.popover_open = False
+        tab.captcha_cleared = False
+
+    def _next_page_url(self) -> Optional[str]:
+        number = self._page_number()
+        if number is None:
+            return None
+        keyword = parse_qs(urlparse(self._tab.url).query).get("k", [""])[0]
+        return asr.search_url(keyword, number + 1)
+
+    def _open_tab(self, url: str) -> None:
+        handle = next(self._handles)
+        self._tabs[handle] = _Tab(url)
+
+    def _type_search(self, text: str) -> None:
+        if not text:
+            self._tab.search_text = ""
+        elif text.endswith(Keys.ENTER):
+            self._tab.search_text += text[:-1]
+            self._navigate(asr.search_url(self._tab.search_text, 1))
+        else:
+            self._tab.search_text += text
+
+    def _type_zip(self, text: str) -> None:
+        self._tab.zip_input = text and self._tab.zip_input + text
+
+    def _apply_zip(self) -> None:
+        if self._tab.zip_input:
+            self.location_label = f"お届け先 {self._tab.zip_input}"
+        self._tab.popover_open = False
+
+    def _clear_captcha(self) -> None:
+        self._tab.captcha_cleared = True
+
+    # -- WebDriver API ----------------------------------------------------------
+    def get(self, url: str) -> None:
+        self._command("get")
+        self._navigate(url)
+
+    @property
+    def current_url(self) -> str:
+        self._command("get_current_url")
+        return self._tab.url
+
+    @property
+    def title(self) -> str:
+        self._command("get_title")
+        return "Amazon.co.jp" if self._page_number() is None else "Amazon.co.jp : 検索結果"
+
+    @property
+    def page_source(self) -> str:
+        self._command("get_page_source")
+        return f"<html><!-- fake page {self._tab.url} state={self._state()} --></html>"
+
+    @property
+    def window_handles(self) -> List[str]:
+        self._command("get_window_handles")
+        return list(self._tabs)
+
+    @property
+    def current_window_handle(self) -> str:
+        self._command("get_current_window_handle")
+        return self._current
+
+    def close(self) -> None:
+        self._command("close")
+        del self._tabs[self._current]
+
+    def quit(self) -> None:
+        self._command("quit")
+        self._tabs.clear()
+
+    def set_window_size(self, width: int, height: int, windowHandle: str = "current") -> None:
+        self._command("set_window_rect")
+        self.window_size = (width, height)
+
+    def get_screenshot_as_png(self) -> bytes:
+        self._command("screenshot")
+        return BLANK_PNG
+
+    def get_cookies(self) -> List[Dict[str, Any]]:
+        self._command("get_all_cookies")
+        return list(self.fixture.get("cookies", []))
+
+    def execute_cdp_cmd(self, cmd: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._command("execute_cdp_cmd")
+        if cmd == "Performance.getMetrics":
+            metrics = (self._page() or {}).get("metrics", {})
+            return {"metrics": [{"name": name, "value": value} for name, value in metrics.items()]}
+        return {}
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        self._command("execute_script")
+        handler = self._scripts.get(script)
+        if handler is None:
+            raise JavascriptException(f"FakeWebDriver cannot run script: {script.strip()[:60]!r}")
+        return handler(*args)
+
+    def find_elements(self, by: str = By.ID, value: Optional[str] = None) -> List[FakeElement]:
+        self._command("find_elements")
+        return self._find(by, value)
+
+    def find_element(self, by: str = By.ID, value: Optional[str] = None) -> FakeElement:
+        self._command("find_element")
+        found = self._find(by, value)
+        if not found:
+            raise NoSuchElementException(f"No element for {by}={value}")
+        return found[0]
+
+    def _find(self, by: str, value: Optional[str]) -> List[FakeElement]:
+        state = self._state()
+        if by == By.XPATH and value and any(word in value for word in LABEL_WORDS):
+            return list(self._elements()["labels"])
+        if by == By.CSS_SELECTOR:
+            if value == asr.RESULTS_SELECTOR:
+                return list(self._elements()["items"])
+            if value == ".s-main-slot":
+                return list(self._elements()["main"])
+            if value == asr.NEXT_BUTTON_SELECTOR and state == asr.PageState.RESULTS.value:
+                return [self._next_button()]
+            if value == "button[type='submit']" and state == asr.PageState.CAPTCHA.value:
+                return [FakeElement(self, {"type": "submit"}, on_click=self._clear_captcha)]
+            if value == CONFIRM_SELECTOR and self._tab.popover_open:
+                return [FakeElement(self, {"name": "glowDoneButton"}, on_click=self._apply_zip)]
+            return []
+        if by != By.ID or state in (asr.PageState.CAPTCHA.value, asr.PageState.ERROR.value):
+            return []
+        if value == "glow-ingress-line2":
+            return [FakeElement(self, {"id": value}, text=self.location_label)]
+        if value == "nav-global-location-popover-link":
+            return [FakeElement(self, {"id": value}, on_click=lambda: setattr(self._tab, "popover_open", True))]
+        if value == "GLUXZipUpdateInput" and self._tab.popover_open:
+            return [FakeElement(self, {"id": value}, on_keys=self._type_zip)]
+        if value == "GLUXZipUpdate" and self._tab.popover_open:
+            return [FakeElement(self, {"id": value}, on_click=self._apply_zip)]
+        if value == "twotabsearchtextbox" and self._tab.url != "about:blank":
+            return [FakeElement(self, {"id": value}, on_keys=self._type_search)]
+        return []
+
+    def _next_button(self) -> FakeElement:
+        number = self._page_number() or 0
+        last = number >= len(self.fixture.get("pages", []))
+        url = self._next_page_url()
+        return FakeElement(
+            self,
+            {
+                "href": url,
+                "class": "s-pagination-item s-pagination-next"
+                + (" s-pagination-disabled" if last else ""),
+            },
+            on_click=None if last else lambda: self._navigate(url),
+        )
+
+    # -- in-page scripts --------------------------------------------------------
+    def _page_state_script(self, selectors: Dict[str, str]) -> str:
+        return self._state()
+
+    def _scroll_step_script(self, selector: str) -> List[float]:
+        height = self._page_height()
+        tab = self._tab
+        tab.scroll_y = min(tab.scroll_y + VIEWPORT[1], max(height - VIEWPORT[1], 0.0))
+        count = len((self._page() or {}).get("items", []))
+        return [count, height, tab.scroll_y + VIEWPORT[1]]
+
+    def _extract_items_script(self, selector: str) -> Dict[str, List[Any]]:
+        page = self._page() or {}
+        items = []
+        for item in page.get("items", []):
+            asin = (item.get("asin") or "").strip()
+            if not asin or not item.get("displayed", True):
+                continue
+            hint = "sponsored" in (item.get("component_type") or "").lower() or any(
+                "sponsored" in badge.lower() or "スポンサー" in badge for badge in item.get("badges", [])
+            )
+            items.append([asin.upper(), item["x"], item["y"], item["width"], item["height"], hint])
+        labels = [
+            label["y"] for label in page.get("labels", [])
+            if label.get("displayed", True) and label["text"].strip() and len(label["text"]) < 50
+        ]
+        return {"items": items, "labels": labels}
+
+    def _page_timing_script(self) -> Dict[str, float]:
+        return dict((self._page() or {}).get("timing", {}))
@@ -0,0 +1,621 @@
+"""Interchangeable page-fetch engines behind one small contract.
+
+Every backend can navigate to a URL, report the PageState of what it
+loaded, extract the ranked items of a results page, take a screenshot and
+export/import its cookies. scrape_keyword() drives any of them the same
+way, so the engine can be chosen per run (--backend) or per keyword (the
+BACKEND input column):
+
+    selenium  Chrome through chromedriver (the default scraping path's engine)
+    cdp       Chrome launched directly and driven over its DevTools websocket;
+              no chromedriver process, full-page screenshots
+    http      plain HTTPS requests ranked by serp_parser; no browser at all,
+              no screenshots, and the delivery location comes from cookies
+
+The plain-HTTP backend cannot open the location popover, so seed it with
+the cookies of a browser session (--cookies FILE, written by the browser
+backends after they set the delivery location).
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import http.cookiejar
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from lxml import html as lxml_html
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+import amazon_search_rank as asr
+import serp_parser
+from amazon_search_rank import PageState
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.backends")
+
+CHROME_BINARIES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")
+CHROME_START_TIMEOUT = 30
+HTTP_TIMEOUT = 30
+# Start-up order of the backends planned for a run: browser sessions (which
+# set the delivery location) start before the HTTP backend and hand it their cookies
+BACKEND_ORDER = ("selenium", "cdp", "http")
+# Keys of a Selenium cookie dict that add_cookie() accepts
+SELENIUM_COOKIE_KEYS = ("name", "value", "domain", "path", "secure", "httpOnly", "expiry")
+
+Cookie = Dict[str, Any]
+
+
+class FetchBackend(ABC):
+    """The contract; ``renders`` backends run a real browser engine."""
+
+    name = ""
+    renders = False
+    # Object with execute_script/execute_cdp_cmd for page metrics, if any
+    cdp_target: Any = None
+
+    def prepare(self) -> None:
+        """Start the engine and settle the session (home page, location)."""
+
+    def start_keyword(self) -> None:
+        """Called before each keyword (e.g. to recycle a browser)."""
+
+    @abstractmethod
+    def navigate(self, url: str) -> None:
+        ...
+
+    @abstractmethod
+    def page_state(self) -> PageState:
+        ...
+
+    def handle_captcha(self, state: PageState) -> bool:
+        """Try to get past a CAPTCHA page; True if something was attempted."""
+        LOGGER.warning(f"CAPTCHA detected; the {self.name} backend cannot solve it.")
+        asr.RUN_REPORT.count("captchas_seen")
+        return False
+
+    def settle(self) -> None:
+        """Let lazily loaded cards appear before extraction."""
+
+    @abstractmethod
+    def extract_items(
+        self,
+        keyword: str,
+        page: int,
+        target_asins: Optional[Set[str]],
+        cumulative_offset: int,
+    ) -> Tuple[List[RankRow], int]:
+        """Rank the loaded results page; returns (rows, cards on page)."""
+
+    def screenshot(self) -> Optional[bytes]:
+        """PNG of the loaded page, or None if the engine cannot render."""
+        return None
+
+    @abstractmethod
+    def cookies(self) -> List[Cookie]:
+        """Session cookies as Selenium-style dicts."""
+
+    @abstractmethod
+    def set_cookies(self, cookies: List[Cookie]) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+def _rank_extracted(target, keyword: str, page: int, target_asins, cumulative_offset: int):
+    """Batched extraction shared by the browser backends."""
+    extracted = target.execute_script(asr.EXTRACT_ITEMS_SCRIPT, asr.RESULTS_SELECTOR)
+    return asr.rank_items(
+        extracted["items"], extracted["labels"], keyword, page,
+        target_asins, cumulative_offset, int(time.time()),
+    )
+
+
+def _wait_state(target) -> PageState:
+    try:
+        return asr.wait_for_results(target)
+    except TimeoutException:
+        return asr.classify_page(target)
+
+
+# ---------------------------------------------------------------------------
+# Selenium
+# ---------------------------------------------------------------------------
+class SeleniumBackend(FetchBackend):
+    """Chrome through chromedriver, recycled by a BrowserWatchdog."""
+
+    name = "selenium"
+    renders = True
+
+    def __init__(self, headless: bool = True, max_keywords: int = asr.RECYCLE_EVERY_KEYWORDS,
+                 max_memory_mb: float = asr.MAX_BROWSER_MEMORY_MB):
+        self.watchdog = asr.BrowserWatchdog(headless, max_keywords, max_memory_mb)
+
+    @property
+    def cdp_target(self):
+        return self.watchdog.driver
+
+    @property
+    def driver(self):
+        if self.watchdog.driver is None:
+            self.watchdog.acquire()
+        return self.watchdog.driver
+
+    def prepare(self) -> None:
+        asr.prepare_session(self.driver)
+
+    def start_keyword(self) -> None:
+        self.watchdog.acquire()
+
+    def navigate(self, url: str) -> None:
+        self.driver.get(url)
+
+    def page_state(self) -> PageState:
+        return _wait_state(self.driver)
+
+    def handle_captcha(self, state: PageState) -> bool:
+        return asr.handle_captcha(self.driver, state)
+
+    def settle(self) -> None:
+        asr.scroll_until_stable(self.driver)
+
+    def extract_items(self, keyword, page, target_asins, cumulative_offset):
+        return _rank_extracted(self.driver, keyword, page, target_asins, cumulative_offset)
+
+    def screenshot(self) -> Optional[bytes]:
+        return self.driver.get_screenshot_as_png()
+
+    def cookies(self) -> List[Cookie]:
+        return self.driver.get_cookies()
+
+    def set_cookies(self, cookies: List[Cookie]) -> None:
+        # Cookies can only be set for the domain that is currently loaded
+        self.driver.get(asr.AMAZON_URL)
+        for cookie in cookies:
+            try:
+                self.driver.add_cookie({k: cookie[k] for k in SELENIUM_COOKIE_KEYS if k in cookie})
+            except WebDriverException:
+                continue
+
+    def close(self) -> None:
+        self.watchdog.quit()
+
+
+# ---------------------------------------------------------------------------
+# Direct CDP (no chromedriver)
+# ---------------------------------------------------------------------------
+def find_chrome() -> str:
+    binary = os.environ.get("CHROME_BIN") or next(
+        (path for path in map(shutil.which, CHROME_BINARIES) if path), None
+    )
+    if not binary:
+        raise WebDriverException("Chrome not found; set CHROME_BIN")
+    return binary
+
+
+def launch_chrome(headless: bool = True) -> Tuple[subprocess.Popen, str, str]:
+    """Start Chrome with a DevTools port; returns (process, host:port, profile dir)."""
+    profile = tempfile.mkdtemp(prefix="rank-chrome-")
+    command = [
+        find_chrome(),
+        *(["--headless=new"] if headless else []),
+        *asr.CHROME_ARGUMENTS,
+        f"--accept-lang={asr.ACCEPT_LANGUAGES}",
+        "--remote-debugging-port=0",
+        f"--user-data-dir={profile}",
+        "--no-first-run",
+        "--no-default-browser-check",
+        "about:blank",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port_file = Path(profile) / "DevToolsActivePort"
+    deadline = time.monotonic() + CHROME_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        if port_file.exists():
+            lines = port_file.read_text().split()
+            if lines:
+                return process, f"127.0.0.1:{lines[0]}", profile
+        time.sleep(0.1)
+    stop_chrome(process, profile)
+    raise WebDriverException("Chrome did not open its DevTools port")
+
+
+def stop_chrome(process: subprocess.Popen, profile: str) -> None:
+    """Stop a launch_chrome() browser and delete its temporary profile."""
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    shutil.rmtree(profile, ignore_errors=True)
+
+
+class CdpBackend(FetchBackend):
+    """A Chrome process of its own, driven over CDP like browser_contexts sessions."""
+
+    name = "cdp"
+    renders = True
+
+    def __init__(self, headless: bool = True):
+        import browser_contexts
+
+        self.process, self.address, self.profile = launch_chrome(headless)
+        try:
+            self.session = browser_contexts.ContextSession(self.address)
+        except Exception:
+            stop_chrome(self.process, self.profile)
+            raise
+        self.cdp_target = self.session
+
+    def prepare(self) -> None:
+        self.session.prepare()
+
+    def navigate(self, url: str) -> None:
+        self.session.get(url)
+
+    def page_state(self) -> PageState:
+        return _wait_state(self.session)
+
+    def handle_captcha(self, state: PageState) -> bool:
+        return asr.handle_captcha(self.session, state)
+
+    def settle(self) -> None:
+        asr.scroll_until_stable(self.session)
+
+    def extract_items(self, keyword, page, target_asins, cumulative_offset):
+        return _rank_extracted(self.session, keyword, page, target_asins, cumulative_offset)
+
+    def screenshot(self) -> Optional[bytes]:
+        # captureBeyondViewport alone still captures only the viewport; clip to the whole page
+        metrics = self.session.execute_cdp_cmd("Page.getLayoutMetrics", {})
+        size = metrics.get("cssContentSize") or metrics["contentSize"]
+        clip = {"x": 0, "y": 0, "width": size["width"], "height": size["height"], "scale": 1}
+        result = self.session.execute_cdp_cmd(
+            "Page.captureScreenshot", {"format": "png", "captureBeyondViewport": True, "clip": clip}
+        )
+        return base64.b64decode(result["data"])
+
+    def cookies(self) -> List[Cookie]:
+        return self.session.get_cookies()
+
+    def set_cookies(self, cookies: List[Cookie]) -> None:
+        self.session.set_cookies(cookies)
+
+    def close(self) -> None:
+        try:
+            self.session.close()
+        finally:
+            stop_chrome(self.process, self.profile)
+
+
+# ---------------------------------------------------------------------------
+# Plain HTTP
+# ---------------------------------------------------------------------------
+def classify_html(root, url: str, status: int) -> PageState:
+    """PAGE_STATE_SCRIPT's checks on a parsed HTML document."""
+    if "validateCaptcha" in url or root.xpath("//form[contains(@action, 'validateCaptcha')]"):
+        return PageState.CAPTCHA
+    if root.xpath(
+        "//a[contains(@href, 'cs_404_link') or contains(@href, 'cs_503_link')]"
+        " | //img[contains(@alt, 'Dogs of Amazon')]"
+    ):
+        return PageState.DOG_PAGE
+    if status >= 400:
+        return PageState.ERROR
+    main_slots = root.xpath(serp_parser.MAIN_SLOT_XPATH)
+    if main_slots and any(
+        (card.get("data-asin") or "").strip() for card in main_slots[0].xpath(serp_parser.CARD_XPATH)
+    ):
+        return PageState.RESULTS
+    if main_slots or root.xpath(
+        "//*[contains(concat(' ', normalize-space(@class), ' '), ' s-no-results-filler ')"
+        " or @data-component-type='s-no-results']"
+    ):
+        return PageState.NO_RESULTS
+    return PageState.OTHER
+
+
+class HttpBackend(FetchBackend):
+    """Search pages fetched over HTTPS and ranked in DOM order (serp_parser)."""
+
+    name = "http"
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar))
+        self.opener.addheaders = [
+            ("User-Agent", asr.USER_AGENT),
+            ("Accept", "text/html,application/xhtml+xml"),
+            ("Accept-Language", asr.ACCEPT_LANGUAGES),
+            ("Accept-Encoding", "gzip"),
+        ]
+        self.url = ""
+        self.status = 0
+        self.root = None
+
+    def prepare(self) -> None:
+        self.navigate(asr.AMAZON_URL)
+        if not any(cookie.name == "session-id" for cookie in self.jar):
+            LOGGER.info("HTTP backend has no seeded session; results use Amazon's default location.")
+
+    def navigate(self, url: str) -> None:
+        try:
+            with self.opener.open(url, timeout=self.timeout) as response:
+                self.status, self.url = response.status, response.geturl()
+                body = response.read()
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            # Error pages (e.g. the 503 "dogs" page) still carry a body to classify
+            self.status, self.url = e.code, url
+            body, headers = e.read(), e.headers
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        charset = headers.get_content_charset() or "utf-8"
+        self.root = lxml_html.fromstring(body.decode(charset, errors="replace") or "<html/>")
+
+    def page_state(self) -> PageState:
+        if self.root is None:
+            return PageState.OTHER
+        return classify_html(self.root, self.url, self.status)
+
+    def extract_items(self, keyword, page, target_asins, cumulative_offset):
+        if asr.VISIBILITY_INDEX is None:
+            return serp_parser.parse_serp_tree(
+                self.root, keyword, page, target_asins, cumulative_offset, int(time.time())
+            )
+        rows, items_count = serp_parser.parse_serp_tree(
+            self.root, keyword, page, None, cumulative_offset, int(time.time())
+        )
+        asr.VISIBILITY_INDEX.add_rows(rows)
+        if target_asins is not None:
+            rows = [row for row in rows if row.asin in target_asins]
+        return rows, items_count
+
+    def cookies(self) -> List[Cookie]:
+        cookies = []
+        for c in self.jar:
+            cookie = {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                      "secure": c.secure, "httpOnly": c.has_nonstandard_attr("HttpOnly")}
+            if c.expires:
+                cookie["expiry"] = c.expires
+            cookies.append(cookie)
+        return cookies
+
+    def set_cookies(self, cookies: List[Cookie]) -> None:
+        for c in cookies:
+            domain = c.get("domain") or ".amazon.co.jp"
+            expires = c.get("expiry") or c.get("expires")
+            self.jar.set_cookie(http.cookiejar.Cookie(
+                0, c["name"], c["value"], None, False,
+                domain, True, domain.startswith("."),
+                c.get("path", "/"), True, bool(c.get("secure")),
+                int(expires) if expires and expires > 0 else None, not expires,
+                None, None, {"HttpOnly": None} if c.get("httpOnly") else {},
+            ))
+
+
+BACKENDS = {
+    "selenium": SeleniumBackend,
+    "cdp": CdpBackend,
+    "http": HttpBackend,
+}
+
+
+# ---------------------------------------------------------------------------
+# Scraping over a backend
+# ---------------------------------------------------------------------------
+def scrape_keyword(
+    backend: FetchBackend,
+    keyword: str,
+    asins: Optional[Set[str]],
+    pages: int = asr.MAX_PAGES,
+    take_shots: bool = False,
+    deadline: Optional[asr.RunDeadline] = None,
+) -> List[RankRow]:
+    """Open result pages 1..``pages`` by URL and rank them with ``backend``."""
+    report = asr.RUN_REPORT
+    results: List[RankRow] = []
+    cumulative_offset = 0
+    reached = False  # a results or no-results page was seen
+    fetched = 0  # pages ranked
+    LOGGER.info(f"Searching for: {keyword} ({backend.name})")
+    report.count("keywords_attempted")
+    started = time.monotonic()
+    try:
+        backend.start_keyword()
+        for page in range(1, pages + 1):
+            if page > 1 and deadline is not None and deadline.expired():
+                LOGGER.warning(f"Deadline reached; stopping {keyword} before page {page}.")
+                break
+            try:
+                with report.phase("wait"):
+                    backend.navigate(asr.search_url(keyword, page))
+                    state = backend.page_state()
+                    if state is PageState.CAPTCHA and backend.handle_captcha(state):
+                        state = backend.page_state()
+                if state is PageState.NO_RESULTS:
+                    reached = True
+                if state is not PageState.RESULTS:
+                    LOGGER.info(f"{keyword} page {page}: {state.value}; stopping.")
+                    break
+                with report.phase("scroll"):
+                    backend.settle()
+                with report.phase("extract"):
+                    rows, items_count = backend.extract_items(keyword, page, asins, cumulative_offset)
+                reached = True
+                report.count("pages_fetched")
+                fetched += 1
+                if take_shots:
+                    _save_screenshot(backend, keyword, page)
+                if asr.PAGE_METRICS is not None and backend.cdp_target is not None:
+                    asr.PAGE_METRICS.record(backend.cdp_target, keyword, page)
+            except Exception as e:
+                LOGGER.error(f"{keyword} page {page} failed: {e}")
+                break
+            results.extend(rows)
+            cumulative_offset += items_count
+    finally:
+        report.keyword_finished(keyword, reached, fetched)
+        report.observe("keyword", time.monotonic() - started)
+    return results
+
+
+def _save_screenshot(backend: FetchBackend, keyword: str, page: int) -> None:
+    try:
+        with asr.RUN_REPORT.phase("screenshot"):
+            png = backend.screenshot()
+            if png is None:
+                return
+            location = asr.ARTIFACT_STORE.put_bytes("images", asr.screenshot_filename(keyword, page), png)
+        asr.RUN_REPORT.count("screenshots_taken")
+        LOGGER.info(f"Screenshot saved: {location}")
+    except Exception as e:
+        LOGGER.warning(f"Failed to take screenshot: {e}")
+
+
+class BackendPool:
+    """One lazily started backend per engine, sharing session cookies."""
+
+    def __init__(self, args, planned: Iterable[str] = ()):
+        self.args = args
+        self.planned = set(planned)  # backends this run will use
+        self.cookies_file: Optional[Path] = args.cookies
+        self.backends: Dict[str, FetchBackend] = {}
+        self.cookies: List[Cookie] = []
+        self.failed: Set[str] = set()
+        if self.cookies_file is not None and self.cookies_file.exists():
+            self.cookies = json.loads(self.cookies_file.read_text(encoding="utf-8"))
+
+    def _create(self, name: str) -> FetchBackend:
+        if name == "selenium":
+            return SeleniumBackend(True, self.args.recycle_every, self.args.max_browser_mb)
+        return BACKENDS[name]()
+
+    def get(self, name: str) -> FetchBackend:
+        backend = self.backends.get(name)
+        if backend is not None:
+            return backend
+        if name in self.failed:
+            raise WebDriverException(f"The {name} backend failed to start earlier")
+        if not BACKENDS[name].renders:
+            # Let a planned browser set the delivery location first and pass on its cookies
+            for browser in BACKEND_ORDER:
+                if (browser in self.planned and BACKENDS[browser].renders
+                        and browser not in self.backends and browser not in self.failed):
+                    try:
+                        self.get(browser)
+                    except Exception as e:
+                        LOGGER.warning(f"Could not start the {browser} backend for its cookies: {e}")
+        try:
+            backend = self._create(name)
+        except Exception:
+            self.failed.add(name)
+            raise
+        try:
+            if self.cookies:
+                backend.set_cookies(self.cookies)
+            backend.prepare()
+        except Exception:
+            self.failed.add(name)
+            backend.close()
+            raise
+        self.backends[name] = backend
+        if backend.renders:
+            # The browser has set the delivery location; pass it on
+            self.cookies = backend.cookies()
+            if self.cookies_file is not None:
+                self.cookies_file.parent.mkdir(parents=True, exist_ok=True)
+                self.cookies_file.write_text(json.dumps(self.cookies, ensure_ascii=False), encoding="utf-8")
+        return backend
+
+    def close(self) -> None:
+        for name, backend in self.backends.items():
+            try:
+                backend.close()
+            except Exception as e:
+                LOGGER.warning(f"Error while closing the {name} backend: {e}")
+        self.backends.clear()
+
+
+def run_backends(
+    targets: Dict[str, Set[str]],
+    args,
+    backend_plan: Dict[str, str],
+    page_plan: Dict[str, int],
+    deadline: Optional[asr.RunDeadline] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[List[RankRow], List[RankRow]]:
+    """Scrape each keyword with its planned backend; returns (target rows, SERP rows).
+
+    Keywords run in the given (priority) order, each on its backend; backends
+    start on first use, browsers before the HTTP backend (BACKEND_ORDER).
+    run_targets() sends only the keywords on the cdp/http backends here;
+    --contexts, --pipeline and --parallel-pages apply to the Selenium path.
+    """
+    import crawl_planner
+
+    plan: Dict[str, str] = {}
+    for keyword, name in backend_plan.items():
+        if name not in BACKENDS:
+            LOGGER.warning(f"Unknown backend {name!r} for {keyword}; using {args.backend}.")
+            name = args.backend
+        plan[keyword] = name
+    keywords = list(targets)  # plan_for_deadline() order
+
+    all_results: List[RankRow] = []
+    serp_rows: List[RankRow] = []
+    pool = BackendPool(args, plan.values())
+    done = 0
+    try:
+        for done, keyword in enumerate(keywords):
+            if deadline is not None and deadline.expired():
+                deadline.skipped.update(keywords[done:])
+                LOGGER.warning(f"Deadline reached; {len(keywords) - done} keyword(s) left unscraped.")
+                break
+            asins = targets[keyword]
+            started = time.monotonic()
+            try:
+                backend = pool.get(plan[keyword])
+            except (WebDriverException, OSError) as e:
+                LOGGER.error(f"Could not start the {plan[keyword]} backend for {keyword}: {e}")
+                asr.RUN_REPORT.count("keywords_attempted")
+                asr.RUN_REPORT.count("keywords_failed")
+                continue
+            keyword_rows = scrape_keyword(
+                backend, keyword, None if args.full_serp else asins,
+                page_plan[keyword], args.screenshot, deadline,
+            )
+            if args.full_serp:
+                serp_rows.extend(keyword_rows)
+                all_results.extend(asr.select_targets(keyword_rows, {keyword: asins}))
+            else:
+                all_results.extend(keyword_rows)
+            if deadline is not None and deadline.expired():
+                deadline.skipped.add(keyword)  # may have been cut before its last page
+            elif timings is not None:
+                crawl_planner.update_timing(
+                    timings, keyword, time.monotonic() - started,
+                    asr.RUN_REPORT.keyword_pages.get(keyword, 0),  # pages actually ranked
+                )
+    except asr.RunCancelled as e:
+        LOGGER.warning(f"Abandoned {keywords[done]}: {e}")
+        if deadline is not None:
+            deadline.skipped.update(keywords[done:])
+    finally:
+        asr.disarm_stop_timer()
+        pool.close()
+    return all_results, serp_rows
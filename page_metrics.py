@@ -0,0 +1,151 @@
+"""Chrome's own numbers for every processed results page.
+
+Python-side timings show how long a page took, not why. For each page this
+records what the browser reports over CDP and the Performance API, so slow
+runs can be split into Amazon page weight vs our own waits:
+
+- navigation timing (TTFB, DOMContentLoaded, load) and the page's age when
+  it was ranked (time since navigation start, i.e. including our waits),
+- bytes transferred for the document and its resources,
+- DOM node count and JS heap (``Performance.getMetrics``),
+- layout count and script/task time spent by the renderer.
+
+Works with a Selenium driver or a ContextSession (both have execute_cdp_cmd).
+"""
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import threading
+import time
+import weakref
+from typing import Any, BinaryIO, Dict, List, Optional
+
+LOGGER = logging.getLogger("amazon_rank_tracker.metrics")
+
+# Chrome keeps 250 resource timings by default; a results page loads more
+RESOURCE_BUFFER_SIZE = 2000
+
+PAGE_TIMING_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0] || {};
+const resources = performance.getEntriesByType('resource');
+let transfer = nav.transferSize || 0;
+for (const r of resources) transfer += r.transferSize || 0;
+return {
+    ttfb_ms: nav.responseStart || 0,
+    dom_content_loaded_ms: nav.domContentLoadedEventEnd || 0,
+    load_ms: nav.loadEventEnd || 0,
+    page_age_ms: performance.now(),
+    transfer_bytes: transfer,
+    resource_count: resources.length,
+};
+"""
+
+# Performance.getMetrics name -> PageMetrics field
+CDP_METRICS = {
+    "Nodes": "dom_nodes",
+    "JSHeapUsedSize": "js_heap_used",
+    "JSHeapTotalSize": "js_heap_total",
+    "LayoutCount": "layout_count",
+    "ScriptDuration": "script_seconds",
+    "TaskDuration": "task_seconds",
+}
+
+
+class PageMetrics:
+    """Browser-side measurements of one results page."""
+
+    FIELDS = (
+        "timestamp", "keyword", "page",
+        "ttfb_ms", "dom_content_loaded_ms", "load_ms", "page_age_ms",
+        "transfer_bytes", "resource_count",
+        "dom_nodes", "js_heap_used", "js_heap_total",
+        "layout_count", "script_seconds", "task_seconds",
+    )
+    __slots__ = FIELDS
+
+    def __init__(self, timestamp: int, keyword: str, page: int, **values: float):
+        self.timestamp = timestamp
+        self.keyword = keyword
+        self.page = page
+        for field in self.FIELDS[3:]:
+            setattr(self, field, values.get(field, 0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+def collect_page_metrics(driver, keyword: str, page: int) -> PageMetrics:
+    """Read the current page's browser metrics."""
+    timing = driver.execute_script(PAGE_TIMING_SCRIPT)
+    # Idempotent, and needed per tab (pipeline tabs are separate targets)
+    driver.execute_cdp_cmd("Performance.enable", {})
+    return page_metrics_from(keyword, page, timing, driver.execute_cdp_cmd("Performance.getMetrics", {}))
+
+
+def page_metrics_from(
+    keyword: str, page: int, timing: Optional[Dict[str, float]], result: Dict[str, Any]
+) -> PageMetrics:
+    """PageMetrics from PAGE_TIMING_SCRIPT's value and a Performance.getMetrics result."""
+    values: Dict[str, float] = dict(timing or {})
+    for metric in result.get("metrics", []):
+        field = CDP_METRICS.get(metric.get("name"))
+        if field:
+            values[field] = metric.get("value", 0)
+    for field in ("ttfb_ms", "dom_content_loaded_ms", "load_ms", "page_age_ms",
+                  "script_seconds", "task_seconds"):
+        values[field] = round(float(values.get(field, 0)), 3)
+    for field in ("transfer_bytes", "resource_count", "dom_nodes", "js_heap_used",
+                  "js_heap_total", "layout_count"):
+        values[field] = int(values.get(field, 0))
+    return PageMetrics(int(time.time()), keyword, page, **values)
+
+
+class PageMetricsLog:
+    """Thread-safe collection of PageMetrics for one run."""
+
+    def __init__(self):
+        self.records: List[PageMetrics] = []
+        self._prepared: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def prepare(self, driver) -> None:
+        """Enlarge the resource timing buffer once per browser session.
+
+        Call before the first search page loads. Background tabs opened by
+        --pipeline / --parallel-pages keep Chrome's default buffer, so their
+        resource counts cap at 250.
+        """
+        with self._lock:
+            if driver in self._prepared:
+                return
+            self._prepared.add(driver)
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
+            "source": f"performance.setResourceTimingBufferSize({RESOURCE_BUFFER_SIZE});",
+        })
+
+    def record(self, driver, keyword: str, page: int) -> Optional[PageMetrics]:
+        """Collect and keep the metrics of the page ``driver`` is on; failures only log."""
+        try:
+            self.prepare(driver)
+            metrics = collect_page_metrics(driver, keyword, page)
+        except Exception as e:
+            LOGGER.warning(f"Failed to collect page metrics for {keyword} page {page}: {e}")
+            return None
+        self.add(metrics)
+        return metrics
+
+    def add(self, metrics: PageMetrics) -> None:
+        """Keep metrics collected elsewhere (e.g. by the asyncio orchestrator)."""
+        with self._lock:
+            self.records.append(metrics)
+
+
+def dump_csv(records: List[PageMetrics], stream: BinaryIO) -> None:
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(PageMetrics.FIELDS)
+    for record in records:
+        writer.writerow([getattr(record, field) for field in PageMetrics.FIELDS])
+    text.detach()
@@ -0,0 +1,350 @@
+"""Share-of-voice and rank analytics over the rank history, vectorised with NumPy.
+
+Per keyword and day, for a set of ASINs (each keyword's targets from
+input.csv, or one --asins set for every keyword):
+
+- sponsored / organic share: slots of that type the set held / all slots,
+- mean and median rank of the set's placements,
+- top-N presence: share of the day's scans with the set in the top N,
+- trailing moving averages of these over --window days.
+
+Shares need every card of a page, so the default input is the full-SERP
+files written by --full-serp. The history is loaded once into parallel
+arrays and every metric is a few bincount/lexsort passes over them instead
+of a loop over rows. Binary files (--output-format bin) go straight into
+the arrays with np.frombuffer; CSV/JSONL files are parsed by serp_records.
+
+    python rank_analytics.py --days 90
+    python rank_analytics.py --asins B0DBSF1CZ6 B0DBSB6XY9 --top-n 4 --window 7
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import datetime as dt
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Union
+
+import numpy as np
+
+import rank_history
+import serp_records
+from serp_records import SPONSORED
+
+LOGGER = logging.getLogger("amazon_rank_tracker.analytics")
+
+DEFAULT_TOP_N = 10
+DEFAULT_WINDOW = 7
+
+# serp_records' packed row: timestamp, keyword index, asin index, type, page, rank, organic rank
+BINARY_ROW_DTYPE = np.dtype([
+    ("timestamp", "<i8"), ("keyword", "<u4"), ("asin", "<u4"), ("type", "u1"),
+    ("page", "<u2"), ("rank", "<u4"), ("organic_rank", "<u4"),
+])
+
+# Metrics with a moving average in the report
+AVERAGED = ("sponsored_share", "organic_share", "mean_rank", "median_rank", "top_n_presence")
+
+# Each keyword's own target ASINs, or one set for every keyword
+Targets = Union[Dict[str, Set[str]], Set[str]]
+
+
+def local_utc_offset() -> int:
+    """Seconds east of UTC used to cut timestamps into days (fixed, e.g. JST)."""
+    return int(dt.datetime.now().astimezone().utcoffset().total_seconds())
+
+
+class RankColumns:
+    """Rank rows as parallel arrays; keywords and ASINs are ids into their tables.
+
+    ``scan`` numbers the source file, so (keyword, scan) is one search of a
+    keyword in one run.
+    """
+
+    def __init__(
+        self,
+        keywords: List[str],
+        asins: List[str],
+        keyword: np.ndarray,
+        asin: np.ndarray,
+        scan: np.ndarray,
+        timestamp: np.ndarray,
+        type_code: np.ndarray,
+        rank: np.ndarray,
+    ):
+        self.keywords = keywords
+        self.asins = asins
+        self.keyword = keyword
+        self.asin = asin
+        self.scan = scan
+        self.timestamp = timestamp
+        self.type_code = type_code
+        self.rank = rank
+
+    def __len__(self) -> int:
+        return len(self.rank)
+
+    def days(self, utc_offset: int) -> np.ndarray:
+        """Local day of every row, as days since 1970-01-01."""
+        return (self.timestamp + utc_offset) // 86400
+
+
+def _map_ids(local: np.ndarray, strings: Sequence[str], table: Dict[str, int]) -> np.ndarray:
+    """Translate a file's string-table indexes into ids of the shared ``table``."""
+    used, inverse = np.unique(local, return_inverse=True)
+    ids = np.array([table.setdefault(strings[i], len(table)) for i in used], dtype=np.int32)
+    return ids[inverse]
+
+
+def _file_columns(
+    path: Path, keyword_ids: Dict[str, int], asin_ids: Dict[str, int]
+) -> Dict[str, np.ndarray]:
+    if path.suffix.lower() == ".bin":
+        data = path.read_bytes()
+        strings, offset, n_rows = serp_records.read_binary_header(data, path)
+        table = np.frombuffer(data, BINARY_ROW_DTYPE, count=n_rows, offset=offset)
+        return {
+            "keyword": _map_ids(table["keyword"], strings, keyword_ids),
+            "asin": _map_ids(table["asin"], strings, asin_ids),
+            "timestamp": table["timestamp"].astype(np.int64),
+            "type_code": table["type"].astype(np.int8),
+            "rank": table["rank"].astype(np.int32),
+        }
+    rows = serp_records.read_rows(path)
+    return {
+        "keyword": np.array([keyword_ids.setdefault(r.keyword, len(keyword_ids)) for r in rows],
+                            dtype=np.int32),
+        "asin": np.array([asin_ids.setdefault(r.asin, len(asin_ids)) for r in rows], dtype=np.int32),
+        "timestamp": np.array([r.timestamp for r in rows], dtype=np.int64),
+        "type_code": np.array([r.type_code for r in rows], dtype=np.int8),
+        "rank": np.array([r.rank for r in rows], dtype=np.int32),
+    }
+
+
+def load_columns(paths: Sequence[Path]) -> RankColumns:
+    """Read rank/SERP files (csv, jsonl or bin) into one RankColumns."""
+    keyword_ids: Dict[str, int] = {}
+    asin_ids: Dict[str, int] = {}
+    parts: List[Dict[str, np.ndarray]] = []
+    for path in paths:
+        try:
+            columns = _file_columns(path, keyword_ids, asin_ids)
+        except Exception as e:
+            LOGGER.warning(f"Skipping unreadable history file {path}: {e}")
+            continue
+        columns["scan"] = np.full(len(columns["rank"]), len(parts), dtype=np.int32)
+        parts.append(columns)
+
+    def joined(name: str, dtype) -> np.ndarray:
+        return np.concatenate([part[name] for part in parts]) if parts else np.empty(0, dtype)
+
+    return RankColumns(
+        list(keyword_ids), list(asin_ids),
+        joined("keyword", np.int32), joined("asin", np.int32), joined("scan", np.int32),
+        joined("timestamp", np.int64), joined("type_code", np.int8), joined("rank", np.int32),
+    )
+
+
+def member_mask(columns: RankColumns, targets: Targets) -> np.ndarray:
+    """True for rows whose ASIN is in the keyword's target set."""
+    asin_ids = {asin: index for index, asin in enumerate(columns.asins)}
+    per_keyword = isinstance(targets, dict)
+    wanted_asins = set().union(*targets.values()) if per_keyword else targets
+    # Lookup table by ASIN id: one gather instead of a sort of every row
+    is_target = np.zeros(len(columns.asins), dtype=bool)
+    is_target[[asin_ids[asin] for asin in wanted_asins if asin in asin_ids]] = True
+    member = is_target[columns.asin]
+    if not per_keyword:
+        return member
+
+    # Rows of some target ASIN: keep those whose (keyword id, asin id) pair is wanted
+    n_asins = len(columns.asins)
+    wanted = np.array(sorted(
+        keyword_id * n_asins + asin_ids[asin]
+        for keyword_id, keyword in enumerate(columns.keywords)
+        for asin in targets.get(keyword, ())
+        if asin in asin_ids
+    ), dtype=np.int64)
+    if not len(wanted):
+        return np.zeros(len(columns), dtype=bool)
+    candidates = np.nonzero(member)[0]
+    keys = columns.keyword[candidates].astype(np.int64) * n_asins + columns.asin[candidates]
+    found = wanted[np.minimum(np.searchsorted(wanted, keys), len(wanted) - 1)] == keys
+    member[candidates[~found]] = False
+    return member
+
+
+class DailyMetrics:
+    """Keyword x day matrices; NaN where a metric is undefined (no scan, no slot, no hit)."""
+
+    def __init__(self, keywords: List[str], first_day: int, values: Dict[str, np.ndarray]):
+        self.keywords = keywords
+        self.first_day = first_day
+        self.values = values
+
+    @property
+    def n_days(self) -> int:
+        return self.values["scans"].shape[1]
+
+    def date(self, day_index: int) -> dt.date:
+        return dt.date(1970, 1, 1) + dt.timedelta(days=self.first_day + day_index)
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def daily_metrics(
+    columns: RankColumns,
+    targets: Targets,
+    top_n: int = DEFAULT_TOP_N,
+    utc_offset: Optional[int] = None,
+) -> DailyMetrics:
+    """Share of voice, mean/median rank and top-N presence per keyword and day."""
+    utc_offset = local_utc_offset() if utc_offset is None else utc_offset
+    n_keywords = len(columns.keywords)
+    if not len(columns):
+        return DailyMetrics(columns.keywords, 0, {"scans": np.zeros((n_keywords, 0))})
+
+    days = columns.days(utc_offset)
+    first_day = int(days.min())
+    n_days = int(days.max()) - first_day + 1
+    size = n_keywords * n_days
+    shape = (n_keywords, n_days)
+    # One flat cell per (keyword, day)
+    cell = columns.keyword.astype(np.int64) * n_days + (days - first_day)
+    member = member_mask(columns, targets)
+    sponsored = columns.type_code == SPONSORED
+
+    def count(mask: np.ndarray) -> np.ndarray:
+        return np.bincount(cell[mask], minlength=size).reshape(shape)
+
+    n_scans = int(columns.scan.max()) + 1
+
+    def distinct_scans(mask: np.ndarray) -> np.ndarray:
+        keys = cell[mask] * n_scans + columns.scan[mask]
+        # Files list a keyword's rows together, so drop repeats of the previous
+        # key first and only sort what is left
+        if len(keys):
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        cells = np.unique(keys) // n_scans
+        return np.bincount(cells, minlength=size).reshape(shape)
+
+    values: Dict[str, np.ndarray] = {}
+    everything = np.ones(len(columns), dtype=bool)
+    values["scans"] = distinct_scans(everything)
+    values["sponsored_slots"] = count(sponsored)
+    values["sponsored_held"] = count(sponsored & member)
+    values["organic_slots"] = count(~sponsored)
+    values["organic_held"] = count(~sponsored & member)
+    values["sponsored_share"] = _ratio(values["sponsored_held"], values["sponsored_slots"])
+    values["organic_share"] = _ratio(values["organic_held"], values["organic_slots"])
+
+    held = count(member)
+    rank_sum = np.bincount(cell[member], weights=columns.rank[member], minlength=size)
+    values["mean_rank"] = _ratio(rank_sum.reshape(shape), held)
+
+    # Median: sort the set's ranks by (cell, rank), then index the middle of each cell's run
+    member_cells = cell[member]
+    member_ranks = columns.rank[member]
+    order = np.lexsort((member_ranks, member_cells))
+    sorted_ranks = member_ranks[order]
+    counts = held.ravel()
+    starts = np.cumsum(counts) - counts
+    present = counts > 0
+    median = np.full(size, np.nan)
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    median[present] = (sorted_ranks[low] + sorted_ranks[high]) / 2
+    values["median_rank"] = median.reshape(shape)
+
+    values["top_n_presence"] = _ratio(
+        distinct_scans(member & (columns.rank <= top_n)), values["scans"]
+    )
+    return DailyMetrics(columns.keywords, first_day, values)
+
+
+def moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over the last ``window`` days (rows = keywords), skipping NaN days."""
+    valid = ~np.isnan(values)
+    pad = np.zeros((values.shape[0], 1))
+    sums = np.concatenate([pad, np.cumsum(np.where(valid, values, 0.0), axis=1)], axis=1)
+    counts = np.concatenate([pad, np.cumsum(valid, axis=1)], axis=1)
+    high = np.arange(1, values.shape[1] + 1)
+    low = np.maximum(high - window, 0)
+    return _ratio(sums[:, high] - sums[:, low], counts[:, high] - counts[:, low])
+
+
+def _formatted(values: np.ndarray, fmt: str) -> np.ndarray:
+    text = np.char.mod(fmt, values)
+    return np.where(np.isnan(values), "", text) if values.dtype.kind == "f" else text
+
+
+def write_report(metrics: DailyMetrics, path: Path, window: int = DEFAULT_WINDOW) -> int:
+    """One CSV row per keyword and day with any scan; returns the row count."""
+    values = dict(metrics.values)
+    for name in AVERAGED:
+        if name in values:
+            values[f"{name}_ma{window}"] = moving_average(values[name], window)
+    keyword_index, day_index = np.nonzero(values["scans"])
+
+    names = list(values)
+    unique_days, day_position = np.unique(day_index, return_inverse=True)
+    dates = np.array([metrics.date(int(day)).isoformat() for day in unique_days], dtype=object)
+    columns = [np.array(metrics.keywords, dtype=object)[keyword_index], dates[day_position]]
+    for name in names:
+        selected = values[name][keyword_index, day_index]
+        columns.append(_formatted(selected, "%.4f" if selected.dtype.kind == "f" else "%d"))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["keyword", "date"] + names)
+        writer.writerows(zip(*columns))
+    return len(keyword_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share of voice and rank analytics per keyword and day")
+    parser.add_argument("files", type=Path, nargs="*",
+                        help="Rank/SERP files (default: recent amazon_serp_* files in @output)")
+    parser.add_argument("--prefix", default="amazon_serp",
+                        help="History file prefix when no files are given")
+    parser.add_argument("--days", type=float, default=30, help="Days of history when no files are given")
+    parser.add_argument("--asins", nargs="+", metavar="ASIN",
+                        help="One ASIN set for every keyword (default: each keyword's targets in --input)")
+    parser.add_argument("--input", type=Path, default=Path("input.csv"), help="Input CSV with the targets")
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N, help="Rank counted as top-N presence")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Moving-average window in days")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Report CSV (default: @output/rank_analytics_YYYYmmdd_HHMMSS.csv)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.asins:
+        targets: Targets = {asin.strip().upper() for asin in args.asins}
+    else:
+        import amazon_search_rank as asr
+        targets = asr.load_targets(args.input)
+    paths = args.files or rank_history.history_files(args.prefix, args.days)
+
+    started = time.perf_counter()
+    columns = load_columns(paths)
+    loaded = time.perf_counter()
+    metrics = daily_metrics(columns, targets, args.top_n)
+    computed = time.perf_counter()
+    output = args.output or rank_history.OUTPUT_DIR / f"rank_analytics_{dt.datetime.now():%Y%m%d_%H%M%S}.csv"
+    written = write_report(metrics, output, args.window)
+    LOGGER.info(
+        f"{len(columns)} rows from {len(paths)} file(s) -> {len(metrics.keywords)} keywords x "
+        f"{metrics.n_days} days; load {loaded - started:.2f}s, metrics {computed - loaded:.2f}s, "
+        f"report {time.perf_counter() - computed:.2f}s"
+    )
+    print(f"Wrote {written} keyword-day rows to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""Long-running daemon mode for the Amazon rank tracker.
+
+Keeps a pool of warm Chrome browsers alive and runs keyword groups on a
+cron-like schedule, so a run no longer pays container start, imports, driver
+download, Chrome launch and location setup every time.
+
+Schedule file (JSON), keyed by the optional GROUP column of input.csv:
+
+    {"default": "0 2 * * *", "daily-top": "*/30 * * * *"}
+
+The group "*" runs every active keyword.
+
+Control socket (127.0.0.1, one line per command, JSON reply):
+
+    run [GROUP]   queue a run of one group (or of every keyword) now
+    status        show queued/active runs
+    stop          end in-flight keywords at the next page, write what runs have so far and exit
+                  (SIGTERM and Ctrl-C do the same)
+"""
+from __future__ import annotations
+
+import csv
+import datetime as dt
+import itertools
+import json
+import logging
+import queue
+import signal
+import socketserver
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import amazon_search_rank as asr
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.daemon")
+
+DEFAULT_GROUP = "default"
+DEFAULT_SCHEDULE = {DEFAULT_GROUP: "0 2 * * *"}
+
+
+# ---------------------------------------------------------------------------
+# Cron expressions
+# ---------------------------------------------------------------------------
+class CronSchedule:
+    """Minimal 5-field cron expression (minute hour day month weekday).
+
+    Supports ``*``, ``*/n``, ``a-b``, ``a-b/n`` and comma lists. Weekday 0 is
+    Sunday; like cron, day-of-month and weekday are OR-ed when both are set.
+    """
+
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(field, low, high)
+            for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        )
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = end = int(part)
+            if start < low or end > high or step < 1:
+                raise ValueError(f"Cron field out of range: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches(self, when: dt.datetime) -> bool:
+        if when.minute not in self.minutes or when.hour not in self.hours:
+            return False
+        if when.month not in self.months:
+            return False
+        day_ok = when.day in self.days
+        weekday_ok = (when.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+
+def load_schedule(path: Path) -> Dict[str, CronSchedule]:
+    """Load the group -> cron mapping, falling back to one daily run."""
+    mapping = DEFAULT_SCHEDULE
+    if path.exists():
+        with path.open("r", encoding="utf-8") as f:
+            mapping = json.load(f)
+    else:
+        LOGGER.info(f"{path} not found; using default schedule {DEFAULT_SCHEDULE}")
+    return {group: CronSchedule(expr) for group, expr in mapping.items()}
+
+
+def load_keyword_groups(input_path: Path) -> Dict[str, Set[str]]:
+    """Map each GROUP of input.csv to its keywords (rows without GROUP go to 'default')."""
+    groups: Dict[str, Set[str]] = {}
+    with input_path.open("r", encoding="utf-8-sig", newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            keyword = (row.get("SEARCH TERM") or "").strip()
+            if keyword:
+                group = (row.get("GROUP") or "").strip() or DEFAULT_GROUP
+                groups.setdefault(group, set()).add(keyword)
+    return groups
+
+
+# ---------------------------------------------------------------------------
+# Runs
+# ---------------------------------------------------------------------------
+class ScheduledRun:
+    """One triggered run of a keyword group; results are written when the last keyword finishes."""
+
+    def __init__(self, run_id: int, group: Optional[str], keywords: List[str]):
+        self.run_id = run_id
+        self.group = group
+        self.keywords = keywords
+        self.remaining = len(keywords)
+        self.results: List[RankRow] = []
+        self.started = dt.datetime.now()
+        self.output_path: Optional[str] = None
+        self.cut: List[str] = []  # keywords stopped before their last page
+        self._lock = threading.Lock()
+
+    def complete_keyword(self, rows: List[RankRow], cut: Optional[str] = None) -> bool:
+        """Record one finished (or ``cut`` short) keyword; returns True when the run is complete."""
+        with self._lock:
+            self.results.extend(rows)
+            if cut is not None:
+                self.cut.append(cut)
+            self.remaining -= 1
+            return self.remaining == 0
+
+    def partial_marker(self, unscraped: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+        """The ``.partial`` marker of a run cut by stop, or None if it completed."""
+        with self._lock:
+            missing = sorted([*unscraped, *self.cut])
+        if not missing:
+            return None
+        return {"reason": "daemon stopped", "unscraped_keywords": missing}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "group": self.group,
+            "keywords": len(self.keywords),
+            "remaining": self.remaining,
+            "rows": len(self.results),
+            "started": self.started.isoformat(timespec="seconds"),
+        }
+
+
+class RankDaemon:
+    """Warm browser pool + cron scheduler + local control socket."""
+
+    def __init__(self, args):
+        self.args = args
+        self.schedule = load_schedule(args.schedule_file)
+        self.jobs: "queue.Queue[tuple]" = queue.Queue()
+        self.stop_event = threading.Event()
+        # Cancelled on stop so in-flight keywords end at the next page boundary
+        self.deadline = asr.RunDeadline()
+        self.active_runs: Dict[int, ScheduledRun] = {}
+        self._run_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+        self._watchdogs: List[asr.BrowserWatchdog] = []
+        self._server: Optional[socketserver.ThreadingTCPServer] = None
+
+    # -- browser pool -------------------------------------------------------
+    def start_workers(self) -> None:
+        for index in range(max(1, self.args.pool_size)):
+            watchdog = asr.BrowserWatchdog(
+                headless=True,
+                max_keywords=self.args.recycle_every,
+                max_memory_mb=self.args.max_browser_mb,
+            )
+            watchdog.warm_up()
+            self._watchdogs.append(watchdog)
+            worker = threading.Thread(
+                target=self._worker_loop, args=(watchdog,), name=f"browser-{index}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+        LOGGER.info(f"{len(self._workers)} warm browser(s) ready.")
+
+    def _worker_loop(self, watchdog: asr.BrowserWatchdog) -> None:
+        while not self.stop_event.is_set():
+            try:
+                run, keyword, asins = self.jobs.get(timeout=1)
+            except queue.Empty:
+                continue
+            rows: List[RankRow] = []
+            try:
+                driver = watchdog.acquire()
+                rows = asr.scrape_for_args(driver, keyword, asins, self.args, deadline=self.deadline)
+            except Exception as e:
+                LOGGER.error(f"Run {run.run_id}: keyword {keyword} failed: {e}")
+            finally:
+                self.jobs.task_done()
+            cut = keyword if self.deadline.expired() else None
+            if run.complete_keyword(rows, cut):
+                self._finish_run(run, run.partial_marker())
+
+    def _finish_run(self, run: ScheduledRun, partial: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            if self.active_runs.pop(run.run_id, None) is None:
+                return  # already flushed at shutdown
+        # The run id keeps runs finishing in the same second from sharing a file name
+        run.output_path = asr.write_results(
+            run.results, prefix=f"amazon_ranks_run{run.run_id}", partial=partial
+        )
+        if asr.VISIBILITY_INDEX is not None:
+            asr.VISIBILITY_INDEX.save()
+        elapsed = (dt.datetime.now() - run.started).total_seconds()
+        LOGGER.info(f"Run {run.run_id} ({run.group or 'all'}) finished in {elapsed:.0f}s.")
+
+    # -- triggering ---------------------------------------------------------
+    def trigger(self, group: Optional[str] = None) -> Dict[str, Any]:
+        """Queue every active keyword of ``group`` (all groups if None)."""
+        with self._lock:
+            for run in self.active_runs.values():
+                if run.group == group:
+                    return {"ok": False, "error": "run already in progress", "run": run.describe()}
+
+        targets = asr.load_targets(asr.INPUT_FILE)
+        if group is not None:
+            members = load_keyword_groups(asr.INPUT_FILE).get(group, set())
+            targets = {k: v for k, v in targets.items() if k in members}
+        if not targets:
+            return {"ok": False, "error": f"no active keywords for group {group!r}"}
+
+        run = ScheduledRun(next(self._run_ids), group, list(targets))
+        with self._lock:
+            self.active_runs[run.run_id] = run
+        for keyword, asins in targets.items():
+            self.jobs.put((run, keyword, asins))
+        LOGGER.info(f"Run {run.run_id} queued: {len(targets)} keywords ({group or 'all'}).")
+        return {"ok": True, "run": run.describe()}
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            runs = [run.describe() for run in self.active_runs.values()]
+        return {
+            "ok": True,
+            "queued_keywords": self.jobs.qsize(),
+            "browsers": len(self._watchdogs),
+            "runs": runs,
+            "schedule": {group: cron.expression for group, cron in self.schedule.items()},
+        }
+
+    def handle_command(self, line: str) -> Dict[str, Any]:
+        parts = line.split()
+        if not parts:
+            return {"ok": False, "error": "empty command"}
+        command, rest = parts[0].lower(), parts[1:]
+        try:
+            if command == "run":
+                return self.trigger(rest[0] if rest else None)
+            if command == "status":
+                return self.status()
+            if command == "stop":
+                self.request_stop("stop command")
+                return {"ok": True, "stopping": True}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": False, "error": f"unknown command {command!r}"}
+
+    # -- control socket -----------------------------------------------------
+    def start_control_socket(self) -> None:
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    reply = daemon.handle_command(raw.decode("utf-8", "replace").strip())
+                    self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+                    if daemon.stop_event.is_set():
+                        break
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", self.args.control_port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="control", daemon=True).start()
+        LOGGER.info(f"Control socket listening on 127.0.0.1:{self.args.control_port}")
+
+    # -- scheduler ----------------------------------------------------------
+    def serve_forever(self) -> None:
+        self.start_workers()
+        self.start_control_socket()
+        last_tick = None
+        while not self.stop_event.is_set():
+            now = dt.datetime.now().replace(second=0, microsecond=0)
+            if now != last_tick:
+                last_tick = now
+                for group, cron in self.schedule.items():
+                    if cron.matches(now):
+                        LOGGER.info(f"Schedule fired for group {group} ({cron.expression}).")
+                        try:
+                            reply = self.trigger(None if group == "*" else group)
+                        except Exception as e:
+                            LOGGER.error(f"Scheduled run of group {group} failed to start: {e}")
+                            continue
+                        if not reply["ok"]:
+                            LOGGER.warning(f"Scheduled run of group {group} not started: {reply['error']}")
+            self.stop_event.wait(timeout=1)
+
+    def request_stop(self, reason: str) -> None:
+        """Stop scheduling and let the workers end their keywords at the next page."""
+        if self.deadline.cancelled is None:
+            self.deadline.cancel(reason)
+        self.stop_event.set()
+
+    def shutdown(self) -> None:
+        self.request_stop("shutdown")
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for worker in self._workers:
+            worker.join(timeout=120)
+        self._flush_partial_runs()
+        for watchdog in self._watchdogs:
+            watchdog.quit()
+        LOGGER.info("Daemon stopped.")
+
+    def _flush_partial_runs(self) -> None:
+        """Write the rows of runs cut short by stop, marked partial with their unscraped keywords."""
+        unscraped: Dict[int, List[str]] = {}
+        while True:
+            try:
+                run, keyword, _ = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            unscraped.setdefault(run.run_id, []).append(keyword)
+            self.jobs.task_done()
+        with self._lock:
+            runs = list(self.active_runs.values())
+        for run in runs:
+            # Queued keywords no worker took, plus keywords stopped mid-way
+            marker = run.partial_marker(unscraped.get(run.run_id, [])) or {
+                "reason": "daemon stopped", "unscraped_keywords": [],
+            }
+            LOGGER.warning(
+                f"Run {run.run_id} stopped with {len(marker['unscraped_keywords'])} keyword(s) unscraped."
+            )
+            self._finish_run(run, marker)
+
+
+def install_signal_handlers(daemon: RankDaemon) -> None:
+    """SIGTERM (docker stop) and Ctrl-C stop the daemon like the ``stop`` command.
+
+    A second Ctrl-C interrupts the drain.
+    """
+    def on_stop(signum, frame):
+        name = signal.Signals(signum).name
+        if daemon.stop_event.is_set():
+            if signum == signal.SIGINT:
+                raise KeyboardInterrupt
+            return
+        LOGGER.warning(f"{name} received; finishing in-flight pages and writing partial runs.")
+        daemon.request_stop(name)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, on_stop)
+
+
+def run_daemon(args) -> None:
+    """Entry point for ``amazon_search_rank.py --daemon``."""
+    daemon = RankDaemon(args)
+    install_signal_handlers(daemon)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        LOGGER.info("Interrupted; shutting down.")
+    finally:
+        daemon.shutdown()
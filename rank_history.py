@@ -0,0 +1,70 @@
+"""Rank history: the rank/SERP files of earlier runs, loaded back as RankRows.
+
+Local runs read @output directly. On Cloud Run the local disk starts empty, so
+cloud_runner downloads recent result files into @output/history first.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import serp_records
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.history")
+
+OUTPUT_DIR = Path("@output")
+HISTORY_DIR = OUTPUT_DIR / "history"
+HISTORY_DAYS = 14
+
+
+def _file_timestamp(path: Path) -> Optional[dt.datetime]:
+    """Parse the YYYYmmdd_HHMMSS stamp that write_results() puts in file names."""
+    parts = path.stem.rsplit("_", 2)
+    try:
+        return dt.datetime.strptime(f"{parts[-2]}_{parts[-1]}", "%Y%m%d_%H%M%S")
+    except (IndexError, ValueError):
+        return None
+
+
+def history_files(
+    prefix: str = "amazon_ranks",
+    days: Optional[float] = HISTORY_DAYS,
+    dirs: Iterable[Path] = (OUTPUT_DIR, HISTORY_DIR),
+    now: Optional[dt.datetime] = None,
+) -> List[Path]:
+    """Result files named ``{prefix}_YYYYmmdd_HHMMSS.*`` from the last ``days`` days, oldest first."""
+    now = now or dt.datetime.now()
+    since = now - dt.timedelta(days=days) if days is not None else None
+    found: Dict[str, Tuple[dt.datetime, Path]] = {}
+    for directory in dirs:
+        if not directory.is_dir():
+            continue
+        for path in directory.glob(f"{prefix}_*"):
+            if path.suffix.lower() not in serp_records.READERS:
+                continue
+            stamp = _file_timestamp(path)
+            if stamp is None or (since is not None and stamp < since):
+                continue
+            # The same file may exist both locally and in history/
+            found.setdefault(path.name, (stamp, path))
+    return [path for _, path in sorted(found.values())]
+
+
+def load_history(
+    prefix: str = "amazon_ranks",
+    days: Optional[float] = HISTORY_DAYS,
+    dirs: Iterable[Path] = (OUTPUT_DIR, HISTORY_DIR),
+) -> List[RankRow]:
+    """Load every row of the recent result files."""
+    rows: List[RankRow] = []
+    paths = history_files(prefix, days, dirs)
+    for path in paths:
+        try:
+            rows.extend(serp_records.read_rows(path))
+        except Exception as e:
+            LOGGER.warning(f"Skipping unreadable history file {path}: {e}")
+    LOGGER.info(f"Loaded {len(rows)} history rows from {len(paths)} file(s).")
+    return rows
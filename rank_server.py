@@ -0,0 +1,217 @@
+"""On-demand rank lookup HTTP API.
+
+Answers "where does ASIN X rank for keyword Y right now?" without editing
+input.csv and running the whole batch:
+
+    python rank_server.py --port 8080
+    curl "http://127.0.0.1:8080/rank?keyword=お食事エプロン&asin=B0DBSF1CZ6"
+
+Every card of every scanned page is cached per (keyword, page). Fresh entries
+are served directly; stale entries are served immediately while a refresh
+runs in the background (stale-while-revalidate). Concurrent requests for the
+same keyword share a single browser fetch.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import amazon_search_rank as asr
+from serp_records import RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.server")
+
+DEFAULT_TTL_SECONDS = 15 * 60
+DEFAULT_STALE_SECONDS = 6 * 60 * 60
+
+
+class CacheEntry:
+    """Every ranked card of one (keyword, page), plus when it was fetched."""
+
+    __slots__ = ("rows", "fetched_at")
+
+    def __init__(self, rows: List[RankRow], fetched_at: float):
+        self.rows = rows
+        self.fetched_at = fetched_at
+
+
+class RankService:
+    """TTL cache of page extractions in front of a small browser pool."""
+
+    def __init__(
+        self,
+        pages: int = asr.MAX_PAGES,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        stale_ttl: float = DEFAULT_STALE_SECONDS,
+        pool_size: int = 1,
+    ):
+        self.pages = pages
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._cache: Dict[Tuple[str, int], CacheEntry] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._watchdogs: List[asr.BrowserWatchdog] = []
+        # Each executor thread owns one browser for its whole life
+        self._executor = ThreadPoolExecutor(max_workers=max(1, pool_size), thread_name_prefix="browser")
+
+    # -- fetching -----------------------------------------------------------
+    def _driver(self):
+        watchdog = getattr(self._local, "watchdog", None)
+        if watchdog is None:
+            watchdog = asr.BrowserWatchdog(headless=True)
+            self._local.watchdog = watchdog
+            with self._lock:
+                self._watchdogs.append(watchdog)
+        return watchdog.acquire()
+
+    def _scrape(self, keyword: str) -> None:
+        reached: Set[int] = set()
+        rows = asr.scrape_keyword(self._driver(), keyword, None, self.pages, pages_reached=reached)
+        if not reached:
+            # Search box missing, CAPTCHA, unexpected page: nothing to cache
+            raise RuntimeError(f"Could not fetch results for {keyword!r}")
+        by_page: Dict[int, List[RankRow]] = {page: [] for page in reached}
+        for row in rows:
+            by_page.setdefault(row.page, []).append(row)
+        now = time.time()
+        with self._lock:
+            for page, page_rows in by_page.items():
+                self._cache[(keyword, page)] = CacheEntry(page_rows, now)
+            self._evict(now)
+        LOGGER.info(f"Cached {len(rows)} cards of {len(reached)} page(s) for {keyword!r}.")
+
+    def _evict(self, now: float) -> None:
+        """Drop entries too old to be served even as stale (caller holds the lock)."""
+        horizon = now - self.ttl - self.stale_ttl
+        for key in [key for key, entry in self._cache.items() if entry.fetched_at < horizon]:
+            del self._cache[key]
+
+    def refresh(self, keyword: str) -> Future:
+        """Start (or join) the browser fetch for ``keyword``."""
+        with self._lock:
+            future = self._inflight.get(keyword)
+            if future is None:
+                future = self._executor.submit(self._scrape, keyword)
+                self._inflight[keyword] = future
+                future.add_done_callback(lambda _f, k=keyword: self._forget(k))
+        return future
+
+    def _forget(self, keyword: str) -> None:
+        with self._lock:
+            self._inflight.pop(keyword, None)
+
+    # -- lookup -------------------------------------------------------------
+    def _entries(self, keyword: str) -> List[Optional[CacheEntry]]:
+        with self._lock:
+            return [self._cache.get((keyword, page)) for page in range(1, self.pages + 1)]
+
+    def lookup(self, keyword: str, asin: str) -> Dict[str, Any]:
+        entries = self._entries(keyword)
+        now = time.time()
+        if all(entries):
+            age = now - min(entry.fetched_at for entry in entries)
+        else:
+            age = None
+
+        if age is not None and age <= self.ttl:
+            status = "hit"
+        elif age is not None and age <= self.ttl + self.stale_ttl:
+            status = "stale"
+            self.refresh(keyword)
+        else:
+            status = "miss"
+            self.refresh(keyword).result()
+            entries = self._entries(keyword)
+            age = 0.0
+
+        matches = [
+            row.to_dict() for entry in entries if entry is not None
+            for row in entry.rows if row.asin == asin
+        ]
+        return {
+            "keyword": keyword,
+            "asin": asin,
+            "found": bool(matches),
+            "pages_scanned": self.pages,
+            "results": matches,
+            "cache": status,
+            "age_seconds": round(age or 0.0, 1),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        for watchdog in self._watchdogs:
+            watchdog.quit()
+
+
+def make_handler(service: RankService):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/healthz":
+                self._reply(200, {"ok": True})
+                return
+            if url.path != "/rank":
+                self._reply(404, {"error": "not found"})
+                return
+            query = parse_qs(url.query)
+            keyword = (query.get("keyword") or [""])[0].strip()
+            asin = (query.get("asin") or [""])[0].strip().upper()
+            if not keyword or not asin:
+                self._reply(400, {"error": "keyword and asin are required"})
+                return
+            try:
+                self._reply(200, service.lookup(keyword, asin))
+            except Exception as e:
+                LOGGER.error(f"Lookup failed for {keyword!r}/{asin}: {e}")
+                self._reply(502, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            LOGGER.info(format % args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Amazon rank lookup HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pages", type=int, default=asr.MAX_PAGES, help="Pages scanned per keyword")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_TTL_SECONDS,
+                        help="Seconds a cached page is served as fresh")
+    parser.add_argument("--stale-ttl", type=float, default=DEFAULT_STALE_SECONDS,
+                        help="Extra seconds a stale page is served while refreshing")
+    parser.add_argument("--pool-size", type=int, default=1, help="Number of browsers")
+    args = parser.parse_args()
+
+    service = RankService(args.pages, args.ttl, args.stale_ttl, args.pool_size)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    LOGGER.info(f"Rank API listening on http://{args.host}:{args.port}/rank")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
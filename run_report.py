@@ -0,0 +1,160 @@
+"""Structured summary of one batch run, for dashboards and alerts.
+
+Counters (keywords attempted/succeeded/failed, pages, CAPTCHAs, location
+resets, screenshots, bytes uploaded) and per-phase duration histograms are
+collected while the run goes and written at the end as JSON and in the
+Prometheus text exposition format (for a node_exporter textfile collector
+or a Pushgateway).
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+METRIC_PREFIX = "amazon_rank"
+
+COUNTERS = {
+    "keywords_attempted": "Keywords whose search was started.",
+    "keywords_succeeded": "Keywords that reached a results or no-results page.",
+    "keywords_failed": "Keywords whose search or first page failed.",
+    "pages_fetched": "Result pages ranked.",
+    "captchas_seen": "CAPTCHA pages encountered.",
+    "location_resets": "Times the delivery location had to be set again.",
+    "screenshots_taken": "Full-page screenshots saved.",
+    "bytes_uploaded": "Bytes of artifacts streamed to the object store.",
+    "rows_written": "Rank rows in the result file.",
+}
+
+# Seconds; covers a 0.1s scroll step up to a multi-minute keyword
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, count) pairs including ``+Inf``."""
+        pairs, running = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            pairs.append((repr(bound), running))
+        pairs.append(("+Inf", self.count))
+        return pairs
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class RunReport:
+    """Thread-safe counters and phase timings of one run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.counters: Dict[str, int] = {name: 0 for name in COUNTERS}
+        self.phases: Dict[str, Histogram] = {}
+        self.info: Dict[str, Any] = {}
+        self.reached_keywords: Dict[str, float] = {}  # keyword -> epoch it last reached a page
+        self.keyword_pages: Dict[str, int] = {}  # keyword -> pages ranked in its last scrape
+        self._lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def keyword_finished(self, keyword: str, reached: bool, pages: int = 0) -> None:
+        """Count a scraped keyword; ``reached``: it got to a results or no-results page.
+
+        ``pages`` is how many result pages were ranked, for per-page timings.
+        """
+        with self._lock:
+            self.keyword_pages[keyword] = pages
+            name = "keywords_succeeded" if reached else "keywords_failed"
+            self.counters[name] = self.counters.get(name, 0) + 1
+            if reached:
+                self.reached_keywords[keyword] = time.time()
+
+    def observe(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a block into the ``name`` histogram (also when it raises)."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start)
+
+    def finish(self, **info: Any) -> None:
+        self.finished = time.time()
+        self.info.update(info)
+
+    # -- export -------------------------------------------------------------
+    def to_dict(self) -> Dict[str, Any]:
+        finished = self.finished or time.time()
+        with self._lock:
+            return {
+                "started": round(self.started, 3),
+                "finished": round(finished, 3),
+                "duration_seconds": round(finished - self.started, 3),
+                **self.info,
+                "counters": dict(self.counters),
+                "phases": {name: h.to_dict() for name, h in sorted(self.phases.items())},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=1)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition: one gauge per counter plus the phase histograms."""
+        report = self.to_dict()
+        lines: List[str] = []
+
+        def gauge(name: str, help_text: str, value: Any) -> None:
+            metric = f"{METRIC_PREFIX}_run_{name}"
+            lines.extend([f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"])
+
+        gauge("timestamp_seconds", "Unix time the run finished.", report["finished"])
+        gauge("duration_seconds", "Wall time of the run.", report["duration_seconds"])
+        gauge("partial", "1 if the run was cut short by a deadline or stop signal.",
+              int(bool(report.get("partial"))))
+        for name, help_text in COUNTERS.items():
+            gauge(name, help_text, report["counters"].get(name, 0))
+
+        metric = f"{METRIC_PREFIX}_phase_duration_seconds"
+        lines.append(f"# HELP {metric} Time spent per phase of keyword processing.")
+        lines.append(f"# TYPE {metric} histogram")
+        for phase, histogram in report["phases"].items():
+            for le, count in histogram["buckets"].items():
+                lines.append(f'{metric}_bucket{{phase="{phase}",le="{le}"}} {count}')
+            lines.append(f'{metric}_sum{{phase="{phase}"}} {histogram["sum"]}')
+            lines.append(f'{metric}_count{{phase="{phase}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
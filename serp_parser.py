@@ -0,0 +1,222 @@
+"""Offline ranking of saved Amazon search-result HTML (no browser).
+
+Re-ranks page snapshots such as the error dumps written by main() and
+set_location_to_tokyo(), producing the same RankRow list as the live
+process_page(). Snapshots have no layout, so document order inside
+.s-main-slot stands in for the live (y, x) order, and the 200px proximity
+rule is replaced by the DOM ancestry it approximates (see
+archive/dom_analysis.txt):
+
+- the card's data-component-type contains "sponsored" (SP ads),
+- the card contains a sponsored label (puis-sponsored-label-text,
+  s-label-popover, aria-label or short "スポンサー"/"Sponsored" text),
+- the card sits inside an AdHolder widget, or inside a main-slot widget
+  whose header carries a sponsored label (SB / video carousels).
+
+Usage:
+    python serp_parser.py error_*.html --workers 8 --output-format jsonl
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from lxml import html as lxml_html
+
+import serp_records
+from serp_records import ORGANIC, SPONSORED, RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.parser")
+
+MAIN_SLOT_XPATH = "//*[contains(concat(' ', normalize-space(@class), ' '), ' s-main-slot ')]"
+CARD_XPATH = ".//*[(self::div or self::li) and @data-asin]"
+SPONSORED_LABEL_XPATH = ".//a[contains(@class, 'puis-sponsored-label-text')]"
+# Same badge selector as get_item_type(): span[aria-label], .s-label-popover
+BADGE_XPATH = ".//span[@aria-label] | .//*[contains(@class, 's-label-popover')]"
+SPONSORED_TEXT_XPATH = (
+    ".//*[not(self::style or self::script)]"
+    "[contains(text(), 'スポンサー') or contains(text(), 'Sponsored')]"
+)
+HIDDEN_XPATH = (
+    "ancestor-or-self::*[@hidden or contains(@class, 'aok-hidden')"
+    " or contains(translate(@style, ' ', ''), 'display:none')]"
+)
+
+
+def _classes(element) -> Set[str]:
+    return set((element.get("class") or "").split())
+
+
+def _has_sponsored_label(element) -> bool:
+    if element.xpath(SPONSORED_LABEL_XPATH):
+        return True
+    for badge in element.xpath(BADGE_XPATH):
+        label = (badge.get("aria-label") or badge.text_content() or "").lower()
+        if "sponsored" in label or "スポンサー" in label:
+            return True
+    for node in element.xpath(SPONSORED_TEXT_XPATH):
+        text = (node.text or "").strip()
+        # Same "short label" rule as the live label cache
+        if text and len(text) < 50:
+            return True
+    return False
+
+
+def _slot_of(card, main_slot):
+    """Return the direct child of .s-main-slot that contains ``card``."""
+    node = card
+    while node.getparent() is not None and node.getparent() is not main_slot:
+        node = node.getparent()
+    return node
+
+
+def get_item_type_offline(card, main_slot, slot_cache: Dict[object, bool]) -> int:
+    """Offline counterpart of get_item_type(); returns an item type code."""
+    component_type = (card.get("data-component-type") or "").lower()
+    if "sponsored" in component_type:
+        return SPONSORED
+    if _has_sponsored_label(card):
+        return SPONSORED
+
+    node = card.getparent()
+    while node is not None and node is not main_slot:
+        if "AdHolder" in _classes(node):
+            return SPONSORED
+        node = node.getparent()
+
+    slot = _slot_of(card, main_slot)
+    if slot is not card:
+        if slot not in slot_cache:
+            slot_cache[slot] = _has_sponsored_label(slot)
+        if slot_cache[slot]:
+            return SPONSORED
+    return ORGANIC
+
+
+def _snapshot_keyword_and_page(root) -> Tuple[str, int]:
+    keyword = "".join(root.xpath("//input[@id='twotabsearchtextbox']/@value")).strip()
+    selected = root.xpath("//*[contains(@class, 's-pagination-selected')]/text()")
+    try:
+        page = int(selected[0].strip()) if selected else 1
+    except ValueError:
+        page = 1
+    return keyword, page
+
+
+def parse_serp_html(
+    html_text: str,
+    keyword: Optional[str] = None,
+    page: Optional[int] = None,
+    target_asins: Optional[Set[str]] = None,
+    cumulative_offset: int = 0,
+    timestamp: Optional[int] = None,
+) -> Tuple[List[RankRow], int]:
+    """Rank the cards of one saved search page, like process_page().
+
+    Keyword and page default to the search box value and the selected
+    pagination link of the snapshot. Returns (rows, items_on_page).
+    """
+    return parse_serp_tree(
+        lxml_html.fromstring(html_text), keyword, page, target_asins, cumulative_offset, timestamp
+    )
+
+
+def parse_serp_tree(
+    root,
+    keyword: Optional[str] = None,
+    page: Optional[int] = None,
+    target_asins: Optional[Set[str]] = None,
+    cumulative_offset: int = 0,
+    timestamp: Optional[int] = None,
+) -> Tuple[List[RankRow], int]:
+    """parse_serp_html() on an already parsed lxml document."""
+    snapshot_keyword, snapshot_page = _snapshot_keyword_and_page(root)
+    keyword = keyword if keyword is not None else snapshot_keyword
+    page = page if page is not None else snapshot_page
+    timestamp = timestamp if timestamp is not None else int(time.time())
+
+    main_slots = root.xpath(MAIN_SLOT_XPATH)
+    if not main_slots:
+        return [], 0
+    main_slot = main_slots[0]
+
+    # Keep the outermost card per ASIN (nested containers repeat the ASIN)
+    unique_cards = []
+    accepted: Dict[object, str] = {}
+    for card in main_slot.xpath(CARD_XPATH):
+        asin = (card.get("data-asin") or "").strip().upper()
+        if not asin or card.xpath(HIDDEN_XPATH):
+            continue
+        if any(accepted.get(parent) == asin for parent in card.iterancestors()):
+            continue
+        accepted[card] = asin
+        unique_cards.append((asin, card))
+
+    results: List[RankRow] = []
+    slot_cache: Dict[object, bool] = {}
+    organic_counter = 0
+    for position, (asin, card) in enumerate(unique_cards, start=1):
+        item_type = get_item_type_offline(card, main_slot, slot_cache)
+        if item_type == ORGANIC:
+            organic_counter += 1
+        if target_asins is None or asin in target_asins:
+            results.append(RankRow(
+                timestamp, keyword, asin, item_type, page,
+                cumulative_offset + position,
+                cumulative_offset + organic_counter if item_type == ORGANIC else 0,
+            ))
+    return results, len(unique_cards)
+
+
+def parse_file(path: Path) -> List[RankRow]:
+    """Rank one snapshot file; the file's mtime becomes the row timestamp."""
+    html_text = path.read_text(encoding="utf-8", errors="replace")
+    rows, _ = parse_serp_html(html_text, timestamp=int(path.stat().st_mtime))
+    return rows
+
+
+def parse_many(paths: List[Path], workers: Optional[int] = None) -> List[RankRow]:
+    """Rank many snapshots in a process pool; failures are logged and skipped."""
+    rows: List[RankRow] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(path, pool.submit(parse_file, path)) for path in paths]
+        for path, future in futures:
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                LOGGER.warning(f"Failed to parse {path}: {e}")
+    return rows
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s][%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Re-rank saved Amazon search-result HTML")
+    parser.add_argument("html", type=Path, nargs="+", help="Saved search-result pages")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--output-dir", type=Path, default=Path("@output"))
+    parser.add_argument("--output-format", choices=sorted(serp_records.WRITERS), default="csv")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    rows = parse_many(args.html, args.workers)
+    LOGGER.info(f"Parsed {len(args.html)} pages into {len(rows)} rows in {time.monotonic() - start:.1f}s.")
+    if rows:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        output_path = args.output_dir / (
+            f"amazon_serp_offline_{dt.datetime.now():%Y%m%d_%H%M%S}.{args.output_format}"
+        )
+        serp_records.WRITERS[args.output_format](rows, output_path)
+        LOGGER.info(f"Saved results to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Pure ranking logic of one results page, on plain data.
+
+process_page() (live WebElements) and rank_items() (batched in-page
+extraction) share these steps, which need no browser and can be
+benchmarked on synthetic pages (benchmarks/bench_ranking.py):
+
+1. sort_items():  reading order, top to bottom then left to right,
+2. dedupe_items(): drop nested containers repeating a card's ASIN,
+3. near_sponsored_label(): the 200px sponsored-label proximity rule,
+4. rank_page():   cumulative rank / organic rank counters.
+"""
+from __future__ import annotations
+
+import bisect
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from serp_records import ORGANIC, SPONSORED, RankRow, SerpItem
+
+MIN_CARD_SIZE = 50
+DEDUP_DISTANCE = 50
+SPONSORED_PROXIMITY_THRESHOLD = 200
+
+
+def sort_items(items: List[SerpItem]) -> None:
+    """Sort cards in place by (y, x)."""
+    items.sort(key=lambda item: (item.y, item.x))
+
+
+def dedupe_items(items: Sequence[SerpItem], distance: float = DEDUP_DISTANCE) -> List[SerpItem]:
+    """Keep the first of cards sharing an ASIN within ``distance`` px on both axes.
+
+    Only cards with the same ASIN are compared, so a page costs O(n) instead
+    of comparing every card with every kept card.
+    """
+    kept_by_asin: Dict[str, List[SerpItem]] = {}
+    unique: List[SerpItem] = []
+    for item in items:
+        kept = kept_by_asin.setdefault(item.asin, [])
+        if any(abs(seen.y - item.y) < distance and abs(seen.x - item.x) < distance for seen in kept):
+            continue
+        kept.append(item)
+        unique.append(item)
+    return unique
+
+
+def near_sponsored_label(
+    y: float, sorted_label_ys: Sequence[float], threshold: float = SPONSORED_PROXIMITY_THRESHOLD
+) -> bool:
+    """True if a sponsored label lies strictly within ``threshold`` px of ``y`` (labels sorted)."""
+    index = bisect.bisect_right(sorted_label_ys, y - threshold)
+    return index < len(sorted_label_ys) and sorted_label_ys[index] < y + threshold
+
+
+def classify_items(
+    items: Sequence[SerpItem],
+    label_ys: Sequence[float],
+    threshold: float = SPONSORED_PROXIMITY_THRESHOLD,
+) -> List[int]:
+    """Type code per card from its in-page hint or a nearby sponsored label."""
+    sorted_ys = sorted(label_ys)
+    return [
+        SPONSORED if item.sponsored_hint or near_sponsored_label(item.y, sorted_ys, threshold)
+        else ORGANIC
+        for item in items
+    ]
+
+
+def rank_page(
+    items: Sequence[SerpItem],
+    type_codes: Sequence[int],
+    keyword: str,
+    page: int,
+    target_asins: Optional[Set[str]],
+    cumulative_offset: int,
+    timestamp: int,
+) -> Tuple[List[RankRow], int]:
+    """Number the deduplicated cards; returns (rows for target ASINs, cards on page).
+
+    ``target_asins=None`` keeps a row for every card.
+    """
+    results: List[RankRow] = []
+    organic_counter = 0
+    for position, (item, type_code) in enumerate(zip(items, type_codes), start=1):
+        if type_code == ORGANIC:
+            organic_counter += 1
+        if target_asins is None or item.asin in target_asins:
+            results.append(RankRow(
+                timestamp, keyword, item.asin, type_code, page,
+                cumulative_offset + position,
+                cumulative_offset + organic_counter if type_code == ORGANIC else 0,
+            ))
+    return results, len(items)
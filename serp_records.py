@@ -0,0 +1,236 @@
+"""Compact record model for search-result (SERP) rows.
+
+process_page() used to build a dict per card, a tuple per seen position and a
+dict with an ISO timestamp string per hit. These slotted classes replace them:
+item types are small integers, the timestamp is an epoch second taken once
+per page, and rows serialise straight to CSV, JSONL or a packed binary file.
+"""
+from __future__ import annotations
+
+import csv
+import datetime as dt
+import io
+import json
+import struct
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+# Item type codes
+ORGANIC = 0
+SPONSORED = 1
+ITEM_TYPES = ("Organic", "Sponsored")
+ITEM_TYPE_CODES = {name: code for code, name in enumerate(ITEM_TYPES)}
+
+CSV_HEADERS = ["timestamp", "keyword", "asin", "type", "page", "rank", "organic_rank"]
+
+BINARY_MAGIC = b"SERP1\n"
+# timestamp, keyword index, asin index, type, page, rank, organic rank
+_BINARY_ROW = struct.Struct("<qIIBHII")
+_STRING_LEN = struct.Struct("<H")
+_COUNT = struct.Struct("<I")
+
+
+class SerpItem:
+    """One visible result card during extraction (position + its live element).
+
+    ``sponsored_hint`` is set when in-page extraction already saw a sponsored
+    component type or badge on the card.
+    """
+
+    __slots__ = ("asin", "x", "y", "element", "sponsored_hint")
+
+    def __init__(
+        self, asin: str, x: float, y: float, element: Any = None, sponsored_hint: bool = False
+    ):
+        self.asin = asin
+        self.x = x
+        self.y = y
+        self.element = element
+        self.sponsored_hint = sponsored_hint
+
+
+class RankRow:
+    """One ranked card: what used to be a result dict."""
+
+    __slots__ = ("timestamp", "keyword", "asin", "type_code", "page", "rank", "organic_rank")
+
+    def __init__(
+        self,
+        timestamp: int,
+        keyword: str,
+        asin: str,
+        type_code: int,
+        page: int,
+        rank: int,
+        organic_rank: int = 0,
+    ):
+        self.timestamp = timestamp  # epoch seconds
+        self.keyword = keyword
+        self.asin = asin
+        self.type_code = type_code
+        self.page = page
+        self.rank = rank
+        self.organic_rank = organic_rank  # 0 = not an organic card
+
+    @property
+    def type(self) -> str:
+        return ITEM_TYPES[self.type_code]
+
+    @property
+    def timestamp_iso(self) -> str:
+        return dt.datetime.fromtimestamp(self.timestamp).isoformat(timespec="seconds")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": self.timestamp_iso,
+            "keyword": self.keyword,
+            "asin": self.asin,
+            "type": self.type,
+            "page": self.page,
+            "rank": self.rank,
+            "organic_rank": self.organic_rank or "",
+        }
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any]) -> "RankRow":
+        """Build a row from a CSV/JSON record in the published column layout."""
+        timestamp = row.get("timestamp") or ""
+        epoch = int(dt.datetime.fromisoformat(timestamp).timestamp()) if timestamp else 0
+        return cls(
+            epoch,
+            row["keyword"],
+            row["asin"],
+            ITEM_TYPE_CODES.get(row["type"], ORGANIC),
+            int(row["page"]),
+            int(row["rank"]),
+            int(row.get("organic_rank") or 0),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"RankRow({self.keyword!r}, {self.asin!r}, {self.type}, "
+            f"page={self.page}, rank={self.rank}, organic_rank={self.organic_rank})"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Serialisation
+# ---------------------------------------------------------------------------
+def _csv_records(rows: Iterable[RankRow]) -> Iterable[List[Any]]:
+    # Rows from one page share a timestamp, so format each epoch only once
+    iso_cache: Dict[int, str] = {}
+    for row in rows:
+        iso = iso_cache.get(row.timestamp)
+        if iso is None:
+            iso = iso_cache[row.timestamp] = row.timestamp_iso
+        yield [iso, row.keyword, row.asin, ITEM_TYPES[row.type_code],
+               row.page, row.rank, row.organic_rank or ""]
+
+
+def _text_stream(stream: BinaryIO) -> io.TextIOWrapper:
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+
+
+def dump_csv(rows: Iterable[RankRow], stream: BinaryIO) -> None:
+    text = _text_stream(stream)
+    writer = csv.writer(text)
+    writer.writerow(CSV_HEADERS)
+    writer.writerows(_csv_records(rows))
+    text.detach()  # leave ``stream`` open for its owner
+
+
+def write_csv(rows: Iterable[RankRow], path: Path) -> None:
+    with path.open("wb") as f:
+        dump_csv(rows, f)
+
+
+def read_csv(path: Path) -> List[RankRow]:
+    with path.open("r", encoding="utf-8", newline="") as f:
+        return [RankRow.from_dict(record) for record in csv.DictReader(f)]
+
+
+def dump_jsonl(rows: Iterable[RankRow], stream: BinaryIO) -> None:
+    text = _text_stream(stream)
+    for record in _csv_records(rows):
+        text.write(json.dumps(dict(zip(CSV_HEADERS, record)), ensure_ascii=False))
+        text.write("\n")
+    text.detach()
+
+
+def write_jsonl(rows: Iterable[RankRow], path: Path) -> None:
+    with path.open("wb") as f:
+        dump_jsonl(rows, f)
+
+
+def read_jsonl(path: Path) -> List[RankRow]:
+    with path.open("r", encoding="utf-8") as f:
+        return [RankRow.from_dict(json.loads(line)) for line in f if line.strip()]
+
+
+def dump_binary(rows: Iterable[RankRow], stream: BinaryIO) -> None:
+    """Packed format: magic, interned string table, fixed-size row records."""
+    rows = list(rows)
+    strings: Dict[str, int] = {}
+    for row in rows:
+        strings.setdefault(row.keyword, len(strings))
+        strings.setdefault(row.asin, len(strings))
+
+    stream.write(BINARY_MAGIC)
+    stream.write(_COUNT.pack(len(strings)))
+    for text in strings:
+        encoded = text.encode("utf-8")
+        stream.write(_STRING_LEN.pack(len(encoded)))
+        stream.write(encoded)
+    stream.write(_COUNT.pack(len(rows)))
+    for row in rows:
+        stream.write(_BINARY_ROW.pack(
+            row.timestamp, strings[row.keyword], strings[row.asin],
+            row.type_code, row.page, row.rank, row.organic_rank,
+        ))
+
+
+def write_binary(rows: Iterable[RankRow], path: Path) -> None:
+    with path.open("wb") as f:
+        dump_binary(rows, f)
+
+
+def read_binary_header(data: bytes, name: Any = "data") -> Tuple[List[str], int, int]:
+    """Parse a binary file's string table: (strings, offset of the first row, row count)."""
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError(f"Not a binary SERP file: {name}")
+    offset = len(BINARY_MAGIC)
+    (n_strings,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    strings: List[str] = []
+    for _ in range(n_strings):
+        (length,) = _STRING_LEN.unpack_from(data, offset)
+        offset += _STRING_LEN.size
+        strings.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    (n_rows,) = _COUNT.unpack_from(data, offset)
+    return strings, offset + _COUNT.size, n_rows
+
+
+def read_binary(path: Path) -> List[RankRow]:
+    data = path.read_bytes()
+    strings, offset, n_rows = read_binary_header(data, path)
+    rows = []
+    for ts, keyword, asin, type_code, page, rank, organic in _BINARY_ROW.iter_unpack(
+        data[offset:offset + n_rows * _BINARY_ROW.size]
+    ):
+        rows.append(RankRow(ts, strings[keyword], strings[asin], type_code, page, rank, organic))
+    return rows
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "bin": write_binary}
+# Same formats written to an open binary stream (e.g. an object-store upload)
+DUMPERS = {"csv": dump_csv, "jsonl": dump_jsonl, "bin": dump_binary}
+READERS = {".csv": read_csv, ".jsonl": read_jsonl, ".bin": read_binary}
+
+
+def read_rows(path: Path) -> List[RankRow]:
+    """Read rows from any supported format, chosen by file suffix."""
+    reader: Optional[Any] = READERS.get(path.suffix.lower())
+    if reader is None:
+        raise ValueError(f"Unsupported SERP file type: {path}")
+    return reader(path)
@@ -0,0 +1,349 @@
+"""Inverted ASIN -> keyword visibility index.
+
+Answers "which keywords does this product appear for, and where?" for every
+ASIN seen on a scanned page, not only the targets, without reading the rank
+history files. process_page() and rank_items() feed each ranked card into it
+as the page is processed; per (ASIN, keyword, day, type) only the best rank
+is kept, so the file grows with distinct placements rather than with runs.
+
+    python amazon_search_rank.py --visibility-index
+    python visibility_index.py B0DBSF1CZ6 --days 7
+    python visibility_index.py --build @output/amazon_serp_*.csv
+
+File layout (little-endian, zlib-compressed after the magic):
+
+    keywords   u32 count, then u16 length + UTF-8 per keyword
+    ASINs      u32 count, then u8 length + UTF-8 + u32 entry count per ASIN
+    entries    (u32 keyword id, u16 day, u16 best rank, u8 type) grouped by
+               ASIN in table order, then sorted by keyword id, day, type
+
+Days count from 1970-01-01 in local time, like the run timestamps. The file
+is rewritten on every save, so it uses zlib level 1; higher levels take
+seconds longer on a large index for little gain.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are only serialised within one process
+    fcntl = None
+
+import serp_records
+from serp_records import ITEM_TYPES, RankRow
+
+LOGGER = logging.getLogger("amazon_rank_tracker.visibility")
+
+INDEX_FILE = Path("@output") / "visibility_index.idx"
+INDEX_MAGIC = b"VIDX1\n"
+MAX_RANK = 0xFFFF
+
+_ENTRY = struct.Struct("<IHHB")
+_COUNT = struct.Struct("<I")
+_KEYWORD_LEN = struct.Struct("<H")
+_ASIN_LEN = struct.Struct("<B")
+_EPOCH = dt.date(1970, 1, 1)
+
+# (keyword, day, type) -> best rank
+Placements = Dict[Tuple[str, int, int], int]
+
+
+def day_number(timestamp: float) -> int:
+    """Local calendar day of a Unix timestamp, as days since 1970-01-01."""
+    return (dt.date.fromtimestamp(timestamp) - _EPOCH).days
+
+
+def day_date(day: int) -> dt.date:
+    return _EPOCH + dt.timedelta(days=day)
+
+
+class Visibility:
+    """Best rank of one ASIN for one keyword, day and card type."""
+
+    __slots__ = ("keyword", "day", "type_code", "rank")
+
+    def __init__(self, keyword: str, day: int, type_code: int, rank: int):
+        self.keyword = keyword
+        self.day = day
+        self.type_code = type_code
+        self.rank = rank
+
+    @property
+    def type(self) -> str:
+        return ITEM_TYPES[self.type_code]
+
+    @property
+    def date(self) -> dt.date:
+        return day_date(self.day)
+
+    def __repr__(self) -> str:
+        return f"Visibility({self.keyword!r}, {self.date}, {self.type}, rank={self.rank})"
+
+
+class IndexFile:
+    """A saved index: string tables parsed, entries left packed until asked for."""
+
+    def __init__(self, keywords: List[str], spans: Dict[str, Tuple[int, int]], entries: bytes):
+        self.keywords = keywords
+        self.spans = spans  # ASIN -> (first entry, entry count)
+        self.entries = entries
+
+    @classmethod
+    def empty(cls) -> "IndexFile":
+        return cls([], {}, b"")
+
+    def raw(self, asin: str) -> bytes:
+        first, count = self.spans.get(asin, (0, 0))
+        return self.entries[first * _ENTRY.size:(first + count) * _ENTRY.size]
+
+    def placements(self, asin: str) -> Placements:
+        keywords = self.keywords
+        return {
+            (keywords[keyword_id], day, type_code): rank
+            for keyword_id, day, rank, type_code in _ENTRY.iter_unpack(self.raw(asin))
+        }
+
+
+def read_index(path: Path) -> IndexFile:
+    """Load an index file; a missing file is an empty index."""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return IndexFile.empty()
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError(f"Not a visibility index: {path}")
+    data = zlib.decompress(data[len(INDEX_MAGIC):])
+
+    offset = 0
+    (n_keywords,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    keywords: List[str] = []
+    for _ in range(n_keywords):
+        (length,) = _KEYWORD_LEN.unpack_from(data, offset)
+        offset += _KEYWORD_LEN.size
+        keywords.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    (n_asins,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    spans: Dict[str, Tuple[int, int]] = {}
+    first = 0
+    for _ in range(n_asins):
+        (length,) = _ASIN_LEN.unpack_from(data, offset)
+        offset += _ASIN_LEN.size
+        asin = data[offset:offset + length].decode("utf-8")
+        offset += length
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        spans[asin] = (first, count)
+        first += count
+    return IndexFile(keywords, spans, data[offset:offset + first * _ENTRY.size])
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on ``path``.lock for a read-merge-write cycle."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+
+def write_index(path: Path, base: IndexFile, updates: Dict[str, Placements]) -> int:
+    """Write ``base`` with ``updates`` merged in (best rank wins); returns the entry count.
+
+    Keyword ids of ``base`` are kept, so untouched ASINs are copied packed.
+    """
+    keywords = list(base.keywords)
+    keyword_ids = {keyword: index for index, keyword in enumerate(keywords)}
+    asin_table: List[Tuple[bytes, int]] = []
+    chunks: List[bytes] = []
+    total = 0
+
+    def add(asin: str, block: bytes) -> None:
+        nonlocal total
+        count = len(block) // _ENTRY.size
+        asin_table.append((asin.encode("utf-8"), count))
+        chunks.append(block)
+        total += count
+
+    for asin in base.spans:
+        if asin not in updates:
+            add(asin, base.raw(asin))
+    for asin, placements in updates.items():
+        merged = base.placements(asin)
+        for key, rank in placements.items():
+            if rank < merged.get(key, MAX_RANK + 1):
+                merged[key] = rank
+        packed = []
+        for (keyword, day, type_code), rank in merged.items():
+            keyword_id = keyword_ids.get(keyword)
+            if keyword_id is None:
+                keyword_id = keyword_ids[keyword] = len(keywords)
+                keywords.append(keyword)
+            packed.append((keyword_id, day, type_code, rank))
+        packed.sort()
+        add(asin, b"".join(_ENTRY.pack(k, day, min(rank, MAX_RANK), t) for k, day, t, rank in packed))
+
+    body = [_COUNT.pack(len(keywords))]
+    for keyword in keywords:
+        encoded = keyword.encode("utf-8")
+        body.append(_KEYWORD_LEN.pack(len(encoded)))
+        body.append(encoded)
+    body.append(_COUNT.pack(len(asin_table)))
+    for encoded, count in asin_table:
+        body.append(_ASIN_LEN.pack(len(encoded)))
+        body.append(encoded)
+        body.append(_COUNT.pack(count))
+    body.extend(chunks)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = path.with_name(path.name + ".tmp")
+    staging.write_bytes(INDEX_MAGIC + zlib.compress(b"".join(body), 1))
+    os.replace(staging, path)
+    return total
+
+
+class VisibilityIndex:
+    """Placements recorded during a run, merged into the index file on save().
+
+    record() is called from every browser thread, so it only touches an
+    in-memory dict under a lock; the file is read and rewritten once per run.
+    """
+
+    def __init__(self, path: Path = INDEX_FILE):
+        self.path = path
+        self._pending: Dict[str, Placements] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved: Optional[IndexFile] = None
+
+    def record(
+        self,
+        keyword: str,
+        timestamp: float,
+        asins: Sequence[str],
+        type_codes: Sequence[int],
+        first_rank: int = 1,
+    ) -> None:
+        """Add one page of deduplicated cards in rank order, ``first_rank`` being the first card's rank."""
+        day = day_number(timestamp)
+        with self._lock:
+            pending = self._pending
+            for rank, (asin, type_code) in enumerate(zip(asins, type_codes), start=first_rank):
+                placements = pending.get(asin)
+                if placements is None:
+                    placements = pending[asin] = {}
+                key = (keyword, day, type_code)
+                if rank < placements.get(key, MAX_RANK + 1):
+                    placements[key] = rank
+
+    def add_rows(self, rows: Iterable[RankRow]) -> None:
+        """Add already ranked rows (full-SERP files, parallel pages after rank rebuild)."""
+        with self._lock:
+            pending = self._pending
+            for row in rows:
+                placements = pending.setdefault(row.asin, {})
+                key = (row.keyword, day_number(row.timestamp), row.type_code)
+                if row.rank < placements.get(key, MAX_RANK + 1):
+                    placements[key] = row.rank
+
+    def lookup(self, asin: str, since_day: Optional[int] = None) -> List[Visibility]:
+        """Every placement of ``asin`` (saved and not yet saved), best rank first."""
+        asin = asin.strip().upper()
+        if self._saved is None:
+            self._saved = read_index(self.path)
+        placements = self._saved.placements(asin)
+        with self._lock:
+            for key, rank in self._pending.get(asin, {}).items():
+                if rank < placements.get(key, MAX_RANK + 1):
+                    placements[key] = rank
+        found = [
+            Visibility(keyword, day, type_code, rank)
+            for (keyword, day, type_code), rank in placements.items()
+            if since_day is None or day >= since_day
+        ]
+        found.sort(key=lambda v: (v.rank, -v.day, v.keyword))
+        return found
+
+    def save(self) -> None:
+        """Merge the recorded placements into the index file.
+
+        The file is re-read under an exclusive file lock rather than at
+        start-up, so a daemon or a second run on the same machine that saved
+        in the meantime is not overwritten. Copies synced through object
+        storage (cloud_runner) are last-writer-wins: run one job at a time.
+        """
+        with self._lock:
+            updates, self._pending = self._pending, {}
+        if not updates:
+            return
+        started = time.monotonic()
+        with self._save_lock, locked(self.path):
+            total = write_index(self.path, read_index(self.path), updates)
+            self._saved = None
+        LOGGER.info(
+            f"Visibility index: {len(updates)} ASINs updated, {total} entries "
+            f"({self.path.stat().st_size} bytes) in {time.monotonic() - started:.2f}s"
+        )
+
+
+def prune(path: Path, keep_days: int, today: Optional[dt.date] = None) -> int:
+    """Drop placements older than ``keep_days`` days; returns the entries left."""
+    since = ((today or dt.date.today()) - _EPOCH).days - keep_days
+    with locked(path):
+        base = read_index(path)
+        kept: Dict[str, Placements] = {}
+        for asin in base.spans:
+            placements = {key: rank for key, rank in base.placements(asin).items() if key[1] > since}
+            if placements:
+                kept[asin] = placements
+        # Rebuilt from scratch so unused keywords leave the table too
+        return write_index(path, IndexFile.empty(), kept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Where does an ASIN show up in search results?")
+    parser.add_argument("asins", nargs="*", help="ASINs to look up")
+    parser.add_argument("--index", type=Path, default=INDEX_FILE, help="Index file")
+    parser.add_argument("--days", type=int, default=None, help="Only the last N days")
+    parser.add_argument("--build", type=Path, nargs="+", metavar="FILE",
+                        help="Add rank/SERP files (csv/jsonl/bin) to the index first")
+    parser.add_argument("--prune-days", type=int, default=None, metavar="DAYS",
+                        help="Drop placements older than DAYS from the index")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    index = VisibilityIndex(args.index)
+    if args.build:
+        for path in args.build:
+            index.add_rows(serp_records.read_rows(path))
+        index.save()
+    if args.prune_days is not None:
+        LOGGER.info(f"{prune(args.index, args.prune_days)} entries left after pruning")
+
+    since_day = day_number(time.time()) - args.days + 1 if args.days is not None else None
+    for asin in args.asins:
+        found = index.lookup(asin, since_day)
+        print(f"{asin.strip().upper()}: {len(found)} placement(s)")
+        for v in found:
+            print(f"  {v.date}  {v.type:<9}  rank {v.rank:>4}  {v.keyword}")
+    if not args.asins and not args.build and args.prune_days is None:
+        parser.print_usage(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()